@@ -0,0 +1,525 @@
+### end to end latency of the bot's slash commands, with discord, last.fm,
+### spotify and image hosting replaced by local stand-ins
+#
+# usage:
+#   python bench/command_bench.py --concurrency 10 --iterations 5
+#   python bench/command_bench.py --commands "chart albums" overview --lastfm-latency 150
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import requests
+from aiohttp import web
+from PIL import Image
+
+from query_bench import BOT_DIR, Catalog, populate
+
+# discord ids of the benchmarked users, matching populate's numbering
+BENCH_DISCORD_ID: int = 1
+
+
+class StandInServer:
+    """
+    One local http server playing last.fm's json api, spotify's
+    search api and an image host, each with its own added latency.
+    Runs on its own thread so commands that block the bot's event
+    loop can still get responses.
+    """
+
+    def __init__(
+        self, lastfm_latency: float, spotify_latency: float, image_latency: float
+    ):
+        self.lastfm_latency = lastfm_latency
+        self.spotify_latency = spotify_latency
+        self.image_latency = image_latency
+
+        self.base_url: str = None
+        self.request_counts: dict[str, int] = {"lastfm": 0, "spotify": 0, "image": 0}
+
+        image = Image.new("RGB", (300, 300), (200, 80, 120))
+        with io.BytesIO() as buffer:
+            image.save(buffer, "PNG")
+            self.image_bytes: bytes = buffer.getvalue()
+
+    def image_url(self, name: str) -> str:
+        return f"{self.base_url}/img/{zlib.crc32(name.encode())}.png"
+
+    def lastfm_response(self, params: dict) -> dict:
+        """
+        Build a plausible response for the last.fm methods the bot uses.
+        """
+
+        method: str = params.get("method", "").lower()
+        username: str = params.get("user") or params.get("username", "someone")
+        rng = random.Random(zlib.crc32(repr(sorted(params.items())).encode()))
+
+        if method == "user.getinfo":
+            return {
+                "user": {
+                    "name": username,
+                    "playcount": str(rng.randint(1_000, 500_000)),
+                    "image": [
+                        {"size": "extralarge", "#text": self.image_url(username)}
+                    ],
+                }
+            }
+
+        if method == "user.getrecenttracks":
+            limit: int = int(params.get("limit", 50))
+            tracks: list[dict] = []
+            now: int = int(time.time())
+
+            for i in range(limit):
+                title, artist = f"Artist {i} Track {i}", f"Artist {i}"
+                track: dict = {
+                    "name": title,
+                    "artist": {"#text": artist},
+                    "album": {"#text": f"{artist} Album 0"},
+                    "url": f"https://www.last.fm/music/{artist}/_/{title}",
+                    "image": [{"size": "extralarge", "#text": self.image_url(title)}],
+                    "date": {"uts": str(now - 180 * (i + 1))},
+                }
+
+                if i == 0:
+                    track["@attr"] = {"nowplaying": "true"}
+                    del track["date"]
+
+                tracks.append(track)
+
+            return {
+                "recenttracks": {
+                    "track": tracks,
+                    "@attr": {
+                        "user": username,
+                        "page": params.get("page", "1"),
+                        "perPage": str(limit),
+                        "totalPages": "1",
+                        "total": str(limit),
+                    },
+                }
+            }
+
+        if method == "track.getinfo":
+            title: str = params.get("track", "")
+            return {
+                "track": {
+                    "name": title,
+                    "artist": {"name": params.get("artist", "")},
+                    "url": f"https://www.last.fm/music/{params.get('artist', '')}/_/{title}",
+                    "listeners": str(rng.randint(1_000, 100_000)),
+                    "playcount": str(rng.randint(10_000, 1_000_000)),
+                    "userplaycount": str(rng.randint(1, 300)),
+                    "album": {
+                        "title": f"{params.get('artist', '')} Album 0",
+                        "image": [
+                            {"size": "extralarge", "#text": self.image_url(title)}
+                        ],
+                    },
+                }
+            }
+
+        if method == "album.search":
+            album: str = params.get("album", "")
+            return {
+                "results": {
+                    "albummatches": {
+                        "album": [
+                            {
+                                "name": album,
+                                "artist": "Someone",
+                                "url": f"https://www.last.fm/music/Someone/{album}",
+                                "image": [
+                                    {
+                                        "size": "extralarge",
+                                        "#text": self.image_url(album),
+                                    }
+                                ],
+                            }
+                        ]
+                    }
+                }
+            }
+
+        return {"error": 3, "message": "Invalid Method"}
+
+    def spotify_response(self, query: str, search_type: str) -> dict:
+        """
+        Build a spotify search response with one result.
+        """
+
+        images: list[dict] = [{"url": self.image_url(query), "height": 640}]
+
+        if search_type == "artist":
+            return {"artists": {"items": [{"name": query, "images": images}]}}
+
+        if search_type == "album":
+            return {"albums": {"items": [{"name": query, "images": images}]}}
+
+        return {
+            "tracks": {
+                "items": [
+                    {
+                        "name": query,
+                        "album": {"name": f"{query} album", "images": images},
+                    }
+                ]
+            }
+        }
+
+    async def handle_lastfm(self, request: web.Request) -> web.Response:
+        self.request_counts["lastfm"] += 1
+        await asyncio.sleep(self.lastfm_latency)
+
+        params: dict = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+
+        return web.json_response(self.lastfm_response(params))
+
+    async def handle_spotify(self, request: web.Request) -> web.Response:
+        self.request_counts["spotify"] += 1
+        await asyncio.sleep(self.spotify_latency)
+
+        return web.json_response(
+            self.spotify_response(request.query.get("q", ""), request.query.get("type"))
+        )
+
+    async def handle_image(self, request: web.Request) -> web.Response:
+        self.request_counts["image"] += 1
+        await asyncio.sleep(self.image_latency)
+
+        return web.Response(body=self.image_bytes, content_type="image/png")
+
+    def start(self) -> str:
+        """
+        Start serving on a free local port and return the base url.
+        """
+
+        ready = threading.Event()
+
+        def serve() -> None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+
+            app = web.Application()
+            app.router.add_route("*", "/2.0/", self.handle_lastfm)
+            app.router.add_get("/v1/search", self.handle_spotify)
+            app.router.add_get("/img/{name}", self.handle_image)
+
+            runner = web.AppRunner(app, access_log=None)
+            loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            loop.run_until_complete(site.start())
+
+            port: int = site._server.sockets[0].getsockname()[1]
+            self.base_url = f"http://127.0.0.1:{port}"
+            ready.set()
+
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+
+        return self.base_url
+
+
+class FakeAvatar:
+    def __init__(self, url: str):
+        self.url = url
+
+
+class FakeUser:
+    """
+    Just enough of a discord.User for the commands.
+    """
+
+    def __init__(self, discord_id: int, name: str, avatar_url: str):
+        self.id = discord_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{discord_id}>"
+        self.avatar = FakeAvatar(avatar_url)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeCommand:
+    def reset_cooldown(self, ctx) -> None:
+        pass
+
+
+class FakeContext:
+    """
+    Stand-in for discord.ApplicationContext that records what
+    the command responds with instead of sending it.
+    """
+
+    def __init__(self, user: FakeUser, guild_id: int):
+        self.user = user
+        self.author = user
+        self.guild_id = guild_id
+        self.guild = None
+        self.command = FakeCommand()
+        self.responses: list[tuple] = []
+
+    async def defer(self, *args, **kwargs) -> None:
+        pass
+
+    async def respond(self, *args, **kwargs) -> None:
+        self.responses.append((args, kwargs))
+
+    async def send(self, *args, **kwargs) -> None:
+        self.responses.append((args, kwargs))
+
+
+class FakeBot:
+    """
+    Bot object handed to the cog. It never becomes ready, which
+    keeps the status loop from running during the benchmark.
+    """
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.get_running_loop()
+
+    async def wait_until_ready(self) -> None:
+        await asyncio.Event().wait()
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """
+    Return the q-th percentile (0-100) of already sorted values
+    using the nearest rank method.
+    """
+
+    index: int = max(
+        0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1)
+    )
+    return sorted_values[index]
+
+
+def install_stand_ins(base_url: str):
+    """
+    Point spotify and the cog's last.fm facade at the stand-in
+    server, returning a factory for the patched cog.
+    """
+
+    from lfm import LastFM
+    from lfm_api import AsyncLastFM
+    from lfm_client import LastFMClient
+    import spotify
+    import spotipy
+
+    def get_client() -> spotipy.Spotify:
+        client = spotipy.Spotify(auth="bench", requests_timeout=10, retries=0)
+        client.prefix = f"{base_url}/v1/"
+        return client
+
+    spotify.get_client = get_client
+
+    def make_cog() -> LastFM:
+        cog = LastFM(FakeBot())
+        cog.lastfm = AsyncLastFM(LastFMClient("bench", base_url=f"{base_url}/2.0/"))
+        return cog
+
+    return make_cog
+
+
+def get_commands(cog) -> dict:
+    """
+    Map benchmark command names to coroutine factories taking a context.
+    """
+
+    return {
+        "now": lambda ctx: cog.now_listening.callback(cog, ctx, None),
+        "recent": lambda ctx: cog.recent_tracks.callback(cog, ctx, None),
+        "top artists": lambda ctx: cog.top_artists.callback(cog, ctx, None, "overall"),
+        "top tracks": lambda ctx: cog.top_tracks.callback(cog, ctx, None, "7 days"),
+        "top albums": lambda ctx: cog.top_albums.callback(cog, ctx, None, "1 month"),
+        "track": lambda ctx: cog.track_info.callback(
+            cog, ctx, "artist 0 track 1", None, None
+        ),
+        "chart artists": lambda ctx: cog.artist_chart.callback(
+            cog, ctx, None, "overall"
+        ),
+        "chart albums": lambda ctx: cog.album_chart.callback(cog, ctx, None, "overall"),
+        "overview": lambda ctx: cog.overview.callback(cog, ctx, None),
+    }
+
+
+async def run_command(command, name: str, user: FakeUser, guild_id: int):
+    """
+    Invoke a command once and return its finished CommandTimer,
+    holding the time it took, per stage time and query count.
+    """
+
+    from metrics import start_command
+
+    ctx = FakeContext(user, guild_id)
+
+    timer = start_command(name)
+    await command(ctx)
+    timer.stop()
+
+    if not ctx.responses:
+        raise RuntimeError("command finished without responding")
+
+    return timer
+
+
+async def run_benchmarks(
+    args: argparse.Namespace, make_cog, server: StandInServer
+) -> dict:
+    """
+    Run every selected command concurrency times at once, for the
+    given number of iterations, and summarise the latencies.
+    """
+
+    from lfm import guilds
+    import metrics
+
+    # a command going over its declared query budget fails the run
+    metrics.strict_query_budgets = True
+
+    cog = make_cog()
+    commands: dict = get_commands(cog)
+    user = FakeUser(BENCH_DISCORD_ID, f"bench_{args.scrobbles}", server.image_url("me"))
+
+    results: dict[str, dict] = {}
+    for name in args.commands:
+        command = commands[name]
+        latencies: list[float] = []
+        stage_totals: dict[str, float] = {}
+        query_counts: list[int] = []
+
+        # warm up imports, connections and fonts outside the measurements
+        await run_command(command, name, user, guilds[0])
+
+        for _ in range(args.iterations):
+            if args.cold:
+                for cache in (cog.lastfm.now_playing_cache, cog.lastfm.profile_cache):
+                    cache._entries.clear()
+
+            timers: list = await asyncio.gather(
+                *[
+                    run_command(command, name, user, guilds[0])
+                    for _ in range(args.concurrency)
+                ]
+            )
+
+            for timer in timers:
+                latencies.append(timer.elapsed() * 1000)
+                query_counts.append(timer.queries)
+                for stage, seconds in timer.stages.items():
+                    stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+
+        latencies.sort()
+        results[name] = {
+            "invocations": len(latencies),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(latencies[-1], 2),
+            "max_queries": max(query_counts),
+            # mean time per invocation spent in each stage
+            "stages_ms": {
+                stage: round(seconds * 1000 / len(latencies), 2)
+                for stage, seconds in sorted(stage_totals.items())
+            },
+        }
+
+        print(
+            f"{name:<14} p50 {results[name]['p50_ms']:>9.2f} ms"
+            f"  p95 {results[name]['p95_ms']:>9.2f} ms"
+            f"  p99 {results[name]['p99_ms']:>9.2f} ms"
+            f"  {results[name]['max_queries']:>4} queries"
+        )
+        for stage, ms in results[name]["stages_ms"].items():
+            print(f"{'':<14}   {stage:<15} {ms:>9.2f} ms")
+
+    cog.cog_unload()
+    await cog.lastfm.client.close()
+
+    return {
+        "meta": {
+            "concurrency": args.concurrency,
+            "iterations": args.iterations,
+            "scrobbles": args.scrobbles,
+            "cold": args.cold,
+            "latency_ms": {
+                "lastfm": args.lastfm_latency,
+                "spotify": args.spotify_latency,
+                "image": args.image_latency,
+            },
+            "upstream_requests": server.request_counts,
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark slash commands end to end against local stand-ins."
+    )
+    parser.add_argument(
+        "--commands",
+        nargs="+",
+        default=["now", "recent", "top artists", "track", "chart albums", "overview"],
+    )
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--scrobbles", type=int, default=20_000)
+    parser.add_argument("--lastfm-latency", type=float, default=80, help="ms")
+    parser.add_argument("--spotify-latency", type=float, default=60, help="ms")
+    parser.add_argument("--image-latency", type=float, default=40, help="ms")
+    parser.add_argument(
+        "--cold", action="store_true", help="clear last.fm caches before each round"
+    )
+    parser.add_argument("-o", "--output", help="file to write the json report to")
+    args = parser.parse_args()
+
+    server = StandInServer(
+        args.lastfm_latency / 1000,
+        args.spotify_latency / 1000,
+        args.image_latency / 1000,
+    )
+    base_url: str = server.start()
+
+    tmp_dir = tempfile.TemporaryDirectory(prefix="jam_tracker_bench_")
+    db_file: str = os.path.join(tmp_dir.name, "bench.db")
+    os.environ["JAM_TRACKER_DB_URL"] = f"sqlite:///{db_file}"
+
+    # the bot loads its font and modules relative to its own folder
+    os.chdir(BOT_DIR)
+    sys.path.insert(0, BOT_DIR)
+
+    import data_interface
+
+    populate(
+        db_file, Catalog(random.Random(1)), [args.scrobbles], 0, end=int(time.time())
+    )
+    data_interface.rebuild_stats()
+
+    make_cog = install_stand_ins(base_url)
+    report: dict = asyncio.run(run_benchmarks(args, make_cog, server))
+
+    data_interface.engine.dispose()
+    tmp_dir.cleanup()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+### benchmark the cmd_data_helpers queries against synthetic scrobble histories
+#
+# usage:
+#   python bench/query_bench.py --sizes 1000 100000 1000000 --users 2000 -o before.json
+#   python bench/query_bench.py --compare before.json after.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from itertools import accumulate
+from typing import Callable
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+
+# unix time the synthetic histories end at, fixed so runs are comparable
+END_TIMESTAMP: int = 1_700_000_000
+
+
+def zipf_weights(n: int, s: float) -> list[float]:
+    """
+    Return cumulative weights for n ranks following a zipf
+    distribution with exponent s, for use with random.choices.
+    """
+
+    return list(accumulate(1 / (rank**s) for rank in range(1, n + 1)))
+
+
+class Catalog:
+    """
+    A made up music library: zipf distributed artists, each with
+    their own zipf distributed albums and tracks.
+    """
+
+    def __init__(self, rng: random.Random, num_artists: int = 5000):
+        self.rng = rng
+        self.artists: list[str] = [f"Artist {i}" for i in range(num_artists)]
+        self.artist_weights: list[float] = zipf_weights(num_artists, 1.1)
+
+        self.tracks_per_artist: int = 40
+        self.track_weights: list[float] = zipf_weights(self.tracks_per_artist, 0.9)
+
+    def track(self, artist_index: int, track_index: int) -> tuple[str, str, str]:
+        """
+        Return the (title, artist, album) of one of an artist's tracks.
+        """
+
+        artist: str = self.artists[artist_index]
+        album: str = f"{artist} Album {track_index // 10}"
+
+        return (f"{artist} Track {track_index}", artist, album)
+
+    def history(
+        self, num_scrobbles: int, years: float = 5, end: int = END_TIMESTAMP
+    ) -> list[tuple]:
+        """
+        Return num_scrobbles (title, artist, album, lfm_url, unix_timestamp)
+        rows spread over the few years before end, newest first like last.fm.
+        """
+
+        artist_indexes: list[int] = self.rng.choices(
+            range(len(self.artists)), cum_weights=self.artist_weights, k=num_scrobbles
+        )
+        track_indexes: list[int] = self.rng.choices(
+            range(self.tracks_per_artist),
+            cum_weights=self.track_weights,
+            k=num_scrobbles,
+        )
+
+        span: int = int(years * 365 * 24 * 3600)
+        timestamps: list[int] = sorted(
+            (end - self.rng.randrange(span) for _ in range(num_scrobbles)),
+            reverse=True,
+        )
+
+        rows: list[tuple] = []
+        for artist_index, track_index, timestamp in zip(
+            artist_indexes, track_indexes, timestamps
+        ):
+            title, artist, album = self.track(artist_index, track_index)
+            lfm_url: str = f"https://www.last.fm/music/{artist}/_/{title}"
+            rows.append((title, artist, album, lfm_url, timestamp))
+
+        return rows
+
+
+def populate(
+    db_file: str,
+    catalog: Catalog,
+    sizes: list[int],
+    background: int,
+    end: int = END_TIMESTAMP,
+) -> None:
+    """
+    Fill the database with one benchmarked user per size, plus
+    background users with small histories to grow the tables.
+    """
+
+    conn = sqlite3.connect(db_file)
+
+    users: list[tuple[str, int]] = [(f"bench_{size}", size) for size in sizes]
+    users += [
+        (f"background_{i}", catalog.rng.randint(50, 500)) for i in range(background)
+    ]
+
+    for discord_id, (username, num_scrobbles) in enumerate(users, start=1):
+        account_id: int = conn.execute(
+            "INSERT INTO lfm_account (username, scrobble_count) VALUES (?, 0)",
+            (username,),
+        ).lastrowid
+        conn.execute(
+            "INSERT INTO user_account (discord_id, last_fm_user, account_id) VALUES (?, ?, ?)",
+            (discord_id, username, account_id),
+        )
+        conn.executemany(
+            "INSERT INTO scrobble (title, artist, album, lfm_url, unix_timestamp, account_id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (row + (account_id,) for row in catalog.history(num_scrobbles, end=end)),
+        )
+        conn.commit()
+
+    conn.close()
+
+
+def time_call(func: Callable, repeat: int) -> dict:
+    """
+    Run func repeat times and return timing stats in milliseconds.
+    """
+
+    timings: list[float] = []
+    for _ in range(repeat):
+        start: float = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        "runs": repeat,
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def get_git_commit() -> str:
+    """
+    Return the commit the benchmark was run against, if available.
+    """
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=BOT_DIR,
+        ).stdout.strip()
+
+    except OSError:
+        return None
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    """
+    Build the synthetic database, time every public helper against
+    it and return the report.
+    """
+
+    tmp_dir = tempfile.TemporaryDirectory(prefix="jam_tracker_bench_")
+    db_file: str = os.path.join(tmp_dir.name, "bench.db")
+    os.environ["JAM_TRACKER_DB_URL"] = f"sqlite:///{db_file}"
+
+    # spotify only supplies cover art to the helpers, and importing
+    # it would start the whole bot
+    spotify_stub = types.ModuleType("spotify")
+    spotify_stub.get_track_image_url = lambda track, artist: None
+    sys.modules["spotify"] = spotify_stub
+    sys.path.insert(0, BOT_DIR)
+
+    import data_interface
+
+    populate(db_file, Catalog(random.Random(args.seed)), args.sizes, args.users)
+
+    data_interface.rebuild_stats()
+
+    import cmd_data_helpers as helpers
+
+    month_ago: int = END_TIMESTAMP - 30 * 24 * 3600
+    year_ago: int = END_TIMESTAMP - 365 * 24 * 3600
+    results: list[dict] = []
+
+    for discord_id, size in enumerate(args.sizes, start=1):
+        name: str = f"bench_{size}"
+        recent: list = helpers.get_x_recent_tracks(name, 50)
+        keys: list[tuple[str, str]] = [(track.title, track.artist) for track in recent]
+        search_title: str = recent[0].title.lower() if recent else "track"
+
+        with data_interface.Session.begin() as session:
+            account_id: int = (
+                session.query(data_interface.LastFMAccount.id)
+                .filter_by(username=name)
+                .scalar()
+            )
+
+        def track_playcounts():
+            with data_interface.Session.begin() as session:
+                helpers.get_track_playcounts(session, account_id, keys)
+
+        cases: dict[str, Callable] = {
+            "get_x_top_tracks": lambda: helpers.get_x_top_tracks(name, 10),
+            "get_x_top_tracks[1 month]": lambda: helpers.get_x_top_tracks(
+                name, 10, month_ago
+            ),
+            "get_x_top_tracks[12 months]": lambda: helpers.get_x_top_tracks(
+                name, 10, year_ago
+            ),
+            "get_x_top_artists": lambda: helpers.get_x_top_artists(name, 10),
+            "get_x_top_artists[1 month]": lambda: helpers.get_x_top_artists(
+                name, 10, month_ago
+            ),
+            "get_x_top_artists[12 months]": lambda: helpers.get_x_top_artists(
+                name, 10, year_ago
+            ),
+            "get_x_top_albums": lambda: helpers.get_x_top_albums(name, 10),
+            "get_x_top_albums[1 month]": lambda: helpers.get_x_top_albums(
+                name, 10, month_ago
+            ),
+            "get_x_top_albums[12 months]": lambda: helpers.get_x_top_albums(
+                name, 10, year_ago
+            ),
+            "get_x_recent_tracks[5]": lambda: helpers.get_x_recent_tracks(name, 5),
+            "get_x_recent_tracks[50]": lambda: helpers.get_x_recent_tracks(name, 50),
+            "get_track_playcounts[50]": track_playcounts,
+            "get_single_track_info": lambda: helpers.get_single_track_info(
+                discord_id, search_title
+            ),
+            "get_number_user_scrobbles_stored": lambda: data_interface.get_number_user_scrobbles_stored(
+                discord_id
+            ),
+            "get_total_scrobbles": data_interface.get_total_scrobbles,
+            "get_total_users": data_interface.get_total_users,
+        }
+
+        for case, func in cases.items():
+            stats: dict = time_call(func, args.repeat)
+            results.append({"size": size, "case": case, **stats})
+            print(f"{size:>9} {case:<36} {stats['median_ms']:>10.3f} ms")
+
+    data_interface.engine.dispose()
+    tmp_dir.cleanup()
+
+    return {
+        "meta": {
+            "commit": get_git_commit(),
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "sizes": args.sizes,
+            "background_users": args.users,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def compare_reports(old_file: str, new_file: str) -> None:
+    """
+    Print the median change of every case found in both reports.
+    """
+
+    with open(old_file) as f:
+        old: dict = json.load(f)
+    with open(new_file) as f:
+        new: dict = json.load(f)
+
+    old_results: dict = {(r["size"], r["case"]): r for r in old["results"]}
+
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    for result in new["results"]:
+        key = (result["size"], result["case"])
+        if key not in old_results:
+            continue
+
+        before: float = old_results[key]["median_ms"]
+        after: float = result["median_ms"]
+        ratio: float = after / before if before else float("inf")
+
+        print(
+            f"{result['size']:>9} {result['case']:<36} {before:>10.3f} -> {after:>10.3f} ms  ({ratio:.2f}x)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the command data helpers on synthetic data."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="scrobble history sizes to benchmark, one user each",
+    )
+    parser.add_argument(
+        "--users", type=int, default=200, help="background users to add"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", help="file to write the json report to")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    report: dict = run_benchmarks(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+### small in-memory caches shared by the bot's API wrappers
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Cache where every entry expires ttl seconds after it was stored.
+
+    Lookups for a key that is already being fetched wait on that
+    fetch instead of starting their own (single-flight), so any
+    number of concurrent commands for the same key only cause one
+    upstream call.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.coalesced: int = 0
+
+        self._entries: dict[Hashable, tuple[float, Any]] = {}
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Return the cached value for key, or None if it
+        is missing or has expired.
+        """
+
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Store value under key for the next ttl seconds.
+        """
+
+        if len(self._entries) >= self.max_entries:
+            self._prune()
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Drop key from the cache, if present.
+        """
+
+        self._entries.pop(key, None)
+
+    async def get_or_fetch(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Return the cached value for key, otherwise await fetch() and
+        cache its result. Concurrent callers share a single fetch,
+        which runs as its own task so a caller being cancelled (a
+        command timing out) doesn't cancel it for everyone else.
+        """
+
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        if (pending := self._in_flight.get(key)) is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        task: asyncio.Task = asyncio.ensure_future(self._fetch(key, fetch))
+        self._in_flight[key] = task
+
+        # mark as retrieved so asyncio doesn't warn when every caller gave up
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            self.set(key, value)
+            return value
+
+        finally:
+            del self._in_flight[key]
+
+    def hit_rate(self) -> float:
+        """
+        Return the fraction of lookups answered without
+        a new upstream call.
+        """
+
+        total: int = self.hits + self.coalesced + self.misses
+        if total == 0:
+            return 0.0
+
+        return (self.hits + self.coalesced) / total
+
+    def _prune(self) -> None:
+        """
+        Remove expired entries, and the oldest ones
+        if the cache is still full afterwards.
+        """
+
+        now: float = time.monotonic()
+        self._entries = {
+            key: entry for key, entry in self._entries.items() if entry[0] > now
+        }
+
+        while len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
@@ -1,11 +1,22 @@
+import calendar
 import datetime
 
+import numpy as np
 import pylast
-from sqlalchemy import func, desc, and_
+from sqlalchemy import func, desc, and_, text
 
 
-from data_interface import Session, User, Scrobble
-from spotify import get_track_info
+from data_interface import (
+    TALLY_KINDS,
+    Session,
+    User,
+    Scrobble,
+    LastFMAccount,
+    PlayTally,
+)
+from spotify import get_track_image_url
+from rollups import DAY_SECONDS
+from track_search import find_track
 
 
 class StrippedTrack:
@@ -89,102 +100,229 @@ def get_single_track_info(
 ) -> tuple:
     """
     Generates a StrippedTrack obj from info in the database
-    on a singular track. Returns a tuple of the StrippedTrack
-    and a url string to an image of the track's cover art.
+    on a singular track. Returns a tuple of the StrippedTrack,
+    its play count and a url string to an image of the track's
+    cover art.
+
+    The title given is matched against the user's own stored tracks
+    with the local fuzzy index, so spotify is only used for the art.
     """
 
-    # retrieving title and album from spotify so that
-    # they should match in the database
+    with Session.begin() as session:
+        account_id: int = (
+            session.query(User.account_id).filter_by(discord_id=discord_id).scalar()
+        )
 
-    # TODO: make use of album in query
-    try:
-        title, album, image_url = get_track_info(track_title, track_artist)
+        if account_id is None:
+            return None
 
-    except TypeError:
-        return None
+        match: tuple[str, str] = find_track(
+            session, account_id, track_title, track_artist
+        )
 
-    if title is None:
-        return None
+        if match is None:
+            return None
 
-    with Session.begin() as session:
-        user_id_query = (
-            session.query(User.id).filter_by(discord_id=discord_id).subquery()
+        title, artist = match
+
+        track_query = (
+            session.query(Scrobble)
+            .filter_by(account_id=account_id, title=title, artist=artist)
+            .filter(Scrobble.unix_timestamp > (unix_timestamp or 0))
         )
 
-        if unix_timestamp:
-            track_and_playcount: Scrobble = (
-                session.query(Scrobble, func.count(Scrobble.title).label("playcount"))
-                .filter_by(user_id=user_id_query.c.id)
-                .filter(Scrobble.unix_timestamp > unix_timestamp)
-                .filter_by(title=title)
-                .one()
-            )
+        track_plays: int = track_query.count()
+        scrobble: Scrobble = track_query.order_by(desc(Scrobble.unix_timestamp)).first()
 
-        else:
-            track_and_playcount: Scrobble = (
-                session.query(Scrobble, func.count(Scrobble.title).label("playcount"))
-                .filter_by(user_id=user_id_query.c.id)
-                .filter_by(title=title)
-                .one()
-            )
+        stripped_track: StrippedTrack = generate_stripped_track(scrobble, track_plays)
 
-        scrobble, track_plays = track_and_playcount
+    image_url: str = get_track_image_url(title, artist)
 
-        # change return value to a dictionary and use .get() in calling method
-        # if scrobble is None:
-        #     return (None, None, image_url)
+    return (stripped_track, track_plays, image_url)
 
-        stripped_track: StrippedTrack = generate_stripped_track(scrobble, track_plays)
-        return (stripped_track, track_plays, image_url)
+
+# keys per IN-list, keeps each query well under sqlite's bound parameter limit
+PLAYCOUNT_BATCH_SIZE: int = 500
+
+
+def get_track_playcounts(
+    session, account_id: int, keys: list[tuple[str, str]]
+) -> dict[tuple[str, str], int]:
+    """
+    Return how many times each (title, artist) in keys was scrobbled
+    on the given account, read from the account's track tallies one
+    batch of keys at a time, so the cost doesn't grow with the length
+    of its history. Titles and artists compare case-insensitively like
+    the tallies do. Keys with no plays map to 0.
+    """
+
+    unique_keys: list[tuple[str, str]] = list(dict.fromkeys(keys))
+    playcounts: dict[tuple[str, str], int] = dict.fromkeys(unique_keys, 0)
+
+    for i in range(0, len(unique_keys), PLAYCOUNT_BATCH_SIZE):
+        batch: list[tuple[str, str]] = unique_keys[i : i + PLAYCOUNT_BATCH_SIZE]
+
+        # joining on the keys hands back each one as it was asked for,
+        # whatever case the tally has it stored in
+        values: str = ", ".join(f"(:title_{j}, :artist_{j})" for j in range(len(batch)))
+        params: dict = {"account_id": account_id}
+        for j, (title, artist) in enumerate(batch):
+            params[f"title_{j}"] = title
+            params[f"artist_{j}"] = artist
+
+        rows = session.execute(
+            text(
+                f"WITH track_key (title, artist) AS (VALUES {values}) "
+                "SELECT track_key.title, track_key.artist, play_tally.plays "
+                "FROM track_key JOIN play_tally ON play_tally.kind = 'track' "
+                "AND play_tally.artist = track_key.artist "
+                "AND play_tally.name = track_key.title "
+                "AND play_tally.account_id = :account_id"
+            ),
+            params,
+        ).all()
+
+        for title, artist, plays in rows:
+            playcounts[(title, artist)] = plays
+
+    return playcounts
 
 
 def get_x_recent_tracks(lfm_user: str, num_tracks: int) -> list[StrippedTrack]:
     """
-    Retrieve the last five tracks scrobbled by a user from
+    Retrieve the last num_tracks tracks scrobbled by a user from
     the database (assumed to be up to date) as StrippedTrack
-    objects.
+    objects. Play counts for all of them are looked up together.
     """
 
     stripped_tracks: list[StrippedTrack] = []
     with Session.begin() as session:
-        user_id_query = (
-            session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
+        account_id: int = (
+            session.query(LastFMAccount.id)
+            .filter_by(username=lfm_user.lower())
+            .scalar()
         )
 
         tracks: list[Scrobble] = (
             session.query(Scrobble)
+            .filter_by(account_id=account_id)
             .order_by(desc(Scrobble.unix_timestamp))
-            .filter_by(user_id=user_id_query.c.id)
             .limit(num_tracks)
             .all()
         )
 
-        if tracks is None:
-            return None
+        if not tracks:
+            return stripped_tracks
 
-        for track in tracks:
-            user_id_query = (
-                session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
-            )
+        track_plays: dict[tuple[str, str], int] = get_track_playcounts(
+            session, account_id, [(track.title, track.artist) for track in tracks]
+        )
 
-            track_plays = (
-                session.query(Scrobble)
-                .filter_by(user_id=user_id_query.c.id)
-                .filter_by(title=track.title)
-                .count()
+        for track in tracks:
+            track_obj: StrippedTrack = generate_stripped_track(
+                track, track_plays[(track.title, track.artist)]
             )
 
-            track_obj: StrippedTrack = generate_stripped_track(track, track_plays)
-
             stripped_tracks.append(track_obj)
 
     return stripped_tracks
 
 
+def get_month(unix_timestamp: int) -> int:
+    """
+    Return the utc calendar month a unix timestamp falls in, counted
+    the way month_tally counts them.
+    """
+
+    date: datetime.datetime = datetime.datetime.utcfromtimestamp(unix_timestamp)
+    return date.year * 12 + date.month - 1
+
+
+def get_month_start(month: int) -> int:
+    return calendar.timegm((month // 12, month % 12 + 1, 1, 0, 0, 0))
+
+
+def get_top_tallies(
+    lfm_user: str,
+    kind: str,
+    limit: int,
+    after_unix_timestamp: int,
+    before_unix_timestamp: int,
+) -> list[tuple[str, str, int]]:
+    """
+    Return the artist, name and play count of the account's most played
+    artists, albums or tracks (by kind) scrobbled strictly between the
+    two timestamps. Months the range covers whole are read from
+    month_tally, so only the partial months at its ends are counted
+    from scrobble, all in one statement. The whole history is read
+    straight from play_tally.
+    """
+
+    if after_unix_timestamp <= 0 and before_unix_timestamp >= 2147483647:
+        # the whole history, play_tally already has it summed up
+        with Session.begin() as session:
+            return session.execute(
+                text(
+                    "SELECT artist, name, plays FROM play_tally "
+                    "WHERE account_id = (SELECT id FROM lfm_account WHERE username = :lfm_user) "
+                    "AND kind = :kind ORDER BY plays DESC LIMIT :limit"
+                ),
+                {"lfm_user": lfm_user.lower(), "kind": kind, "limit": limit},
+            ).all()
+
+    start: int = after_unix_timestamp + 1
+    end: int = before_unix_timestamp
+
+    # months lying wholly inside [start, end)
+    first_month: int = get_month(start)
+    if get_month_start(first_month) < start:
+        first_month += 1
+    end_month: int = get_month(end)
+
+    # the partial months at each end are counted scrobble by scrobble,
+    # or the whole range is if it doesn't cover a month whole
+    whole: bool = first_month < end_month
+    first_start: int = get_month_start(first_month) if whole else end
+    end_start: int = get_month_start(end_month) if whole else end
+
+    name, condition = TALLY_KINDS[kind]
+
+    # a separate range per end, so each is an index range scan
+    edge_scan: str = (
+        f"SELECT artist, {name} AS name, 1 AS plays FROM scrobble "
+        "WHERE account_id = (SELECT id FROM lfm_account WHERE username = :lfm_user) "
+        f"AND unix_timestamp >= {{}} AND unix_timestamp < {{}}{condition}"
+    )
+
+    with Session.begin() as session:
+        return session.execute(
+            text(
+                "SELECT artist, name, SUM(plays) AS total FROM ("
+                "SELECT artist, name, plays FROM month_tally "
+                "WHERE account_id = (SELECT id FROM lfm_account WHERE username = :lfm_user) "
+                "AND kind = :kind AND month >= :first_month AND month < :end_month "
+                f"UNION ALL {edge_scan.format(':start', ':first_start')} "
+                f"UNION ALL {edge_scan.format(':end_start', ':end')}"
+                ") GROUP BY artist COLLATE NOCASE, name COLLATE NOCASE "
+                "ORDER BY total DESC LIMIT :limit"
+            ),
+            {
+                "lfm_user": lfm_user.lower(),
+                "kind": kind,
+                "first_month": first_month,
+                "end_month": end_month,
+                "start": start,
+                "first_start": first_start,
+                "end_start": end_start,
+                "end": end,
+                "limit": limit,
+            },
+        ).all()
+
+
 def get_x_top_tracks(
     lfm_user: str,
-    # arbitrarily large number to represent no limit if not given a limit
-    num_tracks: int = 10**100,
+    num_tracks: int = -1,  # sqlite takes a negative limit as no limit
     after_unix_timestamp: int = 0,
     before_unix_timestamp: int = 2147483647,  # max unix time
 ) -> list[StrippedTrack]:
@@ -193,51 +331,24 @@ def get_x_top_tracks(
     user has for each song.
     """
 
-    stripped_tracks: list[StrippedTrack] = []
-    with Session.begin() as session:
-        user_id_query = (
-            session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
+    return [
+        StrippedTrack(
+            title=title,
+            artist=artist,
+            album=None,
+            lfm_url=get_track_lfm_link(artist, title),
+            unix_timestamp=None,
+            track_plays=plays,
         )
-
-        tracks: list[Scrobble] = (
-            session.query(Scrobble)
-            .filter_by(user_id=user_id_query.c.id)
-            .filter(Scrobble.unix_timestamp > after_unix_timestamp)
-            .filter(Scrobble.unix_timestamp < before_unix_timestamp)
-            .group_by(Scrobble.title, Scrobble.artist)
-            .order_by(desc(func.count(Scrobble.title)))
-            .limit(num_tracks)
-            .all()
+        for artist, title, plays in get_top_tallies(
+            lfm_user, "track", num_tracks, after_unix_timestamp, before_unix_timestamp
         )
-
-        if tracks is None:
-            return None
-
-        for track in tracks:
-            user_id_query = (
-                session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
-            )
-
-            track_plays = (
-                session.query(Scrobble)
-                .filter_by(user_id=user_id_query.c.id)
-                .filter_by(title=track.title)
-                .filter_by(artist=track.artist)
-                .filter(Scrobble.unix_timestamp > after_unix_timestamp)
-                .filter(Scrobble.unix_timestamp < before_unix_timestamp)
-                .count()
-            )
-
-            track_obj: StrippedTrack = generate_stripped_track(track, track_plays)
-
-            stripped_tracks.append(track_obj)
-
-    return stripped_tracks
+    ]
 
 
 def get_x_top_artists(
     lfm_user: str,
-    num_artists: int = 10**100,
+    num_artists: int = -1,
     after_unix_timestamp: int = 0,
     before_unix_timestamp: int = 2147483647,
 ) -> list[StrippedArtist]:
@@ -246,99 +357,31 @@ def get_x_top_artists(
     user has for each artist.
     """
 
-    stripped_artists: list[StrippedArtist] = []
-    with Session.begin() as session:
-        user_id_query = (
-            session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
-        )
-
-        artists: list[Scrobble] = (
-            session.query(Scrobble)
-            .filter_by(user_id=user_id_query.c.id)
-            .filter(Scrobble.unix_timestamp > after_unix_timestamp)
-            .filter(Scrobble.unix_timestamp < before_unix_timestamp)
-            .group_by(Scrobble.artist)
-            .order_by(desc(func.count(Scrobble.artist)))
-            .limit(num_artists)
-            .all()
+    return [
+        StrippedArtist(artist, plays)
+        for artist, _, plays in get_top_tallies(
+            lfm_user, "artist", num_artists, after_unix_timestamp, before_unix_timestamp
         )
-
-        if artists is None:
-            return None
-
-        for artist in artists:
-            user_id_query = (
-                session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
-            )
-
-            artist_plays = (
-                session.query(Scrobble)
-                .filter_by(user_id=user_id_query.c.id)
-                .filter_by(artist=artist.artist)
-                .filter(Scrobble.unix_timestamp > after_unix_timestamp)
-                .filter(Scrobble.unix_timestamp < before_unix_timestamp)
-                .count()
-            )
-
-            artist_obj: StrippedArtist = StrippedArtist(artist.artist, artist_plays)
-
-            stripped_artists.append(artist_obj)
-
-    return stripped_artists
+    ]
 
 
 def get_x_top_albums(
     lfm_user: str,
-    num_albums: int = 10**100,
+    num_albums: int = -1,
     after_unix_timestamp: int = 0,
     before_unix_timestamp: int = 2147483647,
 ) -> list[StrippedAlbum]:
     """
-    Return top x artists based on number of scrobbles the
-    user has for each artist.
+    Return top x albums based on number of scrobbles the
+    user has for each album.
     """
 
-    stripped_artists: list[StrippedArtist] = []
-    with Session.begin() as session:
-        user_id_query = (
-            session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
+    return [
+        StrippedAlbum(album, artist, plays)
+        for artist, album, plays in get_top_tallies(
+            lfm_user, "album", num_albums, after_unix_timestamp, before_unix_timestamp
         )
-
-        albums: list[Scrobble] = (
-            session.query(Scrobble)
-            .filter_by(user_id=user_id_query.c.id)
-            .filter(Scrobble.unix_timestamp > after_unix_timestamp)
-            .filter(Scrobble.unix_timestamp < before_unix_timestamp)
-            .group_by(Scrobble.album)
-            .order_by(desc(func.count(Scrobble.album)))
-            .limit(num_albums)
-            .all()
-        )
-
-        if albums is None:
-            return None
-
-        for album in albums:
-            user_id_query = (
-                session.query(User.id).filter_by(last_fm_user=lfm_user).subquery()
-            )
-
-            album_plays = (
-                session.query(Scrobble)
-                .filter_by(user_id=user_id_query.c.id)
-                .filter_by(album=album.album)
-                .filter(Scrobble.unix_timestamp > after_unix_timestamp)
-                .filter(Scrobble.unix_timestamp < before_unix_timestamp)
-                .count()
-            )
-
-            album_obj: StrippedAlbum = StrippedAlbum(
-                album.album, album.artist, album_plays
-            )
-
-            stripped_artists.append(album_obj)
-
-    return stripped_artists
+    ]
 
 
 def get_relative_unix_timestamp(period: str) -> int:
@@ -357,6 +400,8 @@ def get_relative_unix_timestamp(period: str) -> int:
         delta = datetime.timedelta(weeks=4)
     elif period == pylast.PERIOD_3MONTHS:
         delta = datetime.timedelta(weeks=12)
+    elif period == pylast.PERIOD_6MONTHS:
+        delta = datetime.timedelta(weeks=26)
     elif period == pylast.PERIOD_12MONTHS:
         delta = datetime.timedelta(weeks=52)
     else:
@@ -368,6 +413,66 @@ def get_relative_unix_timestamp(period: str) -> int:
     return int((datetime.datetime.now() - delta).timestamp())
 
 
+def parse_calendar_period(value: str) -> tuple[datetime.date, datetime.date]:
+    """
+    Parse a day given as 2022-05-17, a month as 2022-05 or a year as
+    2022. Returns the first day of the period and the day after its
+    last. Raises ValueError if value is none of those.
+    """
+
+    parts: list[int] = [int(part) for part in value.strip().split("-")]
+
+    if len(parts) == 1:
+        return datetime.date(parts[0], 1, 1), datetime.date(parts[0] + 1, 1, 1)
+
+    if len(parts) == 2:
+        year, month = parts
+        first: datetime.date = datetime.date(year, month, 1)
+        return first, datetime.date(year + month // 12, month % 12 + 1, 1)
+
+    if len(parts) == 3:
+        day: datetime.date = datetime.date(*parts)
+        return day, day + datetime.timedelta(days=1)
+
+    raise ValueError(f"not a day, month or year: {value!r}")
+
+
+def get_date_range_timestamps(
+    start: str, end: str, tz: datetime.tzinfo
+) -> tuple[int, int]:
+    """
+    Return the unix timestamps just before local midnight starting the
+    start period and at local midnight after the end period, so scrobbles
+    strictly between them fall in the range. Either may be None to leave
+    that side open, and a lone start covers just that day, month or year.
+    Raises ValueError for periods that can't be parsed or are out of order.
+    """
+
+    after: int = 0
+    before: int = 2147483647  # max unix time
+
+    def local_midnight(day: datetime.date) -> int:
+        return int(
+            datetime.datetime(day.year, day.month, day.day, tzinfo=tz).timestamp()
+        )
+
+    if start is not None:
+        first, after_last = parse_calendar_period(start)
+        after = local_midnight(first) - 1
+
+        if end is None:
+            before = local_midnight(after_last)
+
+    if end is not None:
+        before = local_midnight(parse_calendar_period(end)[1])
+
+    # nothing can fall strictly between them unless they're 2s apart
+    if before <= after + 1:
+        raise ValueError("range ends before it starts")
+
+    return after, before
+
+
 def get_discord_relative_timestamp(seconds: int) -> str:
     """
     Takes amount of seconds and returns a string representing a
@@ -400,6 +505,17 @@ def get_album_lfm_link(artist: str, album: str) -> str:
     return f"https://www.last.fm/music/{artist_portion}/{album_portion}"
 
 
+def get_track_lfm_link(artist: str, title: str) -> str:
+    """
+    Construct a link to a track @ last.fm's site.
+    """
+
+    artist_portion: str = "+".join(artist.split(" "))
+    title_portion: str = "+".join(title.split(" "))
+
+    return f"https://www.last.fm/music/{artist_portion}/_/{title_portion}"
+
+
 def retrieve_all_lfm_names() -> list[tuple[str, int]]:
     """
     Return a list of tuples representing each user's
@@ -412,3 +528,138 @@ def retrieve_all_lfm_names() -> list[tuple[str, int]]:
         ).all()
 
         return users
+
+
+def get_all_user_scrobble_counts() -> list[tuple[str, int]]:
+    """
+    Return each user's last.fm username along with
+    how many of their scrobbles are stored.
+    """
+
+    with Session.begin() as session:
+        users: list[tuple[str, int]] = (
+            session.query(User.last_fm_user, LastFMAccount.scrobble_count)
+            .join(User.account)
+            .order_by(User.id)
+            .all()
+        )
+
+        return users
+
+
+def get_play_leaderboard(kind: str, artist: str, name: str = "") -> list[tuple]:
+    """
+    Return the discord id, last.fm username and play count of every
+    user who has played the artist, or the album or track called name
+    by the artist, most plays first. Along with them come the artist
+    and name as stored, since they're matched case-insensitively.
+
+    kind is "artist", "album" or "track".
+    """
+
+    with Session.begin() as session:
+        leaderboard: list[tuple] = (
+            session.query(
+                User.discord_id,
+                User.last_fm_user,
+                PlayTally.plays,
+                PlayTally.artist,
+                PlayTally.name,
+            )
+            .join(PlayTally, PlayTally.account_id == User.account_id)
+            .filter(
+                PlayTally.kind == kind,
+                PlayTally.artist == artist,
+                PlayTally.name == name,
+            )
+            .order_by(desc(PlayTally.plays))
+            .all()
+        )
+
+        return leaderboard
+
+
+def get_account_ids(discord_ids: list[int]) -> dict[int, int]:
+    """
+    Return the last.fm account id linked to each of the discord
+    users, leaving out those without one.
+    """
+
+    account_ids: dict[int, int] = {}
+
+    with Session.begin() as session:
+        for i in range(0, len(discord_ids), PLAYCOUNT_BATCH_SIZE):
+            account_ids.update(
+                session.query(User.discord_id, User.account_id)
+                .filter(
+                    User.discord_id.in_(discord_ids[i : i + PLAYCOUNT_BATCH_SIZE]),
+                    User.account_id.is_not(None),
+                )
+                .all()
+            )
+
+    return account_ids
+
+
+def get_scrobble_timestamps(discord_id: int, unix_timestamp: int = 0) -> np.ndarray:
+    """
+    Return the unix timestamps of the user's scrobbles after the given
+    time as a numpy array. The (account_id, unix_timestamp) index covers
+    the query, and sqlite joins the timestamps into one string numpy
+    parses, so no python object is made per scrobble.
+    """
+
+    with Session.begin() as session:
+        packed: str = session.execute(
+            text(
+                "SELECT group_concat(unix_timestamp) FROM scrobble "
+                "WHERE account_id = "
+                "(SELECT account_id FROM user_account WHERE discord_id = :discord_id) "
+                "AND unix_timestamp > :unix_timestamp"
+            ),
+            {"discord_id": discord_id, "unix_timestamp": unix_timestamp},
+        ).scalar()
+
+    if not packed:
+        return np.empty(0, dtype=np.int64)
+
+    return np.fromstring(packed, dtype=np.int64, sep=",")
+
+
+def get_nth_scrobble(account_id: int, number: int) -> StrippedTrack:
+    """
+    Return the account's scrobble with the given number, counting
+    from its oldest, or None if it has fewer. Running totals over its
+    scrobble_day rows give the day the scrobble fell on, then the
+    (account_id, unix_timestamp) index steps to it within that day.
+    """
+
+    with Session.begin() as session:
+        found: tuple[int, int] = session.execute(
+            text(
+                "SELECT day, total - plays FROM "
+                "(SELECT day, plays, SUM(plays) OVER (ORDER BY day) AS total "
+                "FROM scrobble_day WHERE account_id = :account_id) "
+                "WHERE total >= :number ORDER BY day LIMIT 1"
+            ),
+            {"account_id": account_id, "number": number},
+        ).first()
+
+        if found is None:
+            return None
+
+        day, before = found
+
+        scrobble: Scrobble = (
+            session.query(Scrobble)
+            .filter_by(account_id=account_id)
+            .filter(
+                Scrobble.unix_timestamp >= day * DAY_SECONDS,
+                Scrobble.unix_timestamp < (day + 1) * DAY_SECONDS,
+            )
+            .order_by(Scrobble.unix_timestamp, Scrobble.id)
+            .offset(number - before - 1)
+            .first()
+        )
+
+        return generate_stripped_track(scrobble, None)
@@ -0,0 +1,28 @@
+### settings read from the environment or a .env file
+#
+# kept apart from main, which loads every cog, so the grabber and
+# other tools can read them without starting up the bot
+
+from dotenv import load_dotenv
+
+import os
+
+load_dotenv()
+
+TOKEN = os.getenv("BOT_TOKEN")
+LFM_API_KEY = os.getenv("LASTFM_API_KEY")
+LFM_API_SECRET = os.getenv("LASTFM_API_SECRET")
+# lets the api calls be pointed at a stand-in server, defaults to last.fm
+LFM_API_URL = os.getenv("LASTFM_API_URL")
+LFM_USER = os.getenv("LFM_USER")
+LFM_PASS = os.getenv("LFM_PASS")
+SPOTIPY_CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID")
+SPOTIPY_CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET")
+
+# sync scrobbles inside the bot instead of running data_grabber.py
+IN_BOT_SYNC = os.getenv("IN_BOT_SYNC", "").lower() in ("1", "true", "yes")
+# longest a command waits for the user's scrobbles to sync first
+SYNC_WAIT_MS = int(os.getenv("SYNC_WAIT_MS", 500))
+
+# local port to serve prometheus metrics on, off if unset
+METRICS_PORT = os.getenv("METRICS_PORT")
@@ -1,251 +1,302 @@
-import pylast
-from sqlalchemy import (
-    create_engine,
-)
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-
-import os
-from platform import system
+from sqlalchemy import func
+
+import argparse
+import asyncio
+import threading
 import time
+import traceback
+from typing import Awaitable, Callable
 
-import requests
+import aiohttp
 import schedule
 
 
-from data_interface import (
-    User,
-    Scrobble,
-    get_number_user_scrobbles_stored,
-    get_last_stored_timestamp,
-)
-from main import LFM_API_KEY, LFM_API_SECRET
+from data_interface import LastFMAccount, Scrobble, Session
+from ingest import ScrobbleWriter
+from lfm_client import LastFMClient, LastFMError, RateLimiter, RecentTrack
+from config import LFM_API_KEY, LFM_API_URL
+from wrapped import build_wrapped_reports
+
+# accounts synced at the same time, they all share one rate limit
+ACCOUNT_CONCURRENCY: int = 4
 
-db_path = os.path.join("data", "user_scrobble_data.db")
+# pages fetched at once while importing a whole history
+PAGE_CONCURRENCY: int = 4
 
-# need a ../ on linux to go up one level before going down to data folder
-nav_to_root = "" if "windows" in system().lower() else r"../"
+# requests per second the grabber process sends last.fm in all
+REQUESTS_PER_SECOND: float = 5
 
-engine = create_engine(url=f"sqlite:///{nav_to_root}{db_path}", future=True)
-Base = declarative_base()
+# shared by the syncs and the batch jobs running next to them
+limiter = RateLimiter(REQUESTS_PER_SECOND, burst=5)
 
-Session = sessionmaker(bind=engine)
+# seconds between passes over every account
+SYNC_INTERVAL: int = 60
 
-network = pylast.LastFMNetwork(
-    api_key=LFM_API_KEY,
-    api_secret=LFM_API_SECRET,
-)
+# seconds between reconciliations of every account
+RECONCILE_INTERVAL: int = 24 * 60 * 60
 
 
-def track_to_scrobble(track: dict) -> Scrobble:
+def track_to_row(track: RecentTrack) -> dict:
     """
     Takes a track from last.fm's API
-    and returns a Scrobble object.
+    and returns its scrobble table row.
     """
 
-    try:
-        if track["@attr"]["nowplaying"]:
-            return None
+    return {
+        "title": track.title,
+        "artist": track.artist,
+        "album": track.album,
+        "lfm_url": track.lfm_url,
+        "unix_timestamp": track.unix_timestamp,
+    }
 
-    # key @attr or nowplaying may not be present when track isn't currently playing
-    except KeyError:
-        pass
-    try:
-        title: str = track["name"]
-
-    except TypeError:
-        print(f"failed on {track=}")
-        exit(0)
-    artist: str = track["artist"]["#text"]
-    album: str = track["album"]["#text"]
-    lfm_url: str = track["url"]
-    unix_timestamp: int = int(track["date"]["uts"])
-
-    new_scrobble = Scrobble(
-        title=title,
-        artist=artist,
-        album=album,
-        lfm_url=lfm_url,
-        unix_timestamp=unix_timestamp,
-    )
 
-    return new_scrobble
-
-
-def retrieve_page(
-    lfm_user: str,
-    from_timestamp: int = None,
-    to_timestamp: int = None,
-    page_num: int = 1,
-) -> dict:
+def get_account_last_timestamp(account_id: int) -> int:
     """
-    Retrieve one json page of tracks from last.fm API.
-    Return json in dict form, along with page number.
+    Return the timestamp of the newest scrobble stored
+    for a last.fm account, or None if it has none.
     """
 
-    base_str: str = f"https://ws.audioscrobbler.com/2.0/?method=user.getrecenttracks&api_key={LFM_API_KEY}&limit=200&format=json"
+    with Session.begin() as session:
+        return (
+            session.query(func.max(Scrobble.unix_timestamp))
+            .filter_by(account_id=account_id)
+            .scalar()
+        )
 
-    params: list[str] = []
-    params.append(f"&user={lfm_user}")
-    params.append(f"&page={page_num}")
 
-    if from_timestamp:
-        params.append(f"&from={from_timestamp}")
+def get_account(username: str) -> tuple[int, str, int]:
+    """
+    Return the id, username and stored scrobble count of
+    a last.fm account, or None if it isn't stored.
+    """
 
-    if to_timestamp:
-        params.append(f"&to={from_timestamp}")
+    with Session.begin() as session:
+        return (
+            session.query(
+                LastFMAccount.id, LastFMAccount.username, LastFMAccount.scrobble_count
+            )
+            .filter_by(username=username.lower())
+            .first()
+        )
+
+
+async def update_account_scrobbles(
+    client: LastFMClient,
+    writer: ScrobbleWriter,
+    account_id: int,
+    username: str,
+    local_scrobbles: int,
+) -> bool:
+    """
+    Store every scrobble an account made since the newest one stored,
+    or its whole history if nothing is stored yet. Pages are handed to
+    the writer as they arrive, oldest first, and this returns once
+    they're committed. A sync that fails partway has then stored an
+    unbroken run of the oldest pages, and the next one carries on from
+    there. Returns False if last.fm couldn't be reached or the
+    scrobbles couldn't be stored.
+    """
 
-    data: dict = requests.get(base_str + "".join(params)).json()
+    start_time: float = time.time()
+    print(f"updating {username}")
 
-    # request failed (last.fm api may be down) in this case
-    if data.get("recenttracks", None) is None:
-        return None
+    from_timestamp: int = None
+    if local_scrobbles > 0:
+        last_scrobble_time: int = await asyncio.to_thread(
+            get_account_last_timestamp, account_id
+        )
+        if last_scrobble_time is not None:
+            from_timestamp = last_scrobble_time + 1
 
-    return data
+    # pin the end of the range so pages don't shift as new scrobbles
+    # come in, anything after it is picked up by the next update
+    to_timestamp: int = int(time.time())
 
+    writer.clear_failure(account_id)
 
-def is_page_empty(page: dict) -> bool:
-    """
-    Return True if page has no tracks (is empty),
-    False if page has content.
-    """
+    commits: list[asyncio.Future] = []
+    try:
+        async for page in client.iter_recent_tracks(
+            username,
+            from_timestamp=from_timestamp,
+            to_timestamp=to_timestamp,
+            concurrency=PAGE_CONCURRENCY,
+            oldest_first=True,
+        ):
+            if page.total_pages > 1:
+                print(f"on page {page.page} of {page.total_pages}")
+
+            rows: list[dict] = [
+                track_to_row(track) for track in page.tracks if not track.now_playing
+            ]
+
+            if rows:
+                commits.append(await writer.write(account_id, rows))
 
-    return page["recenttracks"]["@attr"]["total"] == 0
+    # request failed (last.fm api may be down) in this case
+    except (LastFMError, aiohttp.ClientError, asyncio.TimeoutError):
+        print(f"failed to update {username}")
+        traceback.print_exc()
+        await asyncio.gather(*commits, return_exceptions=True)
+        return False
 
+    # the writer already printed the error of any commit that failed
+    errors: list = [
+        error
+        for error in await asyncio.gather(*commits, return_exceptions=True)
+        if error is not None
+    ]
+    if errors:
+        print(f"failed to store {username}'s scrobbles: {errors[0]!r}")
+        return False
 
-def get_current_page(page: dict) -> int:
-    """
-    Return current page of data.
-    """
+    end_time: float = time.time()
+    print(f"stored scrobbles in {end_time-start_time} seconds")
 
-    return int(page["recenttracks"]["@attr"]["page"])
+    return True
 
 
-def get_total_pages(page: dict) -> int:
+def get_linked_accounts() -> list[tuple[int, str, int]]:
     """
-    Return total number of pages of data
-    to retrieve from last.fm API.
+    Return the id, username and stored scrobble count of every
+    account at least one discord user is linked to.
     """
 
-    return int(page["recenttracks"]["@attr"]["totalPages"])
+    with Session.begin() as session:
+        return (
+            session.query(
+                LastFMAccount.id, LastFMAccount.username, LastFMAccount.scrobble_count
+            )
+            .filter(LastFMAccount.users.any())
+            .all()
+        )
 
 
-def get_scrobble_objs_from_page(page: dict) -> None:
+async def update_all_accounts(client: LastFMClient, writer: ScrobbleWriter) -> None:
     """
-    Store all scrobbles returned from one page
-    of the last.fm API.
+    Update every linked account, several at a time over
+    one shared last.fm client and scrobble writer. Accounts
+    shared by several discord users are only updated once,
+    and accounts nobody is linked to anymore are left as they are.
     """
 
-    tracks: list[dict] = page["recenttracks"]["track"]
+    accounts: list[tuple[int, str, int]] = await asyncio.to_thread(get_linked_accounts)
 
-    # no new tracks on page
-    if tracks == []:
-        return []
+    if len(accounts) == 0:
+        print("no users to update")
+        return
 
-    scrobbles: list[Scrobble] = []
+    semaphore = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
 
-    # if there is only one track "tracks" dict may be single track
-    if isinstance(tracks, dict):
-        if "artist" in tracks.keys():
-            if scrobble := track_to_scrobble(tracks):
-                scrobbles.append(scrobble)
+    async def update(account: tuple[int, str, int]) -> None:
+        async with semaphore:
+            await update_account_scrobbles(client, writer, *account)
 
-    # multiple tracks
-    else:
-        for track in tracks:
-            if scrobble := track_to_scrobble(track):
-                scrobbles.append(scrobble)
+    await asyncio.gather(*[update(account) for account in accounts])
 
-    return scrobbles
 
-
-def store_scrobble_objs(lfm_user: str, scrobbles: list[Scrobble]) -> None:
+async def every(
+    seconds: float, job: Callable[[], Awaitable[None]], wait_first: bool = False
+) -> None:
     """
-    Stores all Scrobble objects to given user's scrobble list.
+    Run the job every so many seconds, counted from the start of each
+    run. A run taking longer than that delays the next one rather than
+    overlapping it.
     """
 
-    with Session.begin() as session:
-        user: User = session.query(User).filter_by(last_fm_user=lfm_user).first()
-
-        user.scrobble_entries.extend(scrobbles)
+    if wait_first:
+        await asyncio.sleep(seconds)
 
+    while True:
+        start: float = time.monotonic()
 
-def update_all_user_scrobbles() -> None:
-    """
-    Meant to grab every user's latest listening data.
-    Runs every 5 minutes.
-    """
+        try:
+            await job()
 
-    with Session.begin() as session:
-        users: list[User] = session.query(User).all()
+        except Exception:
+            traceback.print_exc()
 
-        if len(users) == 0:
-            print("no users to update")
+        await asyncio.sleep(max(0, seconds - (time.monotonic() - start)))
 
-        for user in users:
-            start_time: int = time.time()
-            print(f"updating {user.last_fm_user}")
 
-            local_scrobbles: int = get_number_user_scrobbles_stored(user.discord_id)
-            last_scrobble_time: int = get_last_stored_timestamp(user.discord_id)
+async def run_pending_jobs() -> None:
+    schedule.run_pending()
 
-            # need to store all of user's scrobbles
-            if local_scrobbles == 0:
-                page: dict = retrieve_page(user.last_fm_user, page_num=1)
 
-                # request failed
-                if page is None:
-                    continue
+async def run_grabber() -> None:
+    """
+    Sync every linked account each minute and reconcile them once a
+    day, all on one event loop over one last.fm client and scrobble
+    writer, so sqlite only ever has the one writer from here. A
+    reconciliation takes a while, so it runs next to the syncs rather
+    than holding them up. Scheduled batch jobs start from here too.
+    """
 
-                total_pages: int = get_total_pages(page)
+    # imported here, it builds on this module
+    from reconcile import reconcile_accounts
 
-                scrobbles: list[Scrobble] = get_scrobble_objs_from_page(page)
-                store_scrobble_objs(user.last_fm_user, scrobbles)
+    async with LastFMClient(
+        LFM_API_KEY, base_url=LFM_API_URL, limiter=limiter
+    ) as client, ScrobbleWriter() as writer:
+        await asyncio.gather(
+            every(SYNC_INTERVAL, lambda: update_all_accounts(client, writer)),
+            every(
+                RECONCILE_INTERVAL,
+                lambda: reconcile_accounts(client, writer),
+                wait_first=True,
+            ),
+            every(1, run_pending_jobs),
+        )
 
-                for i in range(2, total_pages + 1):
-                    page = retrieve_page(user.last_fm_user, page_num=i)
-                    scrobbles: list[Scrobble] = get_scrobble_objs_from_page(page)
-                    store_scrobble_objs(user.last_fm_user, scrobbles)
 
-            else:
-                page: dict = retrieve_page(
-                    user.last_fm_user, from_timestamp=last_scrobble_time + 1, page_num=1
-                )
+def run_in_background(job: Callable[[], None]) -> Callable[[], None]:
+    """
+    Wrap a batch job so the scheduler starts it on a thread of its own
+    and goes straight back to syncing (or watching the workers)
+    instead of waiting for it. A run still going when the job comes
+    due again is left to finish rather than started twice.
+    """
 
-                if page is None:
-                    continue
+    thread: threading.Thread = None
 
-                total_pages: int = get_total_pages(page)
+    def start() -> None:
+        nonlocal thread
 
-                # no new tracks to store
-                if is_page_empty(page):
-                    continue
+        if thread is not None and thread.is_alive():
+            print(f"{job.__name__} is still running, skipping this run")
+            return
 
-                else:
-                    scrobbles: list[Scrobble] = get_scrobble_objs_from_page(page)
-                    store_scrobble_objs(user.last_fm_user, scrobbles)
+        thread = threading.Thread(target=job, name=job.__name__, daemon=True)
+        thread.start()
 
-                    for i in range(2, total_pages + 1):
-                        print(f"on page {i} of {total_pages}")
-                        page = retrieve_page(
-                            user.last_fm_user,
-                            from_timestamp=last_scrobble_time + 1,
-                            page_num=i,
-                        )
+    return start
 
-                        if page is None:
-                            continue
 
-                        scrobbles: list[Scrobble] = get_scrobble_objs_from_page(page)
-                        store_scrobble_objs(user.last_fm_user, scrobbles)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep stored scrobbles up to date.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="split accounts across this many worker processes",
+    )
+    args = parser.parse_args()
 
-            end_time: int = time.time()
-            print(f"stored scrobbles in {end_time-start_time} seconds")
+    # year in review reports are built here either way, the workers'
+    # supervisor runs pending jobs too. it takes a while, so it runs
+    # alongside the syncs rather than holding them up
+    schedule.every(1).hours.do(run_in_background(build_wrapped_reports))
 
+    if args.workers > 0:
+        from reconcile import reconcile_all_accounts
+        from sync_workers import run_workers
 
-schedule.every(1).minutes.do(update_all_user_scrobbles)
+        # the workers each store their own syncs, reconciliation
+        # gets a writer of its own in the supervisor
+        schedule.every(1).days.do(run_in_background(reconcile_all_accounts))
 
-if __name__ == "__main__":
+        run_workers(args.workers)
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    # not needed when the bot runs its own sync service (IN_BOT_SYNC)
+    asyncio.run(run_grabber())
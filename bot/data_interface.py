@@ -1,24 +1,131 @@
 import traceback
 import discord
 import pylast
-from sqlalchemy import Column, ForeignKey, Integer, String, create_engine, func
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    UniqueConstraint,
+    create_engine,
+    event,
+    func,
+    insert,
+    inspect,
+    text,
+    update,
+)
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 
 import os
+import time
 from platform import system
 from typing import Generator
+from zoneinfo import ZoneInfo
+
+from metrics import record_query
 
 db_path = os.path.join("data", "user_scrobble_data.db")
 
 # need a ../ on linux to go up one level before going down to data folder
 nav_to_root = "" if "windows" in system().lower() else r"../"
 
-engine = create_engine(url=f"sqlite:///{nav_to_root}{db_path}", future=True)
+# JAM_TRACKER_DB_URL lets tools like the benchmarks use a throwaway database
+db_url = os.getenv("JAM_TRACKER_DB_URL", f"sqlite:///{nav_to_root}{db_path}")
+
+# statements taking at least this long are logged with their query plan
+slow_query_ms = float(os.getenv("JAM_TRACKER_SLOW_QUERY_MS", 100))
+
+# milliseconds a connection waits for another's write lock before giving up
+busy_timeout_ms = int(os.getenv("JAM_TRACKER_BUSY_TIMEOUT_MS", 30000))
+
+engine = create_engine(url=db_url, future=True)
 Base = declarative_base()
 
 Session = sessionmaker(bind=engine)
 
 
+@event.listens_for(engine, "connect")
+def configure_connection(dbapi_connection, connection_record):
+    """
+    Write-ahead logging lets the bot, the grabber and its batch jobs
+    read while one of them writes, and the busy timeout makes writers
+    queue for the lock instead of failing with "database is locked".
+    """
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+    cursor.close()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed: float = time.perf_counter() - context._query_start
+    record_query(statement, elapsed)
+
+    if elapsed * 1000 >= slow_query_ms:
+        log_slow_query(cursor, statement, parameters, executemany, elapsed)
+
+
+def log_slow_query(cursor, statement, parameters, executemany, seconds) -> None:
+    """
+    Print a slow statement along with sqlite's plan for running it.
+    """
+
+    print(f"Slow query ({seconds * 1000:.1f}ms): {' '.join(statement.split())}")
+
+    # only plain reads are safe to explain again with the same parameters
+    if executemany or not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return
+
+    # explain on the raw connection so it isn't timed as a query itself
+    try:
+        plan: list[tuple] = cursor.connection.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).fetchall()
+
+    except Exception:
+        traceback.print_exc()
+        return
+
+    for row in plan:
+        print(f"    {row[-1]}")
+
+
+class LastFMAccount(Base):
+    """
+    A last.fm account whose scrobbles are stored. Scrobbles belong
+    to the account rather than a discord user, so several discord
+    users can share one copy and switching accounts keeps history.
+    """
+
+    __tablename__ = "lfm_account"
+
+    id = Column(Integer, primary_key=True)
+    # stored lowercase, last.fm usernames aren't case sensitive
+    username = Column(String, nullable=False, unique=True)
+
+    # running scrobble count, kept in step with scrobble_entries
+    scrobble_count = Column(Integer, nullable=False, default=0)
+
+    # each account can have many scrobble entries
+    scrobble_entries = relationship("Scrobble", back_populates="account")
+
+    # discord users currently linked to this account
+    users = relationship("User", back_populates="account")
+
+    def __repr__(self):
+        return f"LastFMAccount(id={self.id!r}, username={self.username!r}, scrobble_count={self.scrobble_count!r})"
+
+
 class User(Base):
     __tablename__ = "user_account"
 
@@ -26,10 +133,14 @@ class User(Base):
     discord_id = Column(Integer, nullable=False)
     last_fm_user = Column(String, nullable=False)
 
-    # each user can have many scrobble entries
-    scrobble_entries = relationship(
-        "Scrobble", back_populates="user", cascade="all, delete, delete-orphan"
-    )
+    # iana time zone name like "Europe/Berlin" days are counted in, utc if unset
+    timezone = Column(String)
+
+    # indexed so leaderboards can go from an account's tally to its users
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), index=True)
+
+    # each user is linked to the one last.fm account they set
+    account = relationship("LastFMAccount", back_populates="users")
 
     def __repr__(self):
         return f"User(id={self.id!r}, discord_id={self.discord_id!r}, last_fm_user={self.last_fm_user!r})"
@@ -37,6 +148,9 @@ class User(Base):
 
 class Scrobble(Base):
     __tablename__ = "scrobble"
+    __table_args__ = (
+        Index("ix_scrobble_account_timestamp", "account_id", "unix_timestamp"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -46,18 +160,693 @@ class Scrobble(Base):
     lfm_url = Column(String)
     unix_timestamp = Column(Integer, nullable=False)
 
-    user_id = Column(Integer, ForeignKey("user_account.id"))
+    account_id = Column(Integer, ForeignKey("lfm_account.id"))
+
+    # each scrobble belongs to one single last.fm account
+    account = relationship("LastFMAccount", uselist=False)
+
+    def __repr__(self):
+        return f"Scrobble({self.id=!r}, {self.title=!r}, {self.artist=!r}, {self.album=!r}, {self.lfm_url=!r}, {self.unix_timestamp=!r}, {self.account_id=!r})"
+
+
+class GlobalStats(Base):
+    """
+    Single row holding totals across every account and user,
+    updated whenever scrobbles or users are stored.
+    """
+
+    __tablename__ = "global_stats"
+
+    id = Column(Integer, primary_key=True)
+    total_scrobbles = Column(Integer, nullable=False, default=0)
+    total_users = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"GlobalStats(total_scrobbles={self.total_scrobbles!r}, total_users={self.total_users!r})"
+
+
+class KnownTrack(Base):
+    """
+    Each distinct (title, artist) an account has scrobbled. Filled
+    by a trigger on scrobble inserts and mirrored into the
+    track_search full-text index for fuzzy track lookups.
+    """
+
+    __tablename__ = "known_track"
+    __table_args__ = (UniqueConstraint("account_id", "title", "artist"),)
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), nullable=False)
+    title = Column(String, nullable=False)
+    artist = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f"KnownTrack(id={self.id!r}, account_id={self.account_id!r}, title={self.title!r}, artist={self.artist!r})"
+
+
+class PlayTally(Base):
+    """
+    How many times each account has played an artist, album or
+    track, kept up to date by triggers on scrobble inserts so
+    leaderboards across users are one index lookup. name is the
+    album or track title, and empty for artists. Names compare
+    case-insensitively.
+    """
+
+    __tablename__ = "play_tally"
+    __table_args__ = (Index("ix_play_tally_account", "account_id", "kind"),)
+
+    kind = Column(String, primary_key=True)  # "artist", "album" or "track"
+    artist = Column(String(collation="NOCASE"), primary_key=True)
+    name = Column(String(collation="NOCASE"), primary_key=True)
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    plays = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"PlayTally(kind={self.kind!r}, artist={self.artist!r}, name={self.name!r}, account_id={self.account_id!r}, plays={self.plays!r})"
+
+
+class MonthTally(Base):
+    """
+    play_tally split by utc calendar month, kept up to date by the
+    same kind of triggers. Top lists over a date range add up the
+    months the range covers whole and only count scrobbles one by
+    one for the partial months at either end. month counts months
+    since year 0, ie. year * 12 + month - 1.
+    """
+
+    __tablename__ = "month_tally"
+
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    kind = Column(String, primary_key=True)  # "artist", "album" or "track"
+    month = Column(Integer, primary_key=True)
+    artist = Column(String(collation="NOCASE"), primary_key=True)
+    name = Column(String(collation="NOCASE"), primary_key=True)
+    plays = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"MonthTally(account_id={self.account_id!r}, kind={self.kind!r}, month={self.month!r}, artist={self.artist!r}, name={self.name!r}, plays={self.plays!r})"
+
+
+class ScrobbleDay(Base):
+    """
+    How many scrobbles each account has on each utc day, kept up to
+    date by a trigger on scrobble inserts. Running totals over an
+    account's days give every scrobble's number, so finding its nth
+    scrobble reads the day rows and one day of scrobbles. The day's
+    first and last timestamps tell which local days it has scrobbles
+    on in any time zone.
+    """
+
+    __tablename__ = "scrobble_day"
 
-    # each scrobble belongs to one single user
-    # user = relationship("User", uselist=False, cascade="all, delete")
-    user = relationship("User", uselist=False)
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    day = Column(Integer, primary_key=True)  # days since the epoch in utc
+    plays = Column(Integer, nullable=False, default=0)
+    first_timestamp = Column(Integer)
+    last_timestamp = Column(Integer)
 
     def __repr__(self):
-        # return f"Scrobble({self.id=!r}, {self.title=!r}, {self.artist=!r}, {self.album=!r}, {self.lfm_url=!r}, {self.cover_art_url=!r}, {self.unix_timestamp=!r}, {self.user_id=!r})"
-        return f"Scrobble({self.id=!r}, {self.title=!r}, {self.artist=!r}, {self.album=!r}, {self.lfm_url=!r}, {self.unix_timestamp=!r}, {self.user_id=!r})"
+        return f"ScrobbleDay(account_id={self.account_id!r}, day={self.day!r}, plays={self.plays!r})"
+
+
+class ArtistDay(Base):
+    """
+    scrobble_day split by artist, kept up to date by the same kind
+    of trigger, so the days an account listened to an artist are
+    one index range. Artists compare case-insensitively.
+    """
+
+    __tablename__ = "artist_day"
+
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    artist = Column(String(collation="NOCASE"), primary_key=True)
+    day = Column(Integer, primary_key=True)  # days since the epoch in utc
+    plays = Column(Integer, nullable=False, default=0)
+    first_timestamp = Column(Integer)
+    last_timestamp = Column(Integer)
+
+    def __repr__(self):
+        return f"ArtistDay(account_id={self.account_id!r}, artist={self.artist!r}, day={self.day!r}, plays={self.plays!r})"
+
+
+class ReconcileRange(Base):
+    """
+    A range of an account's utc days reconciliation ran out of checks
+    before comparing, picked up first on its next run. end_day isn't
+    part of the range.
+    """
+
+    __tablename__ = "reconcile_range"
+
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    first_day = Column(Integer, primary_key=True)
+    end_day = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"ReconcileRange(account_id={self.account_id!r}, first_day={self.first_day!r}, end_day={self.end_day!r})"
+
+
+class WrappedReport(Base):
+    """
+    An account's year in review, built ahead of time by the grabber's
+    batch job. report is the json the /wrapped embed is made from and
+    image the rendered chart. scrobble_count is how many of the year's
+    scrobbles it was built from, so late ones show it's out of date.
+    """
+
+    __tablename__ = "wrapped_report"
+
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    year = Column(Integer, primary_key=True)
+    scrobble_count = Column(Integer, nullable=False)
+    built_at = Column(Integer, nullable=False)
+    report = Column(String, nullable=False)
+    image = Column(LargeBinary)
+
+    def __repr__(self):
+        return f"WrappedReport(account_id={self.account_id!r}, year={self.year!r}, scrobble_count={self.scrobble_count!r}, built_at={self.built_at!r})"
+
+
+class SyncWorker(Base):
+    """
+    A grabber worker process and the last time it checked in.
+    Workers that stop checking in are left out of the hash ring
+    that splits accounts between workers.
+    """
+
+    __tablename__ = "sync_worker"
+
+    name = Column(String, primary_key=True)
+    heartbeat = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"SyncWorker(name={self.name!r}, heartbeat={self.heartbeat!r})"
+
+
+class SyncLease(Base):
+    """
+    A worker's claim on syncing an account, so no two workers
+    sync it at once. Lapses if the worker stops renewing it.
+    """
+
+    __tablename__ = "sync_lease"
+
+    account_id = Column(Integer, ForeignKey("lfm_account.id"), primary_key=True)
+    worker = Column(String, nullable=False)
+    expires_at = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"SyncLease(account_id={self.account_id!r}, worker={self.worker!r}, expires_at={self.expires_at!r})"
+
+
+def sync_schema() -> None:
+    """
+    Bring tables created by an older version of the bot up to date
+    by adding any columns and indexes the models have gained since.
+    create_all only creates tables that are missing entirely.
+    """
+
+    inspector = inspect(engine)
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing: set[str] = {
+                col["name"] for col in inspector.get_columns(table.name)
+            }
+
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+
+                col_type: str = column.type.compile(dialect=engine.dialect)
+                default: str = ""
+                if column.default is not None and column.default.is_scalar:
+                    default = f" DEFAULT {column.default.arg!r}"
+
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}{default}"
+                    )
+                )
+
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def migrate_user_scrobbles() -> bool:
+    """
+    Move scrobbles stored per discord user (scrobble.user_id) over to
+    their last.fm account. When several discord users had the same
+    account only one copy of its scrobbles is kept. Returns True if
+    anything was migrated.
+    """
+
+    scrobble_columns: set[str] = {
+        col["name"] for col in inspect(engine).get_columns("scrobble")
+    }
+
+    with Session.begin() as session:
+        unlinked: int = session.query(User.id).filter(User.account_id.is_(None)).count()
+
+        if unlinked == 0:
+            return False
+
+        session.execute(
+            text(
+                "INSERT OR IGNORE INTO lfm_account (username, scrobble_count) "
+                "SELECT DISTINCT LOWER(last_fm_user), 0 FROM user_account"
+            )
+        )
+        session.execute(
+            text(
+                "UPDATE user_account SET account_id = "
+                "(SELECT id FROM lfm_account WHERE username = LOWER(user_account.last_fm_user)) "
+                "WHERE account_id IS NULL"
+            )
+        )
+
+        if "user_id" in scrobble_columns:
+            # keep the scrobbles of the first discord user linked to each account
+            session.execute(
+                text(
+                    "UPDATE scrobble SET account_id = "
+                    "(SELECT account_id FROM user_account WHERE id = scrobble.user_id) "
+                    "WHERE account_id IS NULL AND user_id IN "
+                    "(SELECT MIN(id) FROM user_account GROUP BY account_id)"
+                )
+            )
+            session.execute(text("DELETE FROM scrobble WHERE account_id IS NULL"))
+
+        session.execute(text("DROP TABLE IF EXISTS user_stats"))
+
+    return True
 
 
 Base.metadata.create_all(engine)
+sync_schema()
+
+
+def rebuild_stats() -> None:
+    """
+    Recount every account's scrobbles and the global totals from
+    scratch. Only needed when seeding or after a migration.
+    """
+
+    with Session.begin() as session:
+        per_account: dict[int, int] = dict(
+            session.query(Scrobble.account_id, func.count(Scrobble.id))
+            .group_by(Scrobble.account_id)
+            .all()
+        )
+
+        accounts: list[LastFMAccount] = session.query(LastFMAccount).all()
+        for account in accounts:
+            account.scrobble_count = per_account.get(account.id, 0)
+
+        stats: GlobalStats = session.query(GlobalStats).first()
+        if stats is None:
+            stats = GlobalStats()
+            session.add(stats)
+
+        stats.total_scrobbles = sum(per_account.values())
+        stats.total_users = session.query(func.count(User.id)).scalar()
+
+
+def init_stats() -> None:
+    """
+    Seed the stats tables if they have not been filled in yet,
+    ie. on a database created before the stats tables existed.
+    """
+
+    with Session.begin() as session:
+        seeded: bool = session.query(GlobalStats).first() is not None
+
+    if not seeded:
+        rebuild_stats()
+
+
+if migrate_user_scrobbles():
+    rebuild_stats()
+
+init_stats()
+
+
+# how an account is written in track_search's account column, the
+# brackets keep one id from matching inside another and make even
+# single digit ids long enough to be a trigram
+ACCOUNT_TOKEN_SQL: str = "'<' || {0} || '>'"
+
+
+def create_track_search() -> None:
+    """
+    Create the trigram full-text index over known_track and the
+    triggers keeping both up to date as scrobbles are stored. The
+    index holds each track's account, so a search only matches the
+    account's own tracks. On an existing database the index is
+    filled once from scrobble, or rebuilt from known_track if it
+    predates the account column.
+    """
+
+    with engine.begin() as conn:
+        existing: str = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = 'track_search'")
+        ).scalar()
+
+        if existing is not None and "account" not in existing:
+            conn.execute(text("DROP TRIGGER IF EXISTS known_track_search"))
+            conn.execute(text("DROP TABLE track_search"))
+
+        # contentless, lookups only need the rowid to join known_track on
+        conn.execute(
+            text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS track_search USING fts5("
+                "title, artist, account, content='', tokenize='trigram')"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS scrobble_known_track AFTER INSERT ON scrobble "
+                "BEGIN INSERT OR IGNORE INTO known_track (account_id, title, artist) "
+                "VALUES (new.account_id, new.title, new.artist); END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS known_track_search AFTER INSERT ON known_track "
+                "BEGIN INSERT INTO track_search (rowid, title, artist, account) "
+                f"VALUES (new.id, new.title, new.artist, {ACCOUNT_TOKEN_SQL.format('new.account_id')}); END"
+            )
+        )
+
+        indexed: bool = conn.execute(text("SELECT 1 FROM known_track LIMIT 1")).first()
+        stored: bool = conn.execute(text("SELECT 1 FROM scrobble LIMIT 1")).first()
+
+        if stored and not indexed:
+            conn.execute(
+                text(
+                    "INSERT OR IGNORE INTO known_track (account_id, title, artist) "
+                    "SELECT DISTINCT account_id, title, artist FROM scrobble "
+                    "WHERE account_id IS NOT NULL"
+                )
+            )
+
+        elif indexed and (existing is None or "account" not in existing):
+            conn.execute(
+                text(
+                    "INSERT INTO track_search (rowid, title, artist, account) "
+                    f"SELECT id, title, artist, {ACCOUNT_TOKEN_SQL.format('account_id')} "
+                    "FROM known_track"
+                )
+            )
+
+
+create_track_search()
+
+
+# what each tally kind is named by and which scrobbles count towards it
+TALLY_KINDS: dict[str, tuple[str, str]] = {
+    "artist": ("''", ""),
+    "album": ("album", " AND album IS NOT NULL AND album != ''"),
+    "track": ("title", ""),
+}
+
+# utc calendar month of a unix_timestamp column, as stored in month_tally
+MONTH_SQL: str = (
+    "CAST(strftime('%Y', {0}, 'unixepoch') AS INTEGER) * 12 "
+    "+ CAST(strftime('%m', {0}, 'unixepoch') AS INTEGER) - 1"
+)
+
+
+def create_play_tally() -> None:
+    """
+    Create the triggers counting each stored scrobble towards its
+    account's artist, album and track tallies, overall and for its
+    month. On an existing database the tallies are filled once from
+    scrobble.
+    """
+
+    def new_columns(expression: str) -> str:
+        return expression.replace("album", "new.album").replace("title", "new.title")
+
+    with engine.begin() as conn:
+        for kind, (name, condition) in TALLY_KINDS.items():
+            conn.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS scrobble_{kind}_tally AFTER INSERT ON scrobble "
+                    f"WHEN new.account_id IS NOT NULL{new_columns(condition)} "
+                    "BEGIN INSERT INTO play_tally (kind, artist, name, account_id, plays) "
+                    f"VALUES ('{kind}', new.artist, {new_columns(name)}, new.account_id, 1) "
+                    "ON CONFLICT (kind, artist, name, account_id) "
+                    "DO UPDATE SET plays = plays + 1; END"
+                )
+            )
+            conn.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS scrobble_{kind}_month_tally AFTER INSERT ON scrobble "
+                    f"WHEN new.account_id IS NOT NULL{new_columns(condition)} "
+                    "BEGIN INSERT INTO month_tally (account_id, kind, month, artist, name, plays) "
+                    f"VALUES (new.account_id, '{kind}', {MONTH_SQL.format('new.unix_timestamp')}, "
+                    f"new.artist, {new_columns(name)}, 1) "
+                    "ON CONFLICT (account_id, kind, month, artist, name) "
+                    "DO UPDATE SET plays = plays + 1; END"
+                )
+            )
+
+        stored: bool = conn.execute(text("SELECT 1 FROM scrobble LIMIT 1")).first()
+        tallied: bool = conn.execute(text("SELECT 1 FROM play_tally LIMIT 1")).first()
+        month_tallied: bool = conn.execute(
+            text("SELECT 1 FROM month_tally LIMIT 1")
+        ).first()
+
+        for kind, (name, condition) in TALLY_KINDS.items():
+            if stored and not tallied:
+                conn.execute(
+                    text(
+                        "INSERT INTO play_tally (kind, artist, name, account_id, plays) "
+                        f"SELECT '{kind}', artist, {name}, account_id, COUNT(*) FROM scrobble "
+                        f"WHERE account_id IS NOT NULL{condition} "
+                        f"GROUP BY artist COLLATE NOCASE, {name} COLLATE NOCASE, account_id"
+                    )
+                )
+
+            if stored and not month_tallied:
+                month: str = MONTH_SQL.format("unix_timestamp")
+                conn.execute(
+                    text(
+                        "INSERT INTO month_tally (account_id, kind, month, artist, name, plays) "
+                        f"SELECT account_id, '{kind}', {month}, artist, {name}, COUNT(*) "
+                        f"FROM scrobble WHERE account_id IS NOT NULL{condition} "
+                        f"GROUP BY account_id, {month}, "
+                        f"artist COLLATE NOCASE, {name} COLLATE NOCASE"
+                    )
+                )
+
+
+create_play_tally()
+
+
+# day rollup tables and the columns besides account_id and day they're keyed by
+DAY_ROLLUPS: dict[str, str] = {"scrobble_day": "", "artist_day": ", artist"}
+
+
+def create_scrobble_days() -> None:
+    """
+    Create the triggers counting each stored scrobble towards its
+    account's scrobble_day and artist_day rows, along with the
+    first and last timestamps of the day. On an existing database
+    the days are filled once from scrobble, and day rows from before
+    the timestamps were kept get them filled in.
+    """
+
+    with engine.begin() as conn:
+        stored: bool = conn.execute(text("SELECT 1 FROM scrobble LIMIT 1")).first()
+
+        for table, columns in DAY_ROLLUPS.items():
+            trigger: str = f"{table}_tally"
+            existing: str = conn.execute(
+                text("SELECT sql FROM sqlite_master WHERE name = :trigger"),
+                {"trigger": trigger},
+            ).scalar()
+
+            if existing is not None and "last_timestamp" not in existing:
+                conn.execute(text(f"DROP TRIGGER {trigger}"))
+
+            conn.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {trigger} AFTER INSERT ON scrobble "
+                    "WHEN new.account_id IS NOT NULL "
+                    f"BEGIN INSERT INTO {table} (account_id{columns}, day, plays, "
+                    "first_timestamp, last_timestamp) "
+                    f"VALUES (new.account_id{columns.replace(', ', ', new.')}, "
+                    "new.unix_timestamp / 86400, 1, new.unix_timestamp, new.unix_timestamp) "
+                    f"ON CONFLICT (account_id{columns}, day) DO UPDATE SET plays = plays + 1, "
+                    "first_timestamp = MIN(first_timestamp, excluded.first_timestamp), "
+                    "last_timestamp = MAX(last_timestamp, excluded.last_timestamp); END"
+                )
+            )
+
+            tallied: bool = conn.execute(text(f"SELECT 1 FROM {table} LIMIT 1")).first()
+
+            if stored and not tallied:
+                conn.execute(
+                    text(
+                        f"INSERT INTO {table} (account_id{columns}, day, plays, "
+                        "first_timestamp, last_timestamp) "
+                        f"SELECT account_id{columns}, unix_timestamp / 86400, COUNT(*), "
+                        "MIN(unix_timestamp), MAX(unix_timestamp) FROM scrobble "
+                        "WHERE account_id IS NOT NULL "
+                        f"GROUP BY account_id{columns.replace('artist', 'artist COLLATE NOCASE')}, "
+                        "unix_timestamp / 86400"
+                    )
+                )
+
+            elif conn.execute(
+                text(f"SELECT 1 FROM {table} WHERE last_timestamp IS NULL LIMIT 1")
+            ).first():
+                conn.execute(
+                    text(
+                        f"UPDATE {table} SET first_timestamp = bounds.first, "
+                        "last_timestamp = bounds.last FROM ("
+                        f"SELECT account_id{columns}, unix_timestamp / 86400 AS day, "
+                        "MIN(unix_timestamp) AS first, MAX(unix_timestamp) AS last "
+                        "FROM scrobble WHERE account_id IS NOT NULL "
+                        f"GROUP BY account_id{columns.replace('artist', 'artist COLLATE NOCASE')}, "
+                        "unix_timestamp / 86400) AS bounds "
+                        f"WHERE {table}.account_id = bounds.account_id "
+                        f"AND {table}.day = bounds.day{columns and f' AND {table}.artist = bounds.artist'}"
+                    )
+                )
+
+
+create_scrobble_days()
+
+
+def merge_case_duplicate_accounts() -> bool:
+    """
+    Usernames used to be stored as typed, so linking "Foo" and "foo"
+    made two accounts with the same history. Keep the one with the
+    most scrobbles stored, move every user over to it and drop the
+    others along with everything stored for them, then lowercase
+    every username. Returns True if any accounts were merged.
+    """
+
+    with Session.begin() as session:
+        lowered: bool = session.execute(
+            text("SELECT 1 FROM lfm_account WHERE username != LOWER(username) LIMIT 1")
+        ).first()
+
+        if not lowered:
+            return False
+
+        # the account kept for each lowercased name, most scrobbles first
+        merges: list[tuple[int, int]] = session.execute(
+            text(
+                "SELECT id, FIRST_VALUE(id) OVER (PARTITION BY LOWER(username) "
+                "ORDER BY scrobble_count DESC, id) FROM lfm_account"
+            )
+        ).all()
+        dropped: dict[int, int] = {
+            account_id: keep for account_id, keep in merges if account_id != keep
+        }
+
+        for account_id, keep in dropped.items():
+            params: dict = {"account_id": account_id, "keep": keep}
+
+            session.execute(
+                text(
+                    "UPDATE user_account SET account_id = :keep "
+                    "WHERE account_id = :account_id"
+                ),
+                params,
+            )
+            # the search index has to be told what it's losing
+            session.execute(
+                text(
+                    "INSERT INTO track_search (track_search, rowid, title, artist, account) "
+                    f"SELECT 'delete', id, title, artist, {ACCOUNT_TOKEN_SQL.format('account_id')} "
+                    "FROM known_track WHERE account_id = :account_id"
+                ),
+                params,
+            )
+
+            for table in (
+                "scrobble",
+                "known_track",
+                "play_tally",
+                "month_tally",
+                "scrobble_day",
+                "artist_day",
+                "reconcile_range",
+                "wrapped_report",
+                "sync_lease",
+            ):
+                session.execute(
+                    text(f"DELETE FROM {table} WHERE account_id = :account_id"), params
+                )
+
+            session.execute(
+                text("DELETE FROM lfm_account WHERE id = :account_id"), params
+            )
+
+        session.execute(text("UPDATE lfm_account SET username = LOWER(username)"))
+
+    return bool(dropped)
+
+
+if merge_case_duplicate_accounts():
+    rebuild_stats()
+
+
+def add_scrobble_counts(session, account_id: int, amount: int) -> None:
+    """
+    Add amount to the account's stored scrobble count and the global
+    total, inside the caller's transaction so the counts commit
+    together with the scrobbles themselves.
+    """
+
+    if amount == 0:
+        return
+
+    session.execute(
+        update(LastFMAccount)
+        .where(LastFMAccount.id == account_id)
+        .values(scrobble_count=LastFMAccount.scrobble_count + amount)
+    )
+    session.execute(
+        update(GlobalStats).values(total_scrobbles=GlobalStats.total_scrobbles + amount)
+    )
+
+
+def add_user_count(session, amount: int) -> None:
+    """
+    Add amount to the global number of users.
+    """
+
+    session.execute(
+        update(GlobalStats).values(total_users=GlobalStats.total_users + amount)
+    )
+
+
+def get_or_create_account(session, lfm_user: str) -> LastFMAccount:
+    """
+    Return the stored account for a last.fm username,
+    creating it if this is the first user to link it.
+    """
+
+    lfm_user = lfm_user.lower()
+    account: LastFMAccount = (
+        session.query(LastFMAccount).filter_by(username=lfm_user).first()
+    )
+
+    if account is None:
+        account = LastFMAccount(username=lfm_user, scrobble_count=0)
+        session.add(account)
+
+    return account
 
 
 def store_user(discord_id: int, lfm_user: str) -> bool:
@@ -67,6 +856,8 @@ def store_user(discord_id: int, lfm_user: str) -> bool:
     user already had their info stored.
     """
 
+    lfm_user = lfm_user.lower()
+
     with Session.begin() as session:
         exists = (
             session.query(User.discord_id).filter_by(discord_id=discord_id).first()
@@ -76,43 +867,40 @@ def store_user(discord_id: int, lfm_user: str) -> bool:
         if exists:
             return False
 
-        new_user = User(discord_id=discord_id, last_fm_user=lfm_user)
+        new_user = User(
+            discord_id=discord_id,
+            last_fm_user=lfm_user,
+            account=get_or_create_account(session, lfm_user),
+        )
         session.add(new_user)
+        add_user_count(session, 1)
 
         return True
 
 
-def update_user(discord_id: int, lfm_user: str) -> None:
+def update_user(discord_id: int, lfm_user: str) -> bool:
     """
     Updates a user's information when they were already associated
     with an Last.fm account, and now want to switch to another.
+    Scrobbles stay with the old account, so switching back later
+    doesn't need them downloaded again.
 
     Returning true represents the user was successfully updated. Return
     False if user supplied same last.fm user as one already stored.
     """
 
+    lfm_user = lfm_user.lower()
+
     with Session.begin() as session:
-        current_user_obj: User = (
-            session.query(User).filter_by(discord_id=discord_id).first()
-        )
+        user_obj: User = session.query(User).filter_by(discord_id=discord_id).first()
 
-        if lfm_user == current_user_obj.last_fm_user:
+        # rows linked before usernames were lowercased can still have capitals
+        if lfm_user == user_obj.last_fm_user.lower():
             return False
 
-        else:
-            user_obj: User = (
-                session.query(User).filter_by(discord_id=discord_id).first()
-            )
-            session.delete(user_obj)
-            session.expire_all()
+        user_obj.account = get_or_create_account(session, lfm_user)
+        user_obj.last_fm_user = lfm_user
 
-        # start new session so SQLA doesn't think I'm overwriting when obj with same user_id as deleted
-        # is added to DB
-    with Session.begin() as session:
-        new_user = User(discord_id=discord_id, last_fm_user=lfm_user)
-        session.add(new_user)
-
-        # successfully "updated" (deleted & added new user obj) user
         return True
 
 
@@ -139,7 +927,8 @@ def store_scrobble(discord_id: int, scrobble: pylast.PlayedTrack) -> bool:
         if not user:
             return False
 
-        user.scrobble_entries.append(new_scrobble)
+        user.account.scrobble_entries.append(new_scrobble)
+        add_scrobble_counts(session, user.account_id, 1)
 
     return True
 
@@ -152,6 +941,7 @@ def store_scrobbles(discord_id: int, scrobbles: list[pylast.PlayedTrack]) -> Non
         if not user:
             return None
 
+        stored: int = 0
         try:
             for scrobble in scrobbles:
                 scrobble_track: pylast.Track = scrobble.track
@@ -165,11 +955,39 @@ def store_scrobbles(discord_id: int, scrobbles: list[pylast.PlayedTrack]) -> Non
                     unix_timestamp=int(scrobble.timestamp),
                 )
 
-                user.scrobble_entries.append(new_scrobble)
+                user.account.scrobble_entries.append(new_scrobble)
+                stored += 1
 
         # generator may be empty? precaution
         except StopIteration:
-            return
+            pass
+
+        add_scrobble_counts(session, user.account_id, stored)
+
+
+def store_scrobble_batches(batches: list[tuple[int, list[dict]]]) -> int:
+    """
+    Insert batches of scrobble rows, each an account id and its rows,
+    and update the counts in one transaction. Returns the number of
+    rows stored.
+    """
+
+    amounts: dict[int, int] = {}
+    rows: list[dict] = []
+    for account_id, batch in batches:
+        amounts[account_id] = amounts.get(account_id, 0) + len(batch)
+        rows.extend(dict(row, account_id=account_id) for row in batch)
+
+    if not rows:
+        return 0
+
+    with Session.begin() as session:
+        session.execute(insert(Scrobble), rows)
+
+        for account_id, amount in amounts.items():
+            add_scrobble_counts(session, account_id, amount)
+
+    return len(rows)
 
 
 def get_last_stored_timestamp(discord_id: int) -> Scrobble:
@@ -179,15 +997,15 @@ def get_last_stored_timestamp(discord_id: int) -> Scrobble:
 
     with Session.begin() as session:
 
-        # find User.id for given last fm username (user param)
-        user_id_query = (
-            session.query(User.id).filter_by(discord_id=discord_id).subquery()
+        # find the last.fm account linked to the discord user
+        account_id_query = (
+            session.query(User.account_id).filter_by(discord_id=discord_id).subquery()
         )
 
         # find the newest scrobble stored for them
         latest_timestamp: int = (
             session.query(func.max(Scrobble.unix_timestamp))
-            .filter_by(user_id=user_id_query.c.id)
+            .filter_by(account_id=account_id_query.c.account_id)
             .scalar()
         )
 
@@ -209,18 +1027,19 @@ def get_last_scrobbled_track(user: pylast.User) -> pylast.PlayedTrack:
 
 def get_number_user_scrobbles_stored(discord_id: int) -> int:
     """
-    Return the number of scrobbles stored for a given user.
+    Return the number of scrobbles stored for a given user's
+    linked last.fm account.
     """
 
     with Session.begin() as session:
         count: int = (
-            session.query(User)
-            .join(User.scrobble_entries)
+            session.query(LastFMAccount.scrobble_count)
+            .join(User.account)
             .filter(User.discord_id == discord_id)
-            .count()
+            .scalar()
         )
 
-    return count
+    return count or 0
 
 
 def check_recent_track_stored(user: pylast.User, discord_id: int) -> bool:
@@ -298,6 +1117,53 @@ def retrieve_lfm_username(discord_id: int) -> str:
         return None  # user not found
 
 
+def get_user_timezone(discord_id: int) -> ZoneInfo:
+    """
+    Return the time zone the discord user has set, or utc if
+    they haven't set one.
+    """
+
+    with Session.begin() as session:
+        timezone: str = (
+            session.query(User.timezone).filter_by(discord_id=discord_id).scalar()
+        )
+
+    return ZoneInfo(timezone or "UTC")
+
+
+def get_account_timezone(discord_id: int) -> tuple[int, ZoneInfo]:
+    """
+    Return the discord user's last.fm account id along with their
+    time zone, in one query.
+    """
+
+    with Session.begin() as session:
+        account_id, timezone = (
+            session.query(User.account_id, User.timezone)
+            .filter_by(discord_id=discord_id)
+            .one()
+        )
+
+    return account_id, ZoneInfo(timezone or "UTC")
+
+
+def set_user_timezone(discord_id: int, timezone: str) -> bool:
+    """
+    Store the discord user's time zone. Returns False if they
+    have no last.fm username set.
+    """
+
+    with Session.begin() as session:
+        user: User = session.query(User).filter_by(discord_id=discord_id).first()
+
+        if not user:
+            return False
+
+        user.timezone = timezone
+
+    return True
+
+
 def get_lfm_username(invoker_id: int, user: discord.User) -> str:
     """
     Returns last.fm username of the command invoker if no user
@@ -343,9 +1209,10 @@ def get_total_scrobbles() -> int:
     """
 
     with Session.begin() as session:
-        num_scrobbles: int = session.query(func.count(Scrobble.id)).scalar()
+        num_scrobbles: int = session.query(GlobalStats.total_scrobbles).scalar()
+
+    return num_scrobbles or 0
 
-    return num_scrobbles
 
 def get_total_users() -> int:
     """
@@ -354,6 +1221,23 @@ def get_total_users() -> int:
     """
 
     with Session.begin() as session:
-        num_users: int = session.query(func.count(User.id)).scalar()
+        num_users: int = session.query(GlobalStats.total_users).scalar()
+
+    return num_users or 0
+
+
+def get_db_size() -> int:
+    """
+    Return the size in bytes of the database file, including
+    its write-ahead log if there is one.
+    """
+
+    if not (db_file := engine.url.database):
+        return 0
+
+    size: int = 0
+    for path in (db_file, f"{db_file}-wal"):
+        if os.path.exists(path):
+            size += os.path.getsize(path)
 
-    return num_users
\ No newline at end of file
+    return size
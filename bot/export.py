@@ -0,0 +1,103 @@
+### streams a user's stored scrobbles out into gzipped csv files
+
+import csv
+import gzip
+import io
+import os
+
+from sqlalchemy import select
+
+from data_interface import Scrobble, Session, User
+
+# rows fetched from the database and written at a time
+EXPORT_CHUNK_ROWS: int = 5000
+
+# discord rejects uploads over 8 MB, a new part is started once one
+# passes this, leaving room for the chunk still in the compressor
+PART_BYTES: int = 7 * 2**20
+
+EXPORT_COLUMNS: tuple[str, ...] = (
+    "unix_timestamp",
+    "title",
+    "artist",
+    "album",
+    "lfm_url",
+)
+
+
+class CsvPart:
+    """
+    One gzipped csv file being written, starting with the header row.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.raw = open(path, "wb")
+        self.text = io.TextIOWrapper(
+            gzip.GzipFile(fileobj=self.raw, mode="wb"), encoding="utf-8", newline=""
+        )
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(EXPORT_COLUMNS)
+
+    def compressed_size(self) -> int:
+        self.text.flush()
+        return self.raw.tell()
+
+    def close(self) -> None:
+        # closing the text wrapper closes the gzip stream, not the file
+        self.text.close()
+        self.raw.close()
+
+
+def write_export(
+    discord_id: int, directory: str, part_bytes: int = PART_BYTES
+) -> list[str]:
+    """
+    Write the user's scrobbles, oldest first, as gzipped csv files in
+    directory, starting a new part before one grows past part_bytes.
+    Rows are read EXPORT_CHUNK_ROWS at a time as plain tuples and
+    written as they come, so memory use stays the same however long
+    the history is. Returns the paths of the parts written.
+    """
+
+    paths: list[str] = []
+    part: CsvPart = None
+
+    try:
+        with Session.begin() as session:
+            account_id: int = (
+                session.query(User.account_id).filter_by(discord_id=discord_id).scalar()
+            )
+
+            # the (account_id, unix_timestamp) index hands rows over in order
+            result = session.execute(
+                select(
+                    Scrobble.unix_timestamp,
+                    Scrobble.title,
+                    Scrobble.artist,
+                    Scrobble.album,
+                    Scrobble.lfm_url,
+                )
+                .where(Scrobble.account_id == account_id)
+                .order_by(Scrobble.unix_timestamp, Scrobble.id)
+                .execution_options(yield_per=EXPORT_CHUNK_ROWS)
+            )
+
+            for rows in result.partitions():
+                if part is None or part.compressed_size() >= part_bytes:
+                    if part is not None:
+                        part.close()
+
+                    path: str = os.path.join(
+                        directory, f"scrobbles_{len(paths) + 1}.csv.gz"
+                    )
+                    part = CsvPart(path)
+                    paths.append(path)
+
+                part.writer.writerows(rows)
+
+    finally:
+        if part is not None:
+            part.close()
+
+    return paths
@@ -0,0 +1,44 @@
+### bins scrobble timestamps by weekday and hour with numpy
+
+import datetime
+
+import numpy as np
+from PIL import Image
+
+from cmd_data_helpers import get_scrobble_timestamps
+from image import render_heatmap
+from rollups import DAY_SECONDS, to_local_seconds
+
+# 1970-01-01 was a thursday, weekdays count from monday = 0
+EPOCH_WEEKDAY: int = 3
+
+
+def bin_weekday_hour(timestamps: np.ndarray, tz: datetime.tzinfo) -> np.ndarray:
+    """
+    Count the timestamps by local weekday (rows, monday first) and
+    hour (columns) in the time zone, as a 7 x 24 array.
+    """
+
+    if timestamps.size == 0:
+        return np.zeros((7, 24), dtype=np.int64)
+
+    local: np.ndarray = to_local_seconds(timestamps, tz)
+
+    days: np.ndarray = local // DAY_SECONDS
+    weekdays: np.ndarray = (days + EPOCH_WEEKDAY) % 7
+    hours: np.ndarray = (local - days * DAY_SECONDS) // 3600
+
+    return np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
+
+
+def create_heatmap(
+    discord_id: int, unix_timestamp: int, tz: datetime.tzinfo, title: str
+) -> Image.Image:
+    """
+    Fetch, bin and draw the user's listening heatmap. Blocks, so
+    commands should run it on a thread.
+    """
+
+    timestamps: np.ndarray = get_scrobble_timestamps(discord_id, unix_timestamp)
+
+    return render_heatmap(bin_weekday_hour(timestamps, tz), title)
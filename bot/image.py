@@ -2,22 +2,27 @@ from io import BytesIO
 from math import sqrt
 
 import discord
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import textwrap
 import requests
 
+from metrics import span
+
 
 def get_dominant_color(image_url: str):
     """
     Take a URL to an image and return the dominant color of the image.
     """
 
-    image = requests.get(image_url)
+    with span("image_download"):
+        image = requests.get(image_url)
 
-    image = Image.open(BytesIO(image.content))
-    image = image.convert("RGB")
-    image = image.resize((1, 1))
-    rgb = image.getpixel((0, 0))
+    with span("render"):
+        image = Image.open(BytesIO(image.content))
+        image = image.convert("RGB")
+        image = image.resize((1, 1))
+        rgb = image.getpixel((0, 0))
 
     return rgb
 
@@ -47,50 +52,120 @@ def combine_images(top_artist_names: list[str], image_urls: list[str]) -> Image:
 
     row_col_size = int(sqrt(len(image_urls)))
 
-    images = [requests.get(url).content for url in image_urls]
-    images = [Image.open(BytesIO(image)) for image in images]
-    w, h = images[0].size
+    with span("image_download"):
+        images = [requests.get(url).content for url in image_urls]
 
-    updated_imgs: list = []
-    # write text over every image
-    for artist_name, image in zip(top_artist_names, images):
+    with span("render"):
+        images = [Image.open(BytesIO(image)) for image in images]
+        w, h = images[0].size
 
-        # cut off extended from album name to save space
-        img_text = (
-            artist_name
-            if "(Extended)" not in artist_name
-            else artist_name.split("(Extended)")[0]
-        )
-        draw = ImageDraw.Draw(image)
+        updated_imgs: list = []
+        # write text over every image
+        for artist_name, image in zip(top_artist_names, images):
+
+            # cut off extended from album name to save space
+            img_text = (
+                artist_name
+                if "(Extended)" not in artist_name
+                else artist_name.split("(Extended)")[0]
+            )
+            draw = ImageDraw.Draw(image)
+
+            FONT_SIZE = 40
+
+            font = ImageFont.truetype("Roboto-Bold.ttf", FONT_SIZE)
+            text_width, text_height = draw.textsize(img_text, font=font)
+
+            # make black background rectangle behind text
+            rectangle_size = (text_width + 20, text_height + 20)
+
+            rectangle_img = Image.new("RGBA", rectangle_size, "black")
+            rectangle_draw = ImageDraw.Draw(rectangle_img)
+
+            # make background lower opacity
+            OPACITY = 50
+            paste_mask = rectangle_img.split()[3].point(lambda i: i * OPACITY // 100)
+
+            image.paste(
+                rectangle_img, ((w - rectangle_size[0]) // 2, (h - 85)), mask=paste_mask
+            )
+            draw.text(
+                (((w - rectangle_size[0]) // 2) + 10, (h - 85)),
+                img_text,
+                font=font,
+            )
+
+            updated_imgs.append(image)
 
-        FONT_SIZE = 40
+        grid = Image.new("RGBA", size=(row_col_size * w, row_col_size * h))
 
-        font = ImageFont.truetype("Roboto-Bold.ttf", FONT_SIZE)
-        text_width, text_height = draw.textsize(img_text, font=font)
+        for i, img in enumerate(images):
+            grid.paste(img, box=(i % row_col_size * w, i // row_col_size * h))
+        return grid
 
-        # make black background rectangle behind text
-        rectangle_size = (text_width + 20, text_height + 20)
 
-        rectangle_img = Image.new("RGBA", rectangle_size, "black")
-        rectangle_draw = ImageDraw.Draw(rectangle_img)
+HEATMAP_CELL_SIZE: int = 40
+HEATMAP_MARGIN: int = 70
+HEATMAP_BACKGROUND: tuple[int, int, int] = (32, 34, 37)
+HEATMAP_EMPTY: tuple[int, int, int] = (47, 49, 54)
+HEATMAP_FULL: tuple[int, int, int] = (241, 196, 15)
+WEEKDAY_NAMES: list[str] = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 
-        # make background lower opacity
-        OPACITY = 50
-        paste_mask = rectangle_img.split()[3].point(lambda i: i * OPACITY // 100)
 
-        image.paste(
-            rectangle_img, ((w - rectangle_size[0]) // 2, (h - 85)), mask=paste_mask
+def render_heatmap(counts: np.ndarray, title: str) -> Image:
+    """
+    Draw a 7 x 24 array of scrobble counts as a weekday by hour
+    grid, busier hours in brighter gold.
+    """
+
+    with span("render"):
+        # shade every cell at once, then scale the 7 x 24 pixels up into cells
+        shares: np.ndarray = counts / max(int(counts.max()), 1)
+        empty: np.ndarray = np.array(HEATMAP_EMPTY, dtype=np.float64)
+        full: np.ndarray = np.array(HEATMAP_FULL, dtype=np.float64)
+        pixels: np.ndarray = empty + shares[..., np.newaxis] * (full - empty)
+
+        grid: Image = Image.fromarray(pixels.astype(np.uint8), "RGB").resize(
+            (24 * HEATMAP_CELL_SIZE, 7 * HEATMAP_CELL_SIZE), Image.Resampling.NEAREST
         )
-        draw.text(
-            (((w - rectangle_size[0]) // 2) + 10, (h - 85)),
-            img_text,
-            font=font,
+
+        image: Image = Image.new(
+            "RGB",
+            (
+                grid.width + HEATMAP_MARGIN + 20,
+                grid.height + HEATMAP_MARGIN * 2,
+            ),
+            HEATMAP_BACKGROUND,
         )
+        image.paste(grid, (HEATMAP_MARGIN, HEATMAP_MARGIN + 30))
 
-        updated_imgs.append(image)
+        draw = ImageDraw.Draw(image)
+        font = ImageFont.truetype("Roboto-Bold.ttf", 18)
+        title_font = ImageFont.truetype("Roboto-Bold.ttf", 28)
+
+        draw.text((HEATMAP_MARGIN, 15), title, font=title_font, fill="white")
+
+        for hour in range(0, 24, 3):
+            draw.text(
+                (HEATMAP_MARGIN + hour * HEATMAP_CELL_SIZE + 4, HEATMAP_MARGIN + 5),
+                f"{hour:02}",
+                font=font,
+                fill="white",
+            )
+
+        for day, name in enumerate(WEEKDAY_NAMES):
+            draw.text(
+                (15, HEATMAP_MARGIN + 30 + day * HEATMAP_CELL_SIZE + 10),
+                name,
+                font=font,
+                fill="white",
+            )
 
-    grid = Image.new("RGBA", size=(row_col_size * w, row_col_size * h))
+        draw.text(
+            (HEATMAP_MARGIN, image.height - 35),
+            f"{int(counts.sum())} scrobbles, busiest hour {int(counts.max())}",
+            font=font,
+            fill="white",
+        )
 
-    for i, img in enumerate(images):
-        grid.paste(img, box=(i % row_col_size * w, i // row_col_size * h))
-    return grid
+    return image
@@ -0,0 +1,418 @@
+### seeds an account's history from a scrobble export file instead of the api
+
+import argparse
+import asyncio
+import bisect
+import calendar
+import csv
+import gzip
+import io
+import itertools
+import json
+import time
+from typing import Iterator
+
+from sqlalchemy import text
+
+from data_interface import Session, get_or_create_account, store_scrobble_batches
+from data_grabber import get_account, update_account_scrobbles
+from ingest import ScrobbleWriter
+from lfm_client import LastFMClient
+from config import LFM_API_KEY, LFM_API_URL
+from reconcile import reconcile_account
+
+# rows parsed, checked for duplicates and inserted at a time
+IMPORT_BATCH_ROWS: int = 5000
+
+# characters read at a time while streaming a json export
+JSON_CHUNK_CHARS: int = 2**20
+
+# exporters write english month names whatever the machine's locale
+MONTHS: dict[str, int] = {
+    "Jan": 1,
+    "Feb": 2,
+    "Mar": 3,
+    "Apr": 4,
+    "May": 5,
+    "Jun": 6,
+    "Jul": 7,
+    "Aug": 8,
+    "Sep": 9,
+    "Oct": 10,
+    "Nov": 11,
+    "Dec": 12,
+}
+
+# header names other exporters use for the scrobble table's columns
+CSV_COLUMNS: dict[str, str] = {
+    "unix_timestamp": "unix_timestamp",
+    "uts": "unix_timestamp",
+    "timestamp": "unix_timestamp",
+    "title": "title",
+    "track": "title",
+    "name": "title",
+    "artist": "artist",
+    "album": "album",
+    "lfm_url": "lfm_url",
+    "url": "lfm_url",
+}
+
+
+def open_export(path: str) -> io.TextIOBase:
+    """
+    Open an export file as text, whether or not it's gzipped
+    (the bot's own /export hands out .csv.gz files).
+    """
+
+    with open(path, "rb") as file:
+        magic: bytes = file.read(2)
+
+    if magic == b"\x1f\x8b":
+        return io.TextIOWrapper(gzip.open(path, "rb"), encoding="utf-8", newline="")
+
+    return open(path, encoding="utf-8-sig", newline="")
+
+
+def parse_export_date(date: str) -> int:
+    """
+    Turn a date like "31 Jan 2021 12:34", as written by the usual
+    last.fm csv exporters in utc, into a unix timestamp.
+    """
+
+    day, month, year, clock = date.split()
+    hour, minute = clock.split(":")
+
+    return calendar.timegm(
+        (int(year), MONTHS[month], int(day), int(hour), int(minute), 0)
+    )
+
+
+def iter_csv_rows(file: io.TextIOBase) -> Iterator[dict]:
+    """
+    Yield scrobble rows from a csv export. Files with a header row are
+    read by column name, files without one are taken to be
+    artist, album, title, date as most last.fm exporters write them.
+    """
+
+    reader = csv.reader(file)
+    first: list[str] = next(reader, None)
+
+    if first is None:
+        return
+
+    header: list[str] = [CSV_COLUMNS.get(column.strip().lower()) for column in first]
+
+    if "unix_timestamp" not in header:
+        # no header, so the first row is a scrobble too
+        for record in itertools.chain([first], reader):
+            if len(record) >= 4:
+                yield headerless_row(record)
+
+        return
+
+    for record in reader:
+        row: dict = {"album": None, "lfm_url": None}
+        for column, value in zip(header, record):
+            if column is not None:
+                row[column] = value
+
+        if row.get("unix_timestamp") and row.get("title") and row.get("artist"):
+            row["unix_timestamp"] = int(row["unix_timestamp"])
+            row["album"] = row["album"] or None
+            row["lfm_url"] = row["lfm_url"] or None
+            yield row
+
+
+def headerless_row(record: list[str]) -> dict:
+    """
+    Takes a headerless export's artist, album, title, date record and
+    returns its scrobble table row. Its dates only go down to the
+    minute, which resolution records for store_new_rows.
+    """
+
+    artist, album, title, date = record[:4]
+
+    return {
+        "title": title,
+        "artist": artist,
+        "album": album or None,
+        "lfm_url": None,
+        "unix_timestamp": parse_export_date(date),
+        "resolution": 60,
+    }
+
+
+def get_text(value) -> str:
+    """
+    Return the text of a json export field, which is either a plain
+    string or an object like the api's {"#text": ...} or {"name": ...}.
+    """
+
+    if isinstance(value, dict):
+        value = value.get("#text") or value.get("name")
+
+    return value or None
+
+
+def json_track_to_row(track: dict) -> dict:
+    """
+    Takes a track as last.fm's api (and exports of it) lay them out
+    and returns its scrobble table row, or None for the track that
+    was playing when the export was taken.
+    """
+
+    date = track.get("date")
+    if isinstance(date, dict):
+        date = date.get("uts")
+
+    if date is None:
+        date = track.get("uts") or track.get("timestamp")
+
+    title: str = get_text(track.get("name") or track.get("title"))
+    artist: str = get_text(track.get("artist"))
+
+    if date is None or title is None or artist is None:
+        return None
+
+    return {
+        "title": title,
+        "artist": artist,
+        "album": get_text(track.get("album")),
+        "lfm_url": track.get("url") or track.get("lfm_url") or None,
+        "unix_timestamp": int(date),
+    }
+
+
+def iter_json_items(value) -> Iterator[dict]:
+    """
+    Yield the tracks in one json value, which may be a track, a page of
+    the api's recent tracks or a list of either.
+    """
+
+    if isinstance(value, list):
+        for item in value:
+            yield from iter_json_items(item)
+
+    elif isinstance(value, dict):
+        if "recenttracks" in value:
+            yield from iter_json_items(value["recenttracks"])
+
+        elif "track" in value and isinstance(value["track"], list):
+            yield from iter_json_items(value["track"])
+
+        else:
+            yield value
+
+
+def iter_json_values(file: io.TextIOBase) -> Iterator:
+    """
+    Yield the elements of the top level json array in the file one at a
+    time, so only one page or track is held in memory however large the
+    export is. A file that isn't an array is yielded as a single value.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer: str = ""
+    position: int = 0
+
+    def fill() -> bool:
+        nonlocal buffer, position
+        chunk: str = file.read(JSON_CHUNK_CHARS)
+        buffer = buffer[position:] + chunk
+        position = 0
+        return bool(chunk)
+
+    def skip(characters: str) -> None:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+
+            if position < len(buffer) or not fill():
+                return
+
+    skip(" \t\r\n")
+    if position == len(buffer):
+        return
+
+    if buffer[position] != "[":
+        # not an array, the whole file is one value
+        while fill():
+            pass
+
+        yield json.loads(buffer)
+        return
+
+    position += 1
+    while True:
+        skip(" \t\r\n,")
+        if position == len(buffer):
+            raise ValueError("export ends before its closing ]")
+
+        if buffer[position] == "]":
+            return
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                break
+
+            except json.JSONDecodeError:
+                # the value may just run past what's been read so far
+                if not fill():
+                    raise
+
+        # a number cut off by the end of the buffer would still decode
+        if end == len(buffer) and fill():
+            continue
+
+        position = end
+        yield value
+
+
+def iter_export_rows(path: str) -> Iterator[dict]:
+    """
+    Yield the scrobble rows in a csv or json export file.
+    """
+
+    with open_export(path) as file:
+        if path.lower().removesuffix(".gz").endswith(".json"):
+            for value in iter_json_values(file):
+                for track in iter_json_items(value):
+                    if (row := json_track_to_row(track)) is not None:
+                        yield row
+
+        else:
+            yield from iter_csv_rows(file)
+
+
+def store_new_rows(account_id: int, rows: list[dict]) -> int:
+    """
+    Store the rows the account doesn't have a scrobble of the same
+    track and artist at yet, so an export overlapping what's already
+    stored (or itself) isn't counted twice while different tracks
+    scrobbled in the same second are all kept. A row with a
+    resolution (seconds its timestamp may have been cut down by)
+    matches any scrobble of the track in that window. Exports are in
+    time order, so each batch only has to look at a short range of
+    the account's scrobbles. Returns the number of rows stored.
+    """
+
+    resolutions: list[int] = [row.pop("resolution", 1) for row in rows]
+
+    with Session.begin() as session:
+        stored: list[tuple[int, str, str]] = session.execute(
+            text(
+                "SELECT unix_timestamp, title, artist FROM scrobble "
+                "WHERE account_id = :account_id "
+                "AND unix_timestamp BETWEEN :low AND :high"
+            ),
+            {
+                "account_id": account_id,
+                "low": min(row["unix_timestamp"] for row in rows),
+                "high": max(
+                    row["unix_timestamp"] + resolution - 1
+                    for row, resolution in zip(rows, resolutions)
+                ),
+            },
+        ).all()
+
+    # timestamps stored (or about to be) of each track, in order
+    seen: dict[tuple[str, str], list[int]] = {}
+    for timestamp, title, artist in sorted(stored):
+        seen.setdefault((title, artist), []).append(timestamp)
+
+    new_rows: list[dict] = []
+    for row, resolution in zip(rows, resolutions):
+        timestamp: int = row["unix_timestamp"]
+        timestamps: list[int] = seen.setdefault((row["title"], row["artist"]), [])
+        index: int = bisect.bisect_left(timestamps, timestamp)
+
+        if index < len(timestamps) and timestamps[index] < timestamp + resolution:
+            continue
+
+        timestamps.insert(index, timestamp)
+        new_rows.append(row)
+
+    # store_scrobble_batches keeps the counts and every tally in step
+    return store_scrobble_batches([(account_id, new_rows)])
+
+
+def import_export(
+    username: str, path: str, batch_rows: int = IMPORT_BATCH_ROWS
+) -> tuple[int, int]:
+    """
+    Stream an export file into the last.fm account's scrobbles,
+    batch_rows at a time, creating the account if it isn't stored.
+    Returns the number of rows read and the number stored.
+    """
+
+    with Session.begin() as session:
+        get_or_create_account(session, username)
+
+    account_id: int = get_account(username)[0]
+
+    read: int = 0
+    stored: int = 0
+    batch: list[dict] = []
+
+    for row in iter_export_rows(path):
+        batch.append(row)
+
+        if len(batch) == batch_rows:
+            read += len(batch)
+            stored += store_new_rows(account_id, batch)
+            batch = []
+
+    if batch:
+        read += len(batch)
+        stored += store_new_rows(account_id, batch)
+
+    return read, stored
+
+
+async def fill_from_api(username: str) -> bool:
+    """
+    Fetch whatever the account scrobbled after the export was taken,
+    which is only the pages newer than the newest stored scrobble,
+    then reconcile to fetch any ranges the export was missing.
+    """
+
+    account: tuple[int, str, int] = get_account(username)
+
+    async with LastFMClient(
+        LFM_API_KEY, base_url=LFM_API_URL
+    ) as client, ScrobbleWriter() as writer:
+        if not await update_account_scrobbles(client, writer, *account):
+            return False
+
+        filled: int = await reconcile_account(client, writer, account[0], username)
+        print(f"filled {filled} scrobbles missing from the export")
+
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Seed a last.fm account's scrobbles from an export file."
+    )
+    parser.add_argument("username", help="last.fm username the export belongs to")
+    parser.add_argument(
+        "path", help="csv or json export, optionally gzipped (.csv.gz, .json.gz)"
+    )
+    parser.add_argument(
+        "--no-sync",
+        action="store_true",
+        help="don't fetch scrobbles newer than the export from last.fm afterwards",
+    )
+    args = parser.parse_args()
+
+    start_time: float = time.time()
+    read, stored = import_export(args.username, args.path)
+    print(
+        f"read {read} scrobbles, stored {stored} new ones "
+        f"in {time.time() - start_time:.1f} seconds"
+    )
+
+    if not args.no_sync:
+        asyncio.run(fill_from_api(args.username))
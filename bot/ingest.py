@@ -0,0 +1,191 @@
+### single writer that stores fetched scrobbles in group commits
+
+import asyncio
+import time
+import traceback
+
+from data_interface import store_scrobble_batches
+from metrics import (
+    INGEST_BACKPRESSURE_SECONDS,
+    INGEST_COMMIT_SECONDS,
+    INGEST_GROUP_ROWS,
+    INGEST_ROWS_TOTAL,
+    recent_ingest_commits,
+)
+
+# batches (usually one page of tracks each) allowed to wait for the
+# writer before fetchers are made to wait
+MAX_QUEUED_BATCHES: int = 32
+
+# a group is committed once it has this many rows...
+GROUP_ROWS: int = 2000
+
+# ...or once its first batch has waited this long for more
+GROUP_SECONDS: float = 0.05
+
+
+class WriteAborted(Exception):
+    """
+    Rows not stored because an earlier commit for the same account
+    failed, storing them anyway would leave a hole behind them.
+    """
+
+
+class ScrobbleWriter:
+    """
+    Stores scrobbles for every sync running on the event loop through
+    one writer task, so they don't fight over sqlite's write lock.
+    Fetchers queue batches of rows and the writer commits whatever has
+    queued up together, up to GROUP_ROWS at a time. The queue is
+    bounded, so fetchers slow down when the database falls behind.
+    """
+
+    def __init__(
+        self,
+        max_queued: int = MAX_QUEUED_BATCHES,
+        group_rows: int = GROUP_ROWS,
+        group_seconds: float = GROUP_SECONDS,
+    ):
+        self.group_rows = group_rows
+        self.group_seconds = group_seconds
+
+        # (account id, rows, future resolved once they're committed),
+        # None asks the writer to stop once it's drained
+        self.queue: asyncio.Queue = asyncio.Queue(max_queued)
+        self.task: asyncio.Task = None
+
+        # accounts whose last commit failed, later rows for them are
+        # refused until their next sync starts over
+        self.failed_accounts: set[int] = set()
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        """
+        Stop right away, dropping anything still queued.
+        """
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def close(self) -> None:
+        """
+        Commit everything queued so far, then stop.
+        """
+
+        if self.task is not None:
+            await self.queue.put(None)
+            await self.task
+            self.task = None
+
+    async def __aenter__(self) -> "ScrobbleWriter":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def clear_failure(self, account_id: int) -> None:
+        """
+        Accept rows for the account again, called as a sync of it starts.
+        """
+
+        self.failed_accounts.discard(account_id)
+
+    async def write(self, account_id: int, rows: list[dict]) -> asyncio.Future:
+        """
+        Queue rows to be stored for the account, waiting while the queue
+        is full. Returns a future that resolves once they're committed,
+        or raises if the commit failed. Once a commit for the account
+        fails, its later rows raise WriteAborted instead of being
+        stored, so what's stored never skips over rows that weren't.
+        """
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        start: float = time.perf_counter()
+        await self.queue.put((account_id, rows, future))
+        INGEST_BACKPRESSURE_SECONDS.observe(time.perf_counter() - start)
+
+        return future
+
+    async def _run(self) -> None:
+        stopping: bool = False
+
+        while not stopping:
+            item: tuple = await self.queue.get()
+            if item is None:
+                break
+
+            group: list[tuple] = [item]
+            rows: int = len(item[1])
+            deadline: float = time.monotonic() + self.group_seconds
+
+            while rows < self.group_rows:
+                try:
+                    item = self.queue.get_nowait()
+
+                except asyncio.QueueEmpty:
+                    timeout: float = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+
+                    except asyncio.TimeoutError:
+                        break
+
+                if item is None:
+                    stopping = True
+                    break
+
+                group.append(item)
+                rows += len(item[1])
+
+            await self._commit(group)
+
+    async def _commit(self, group: list[tuple]) -> None:
+        start: float = time.perf_counter()
+
+        aborted: list[tuple] = [
+            item for item in group if item[0] in self.failed_accounts
+        ]
+        for _, _, future in aborted:
+            if not future.done():
+                future.set_exception(WriteAborted())
+
+        group = [item for item in group if item[0] not in self.failed_accounts]
+        if not group:
+            return
+
+        try:
+            stored: int = await asyncio.to_thread(
+                store_scrobble_batches,
+                [(account_id, rows) for account_id, rows, _ in group],
+            )
+
+        except Exception as error:
+            traceback.print_exc()
+            for account_id, _, future in group:
+                self.failed_accounts.add(account_id)
+                if not future.done():
+                    future.set_exception(error)
+
+            return
+
+        seconds: float = time.perf_counter() - start
+        INGEST_COMMIT_SECONDS.observe(seconds)
+        INGEST_GROUP_ROWS.observe(stored)
+        INGEST_ROWS_TOTAL.inc(stored)
+        recent_ingest_commits.append((time.monotonic(), stored, seconds))
+
+        for _, _, future in group:
+            if not future.done():
+                future.set_result(None)
@@ -1,4 +1,5 @@
-from asyncio import tasks
+import asyncio
+import tempfile
 import traceback
 
 import discord
@@ -14,6 +15,7 @@ from discord.ext.commands.errors import CommandOnCooldown
 import pylast
 
 import datetime
+import zoneinfo
 from enum import Enum
 from random import choice
 import requests
@@ -21,6 +23,9 @@ import requests
 from data_interface import (
     store_user,
     update_user,
+    get_account_timezone,
+    get_user_timezone,
+    set_user_timezone,
     retrieve_lfm_username,
     get_lfm_username,
     get_lfm_username,
@@ -30,8 +35,18 @@ from data_interface import (
 )
 from image import combine_images, update_embed_color
 from io import BytesIO
-from main import LFM_API_KEY, LFM_API_SECRET
+from lfm_api import AsyncLastFM, UserProfile
+from lfm_client import AlbumMatch, LastFMClient, LastFMError
+from config import IN_BOT_SYNC, LFM_API_KEY, LFM_API_URL, SYNC_WAIT_MS
+from metrics import query_budget, span
+from sync_service import URGENT, SyncService
+from taste import ArtistVector, ArtistVectorCache, cosine_similarity, shared_top_artists
 from spotify import get_artist_image_url, get_track_image_url, get_album_image_url
+from heatmap import create_heatmap
+from wrapped import build_wrapped_reports, get_wrapped_report
+from export import write_export
+from reconcile import reconcile_accounts
+from rollups import DayRuns, get_day_runs, get_local_day_start, get_window_counts
 from PIL import Image
 
 from cmd_data_helpers import StrippedTrack, StrippedArtist, StrippedAlbum
@@ -42,9 +57,13 @@ from cmd_data_helpers import (
     get_x_top_artists,
     get_x_top_albums,
     get_relative_unix_timestamp,
+    get_date_range_timestamps,
     get_single_track_info,
     get_discord_relative_timestamp,
-    retrieve_all_lfm_names,
+    get_all_user_scrobble_counts,
+    get_play_leaderboard,
+    get_account_ids,
+    get_nth_scrobble,
 )
 
 guilds = [
@@ -66,6 +85,17 @@ PERIODS = {
 
 CMD_TIME_CHOICES = list(PERIODS.keys())
 
+TIMEZONES: list[str] = sorted(zoneinfo.available_timezones())
+
+# members listed by /whoknows
+WHOKNOWS_SIZE: int = 10
+
+# shared artists listed by /compare
+SHARED_ARTIST_COUNT: int = 10
+
+# members listed by /compatible
+COMPATIBLE_COUNT: int = 5
+
 BLOB_JAMMIN: str = "<a:blobjammin:988683824860921857>"  # emote
 
 
@@ -94,13 +124,71 @@ class LastFM(commands.Cog):
         self.bot: discord.Bot = bot
         self.status = None
 
-        self.network = pylast.LastFMNetwork(
-            api_key=LFM_API_KEY,
-            api_secret=LFM_API_SECRET,
+        # cached, non-blocking access to the last.fm calls commands make
+        self.lastfm = AsyncLastFM(LastFMClient(LFM_API_KEY, base_url=LFM_API_URL))
+
+        # artist play counts of recently compared accounts
+        self.taste = ArtistVectorCache()
+
+        # optional replacement for running data_grabber.py separately
+        self.sync: SyncService = (
+            SyncService(self.lastfm.client) if IN_BOT_SYNC else None
         )
 
         self.change_status.start()
 
+        # the grabber builds the wrapped reports and reconciles
+        # history when it runs separately
+        if self.sync is not None:
+            self.build_reports.start()
+            self.reconcile_history.start()
+
+    def cog_unload(self):
+        self.change_status.cancel()
+        if self.sync is not None:
+            self.sync.stop()
+            self.build_reports.cancel()
+            self.reconcile_history.cancel()
+        self.bot.loop.create_task(self.lastfm.client.close())
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self.sync is not None:
+            self.sync.start()
+
+    async def refresh_scrobbles(self, lfm_user: str) -> None:
+        """
+        Give the sync service a moment to store the user's newest
+        scrobbles before a command reads them. Commands go ahead with
+        what's stored if it takes longer.
+        """
+
+        if self.sync is not None:
+            await self.sync.sync_now(lfm_user, SYNC_WAIT_MS)
+
+    def get_period_bounds(
+        self, discord_id: int, period: str, start: str, end: str
+    ) -> tuple[int, int, str]:
+        """
+        Return the unix timestamps scrobbles have to fall strictly
+        between, and a name for the period. Dates given by the user
+        override the period and are read in their time zone. Raises
+        ValueError for dates that can't be parsed.
+        """
+
+        if start is None and end is None:
+            after: int = get_relative_unix_timestamp(PERIODS[period]) or 0
+            return after, 2147483647, period
+
+        after, before = get_date_range_timestamps(
+            start, end, get_user_timezone(discord_id)
+        )
+
+        if end is None:
+            return after, before, start
+
+        return after, before, f"{start or 'start'} to {end}"
+
     lfm = SlashCommandGroup(
         "lfm",
         "Commands related to last.fm.",
@@ -116,6 +204,11 @@ class LastFM(commands.Cog):
         "View charts on your top artists or tracks!",
     )
 
+    whoknows = SlashCommandGroup(
+        "whoknows",
+        "See who in this server has played something the most!",
+    )
+
     pfp = SlashCommandGroup(
         "pfp",
         "Commands related to the bot's profile picture!",
@@ -151,8 +244,35 @@ class LastFM(commands.Cog):
     async def before_change_status(self):
         await self.bot.wait_until_ready()
 
+    @tasks.loop(hours=1)
+    async def build_reports(self):
+        """
+        Build any missing or out of date wrapped reports, off the
+        event loop since rendering the charts blocks.
+        """
+
+        await asyncio.to_thread(build_wrapped_reports)
+
+    @build_reports.before_loop
+    async def before_build_reports(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(hours=24)
+    async def reconcile_history(self):
+        """
+        Fill in scrobbles syncing missed, through the sync
+        service's client and writer.
+        """
+
+        await reconcile_accounts(self.sync.client, self.sync.writer)
+
+    @reconcile_history.before_loop
+    async def before_reconcile_history(self):
+        await self.bot.wait_until_ready()
+
     @has_set_lfm_user()
     @slash_command(name="scrobbles")
+    @query_budget(5)
     async def scrobbles(self, ctx: ApplicationContext, user: discord.User = None):
         """
         Display how many total scrobbles the user has.
@@ -170,12 +290,15 @@ class LastFM(commands.Cog):
             )
             return
 
+        await self.refresh_scrobbles(name)
+
         num_scrobbles = get_number_user_scrobbles_stored(user_id)
 
         await ctx.respond(f"{name} has **{num_scrobbles}** total scrobbles!")
 
     @has_set_lfm_user()
     @slash_command(name="now")
+    @query_budget(3)
     async def now_listening(self, ctx: ApplicationContext, user: discord.User = None):
         """
         Displays what you are currently listening to. Supply name with last.fm account
@@ -193,54 +316,49 @@ class LastFM(commands.Cog):
             )
             return
 
-        user: pylast.User = self.network.get_user(name)
+        track, profile = await asyncio.gather(
+            self.lastfm.get_now_playing(name), self.lastfm.get_user_profile(name)
+        )
 
-        track = user.get_now_playing()
         if track is None:
 
             await ctx.respond(
-                f"**{user.get_name()}** is not currently listening to any track!"
+                f"**{profile.name}** is not currently listening to any track!"
             )
             return
-        track.username = name
 
-        embed_desc = f"{BLOB_JAMMIN} **[{track.get_title()}]({track.get_url()})** - {track.artist}\n{track.get_album().get_name()}"
+        embed_desc = f"{BLOB_JAMMIN} **[{track.title}]({track.lfm_url})** - {track.artist}\n{track.album}"
 
         embed = discord.Embed(
             color=discord.Color.gold(),
             description=embed_desc,
         )
 
-        image_url = user.get_image()
-
-        if image_url:
+        if profile.image_url:
             embed.set_author(
-                name=f"{user.get_name()} - Now Listening",
-                icon_url=image_url,
+                name=f"{profile.name} - Now Listening",
+                icon_url=profile.image_url,
             )
 
         else:  # if user has no image leave off icon
             embed.set_author(
-                name=f"{user.get_name()} - Now Listening",
+                name=f"{profile.name} - Now Listening",
             )
 
-        try:
+        if track.user_plays is not None:
             embed.set_footer(
-                text=f"{user.get_name()} has scrobbled this track {track.get_userplaycount()} times!"
+                text=f"{profile.name} has scrobbled this track {track.user_plays} times!"
             )
-        except pylast.WSError as e:  # occurs sometimes when can't get track playcount? look more in depth later
-            print(f"Error, likely due to failed retrieving track.get_userplaycount()")
 
-        track_image_url = track.get_cover_image()
-
-        if track_image_url:
-            embed.set_thumbnail(url=track_image_url)
+        if track.image_url:
+            embed.set_thumbnail(url=track.image_url)
             embed = update_embed_color(embed)
 
         await ctx.respond(embed=embed)
 
     @has_set_lfm_user()
     @slash_command(name="recent")
+    @query_budget(8)
     async def recent_tracks(
         self, ctx: ApplicationContext, user: discord.User = None
     ) -> None:
@@ -252,11 +370,6 @@ class LastFM(commands.Cog):
 
         # if user supplied, set lfm_user to their last.fm username & return if they have none set
         name: str = get_lfm_username(ctx.user.id, user)
-        user: pylast.User = self.network.get_user(name)
-
-        # for some reason, track.get_userplaycount()implicitly uses
-        # self.network.username so i suppose i have to set this for each user
-        self.network.username = name
 
         if name is None:
             await ctx.respond(
@@ -264,76 +377,74 @@ class LastFM(commands.Cog):
             )
             return
 
-        now_playing: pylast.Track = user.get_now_playing()
+        await self.refresh_scrobbles(name)
+
+        # stored scrobbles cover everything but the track playing right now,
+        # so that's the only thing last.fm needs asking for
+        now_playing, profile = await asyncio.gather(
+            self.lastfm.get_now_playing(name), self.lastfm.get_user_profile(name)
+        )
         track_limit = (
             4 if now_playing else 5
         )  # only get 4 tracks if user is already playing a 5th
 
-        tracks: list[pylast.PlayedTrack] = user.get_recent_tracks(limit=track_limit)
+        tracks: list[StrippedTrack] = await asyncio.to_thread(
+            get_x_recent_tracks, name, track_limit
+        )
 
-        if len(tracks) == 0:
+        if len(tracks) == 0 and now_playing is None:
             await ctx.respond(f"{ctx.user.mention}, this user has no scrobbled tracks!")
             return
 
         embed = discord.Embed()
 
-        image_url = user.get_image()
-
-        if image_url:
+        if profile.image_url:
             embed.set_author(
-                name=f"{user.get_name()}'s recently played tracks",
-                icon_url=image_url,
+                name=f"{profile.name}'s recently played tracks",
+                icon_url=profile.image_url,
             )
 
         else:  # if user has no image leave off icon
             embed.set_author(
-                name=f"{user.get_name()}'s recently played tracks",
+                name=f"{profile.name}'s recently played tracks",
             )
 
         embed_string: str = ""
         if now_playing:
-            cover_image: str = now_playing.get_cover_image()
-
-            embed.set_thumbnail(url=cover_image)
+            embed.set_thumbnail(url=now_playing.image_url)
 
             # off set the song nums by 2 if listening song currently
             # one to start counting from 1, and 2 if now_playing is the #1
             number_offset: int = 2
 
-            track_name, track_artist = now_playing.get_name(), now_playing.get_artist()
-            embed_string += f"{BLOB_JAMMIN} **[{track_name}]({now_playing.get_url()})** - {track_artist}\n"
+            embed_string += f"{BLOB_JAMMIN} **[{now_playing.title}]({now_playing.lfm_url})** - {now_playing.artist}\n"
 
-            if (np_track_album := now_playing.get_album()) is not None:
-                embed_string += f"{np_track_album.get_name()} | {now_playing.get_userplaycount()} scrobbles\n\n"
+            if now_playing.album is not None:
+                embed_string += (
+                    f"{now_playing.album} | {now_playing.user_plays} scrobbles\n\n"
+                )
 
             else:
-                embed_string += f"{now_playing.get_playcount()} scrobbles\n\n"
+                embed_string += f"{now_playing.user_plays} scrobbles\n\n"
 
         else:
             number_offset: int = 1
-            cover_image: str = None
-
-        for i, song in enumerate(tracks):
-            if number_offset == 2 and i == 4:
-                break
-
-            track: pylast.Track = song.track
 
+        for i, track in enumerate(tracks):
             if not embed.thumbnail.url and i == 0:
                 if (
                     cover_image_url := get_track_image_url(track.title, track.artist)
                 ) is not None:
                     embed.set_thumbnail(url=cover_image_url)
 
-            playcount: int = track.get_userplaycount()
+            embed_string += f"{i+number_offset}) **[{track.title}]({track.lfm_url})** - {track.artist}\n"
+            embed_string += f"{track.album} | {track.track_plays} scrobbles\n\n"
 
-            embed_string += f"{i+number_offset}) **[{track.title}]({track.get_url()})** - {track.artist}\n"
-            embed_string += f"{song.album} | {playcount} scrobbles\n\n"
+        discord_id: int = ctx.user.id if user is None else user.id
+        total_scrobbles: int = get_number_user_scrobbles_stored(discord_id)
 
         embed.description = embed_string
-        embed.set_footer(
-            text=f"{user.get_name()} has {user.get_playcount()} total scrobbles!"
-        )
+        embed.set_footer(text=f"{profile.name} has {total_scrobbles} total scrobbles!")
         embed = update_embed_color(embed)
 
         await ctx.respond(embed=embed)
@@ -350,10 +461,8 @@ class LastFM(commands.Cog):
 
         await ctx.defer()
 
-        user: pylast.User = self.network.get_user(lfm_user)
-
         try:
-            user.get_recent_tracks(limit=1)
+            await self.lastfm.client.get_recent_tracks(lfm_user, limit=1)
 
         except:
             await ctx.respond(
@@ -365,6 +474,10 @@ class LastFM(commands.Cog):
 
         result: bool = store_user(ctx.user.id, lfm_user)
 
+        # start collecting a newly linked account's history right away
+        if result and self.sync is not None:
+            self.sync.enqueue(lfm_user, URGENT)
+
         profile_link: str = f"https://www.last.fm/user/{lfm_user}"
         footer_msg: str = "It may take several minutes to collect all your scrobbles!"
 
@@ -388,6 +501,9 @@ class LastFM(commands.Cog):
 
             # successful update
             if update_result:
+                if self.sync is not None:
+                    self.sync.enqueue(lfm_user, URGENT)
+
                 embed.description = (
                     f"Successfully updated your stored last.fm account to `{lfm_user}`!"
                 )
@@ -405,6 +521,39 @@ class LastFM(commands.Cog):
                 ctx.command.reset_cooldown(ctx)
                 return
 
+    @has_set_lfm_user()
+    @lfm.command(
+        name="timezone", description="Set the time zone your days are counted in."
+    )
+    @option(
+        name="timezone",
+        type=str,
+        description="Your time zone, like Europe/Berlin or America/New_York",
+        autocomplete=discord.utils.basic_autocomplete(TIMEZONES),
+    )
+    async def lfm_timezone_set(self, ctx: ApplicationContext, timezone: str) -> None:
+        """
+        Store the user's time zone, which daily stats like overview
+        and streaks split days by.
+        """
+
+        if timezone not in TIMEZONES:
+            await ctx.respond(
+                f"{ctx.user.mention}, `{timezone}` isn't a time zone I know! Try picking one from the list.",
+                ephemeral=True,
+            )
+            return
+
+        set_user_timezone(ctx.user.id, timezone)
+
+        local_time: datetime.datetime = datetime.datetime.now(
+            zoneinfo.ZoneInfo(timezone)
+        )
+        await ctx.respond(
+            f"{ctx.user.mention}, your time zone is now `{timezone}`, where it's {local_time:%H:%M}.",
+            ephemeral=True,
+        )
+
     @has_set_lfm_user()
     @top.command(name="artists", description="See a list of your top ten artists.")
     @option(
@@ -415,11 +564,28 @@ class LastFM(commands.Cog):
         required=False,
         default="overall",
     )
+    @option(
+        name="start",
+        type=str,
+        description="Day (2022-05-17), month (2022-05) or year (2022) to count from instead",
+        required=False,
+        default=None,
+    )
+    @option(
+        name="end",
+        type=str,
+        description="Day, month or year to count up to, otherwise just the start's",
+        required=False,
+        default=None,
+    )
+    @query_budget(15)
     async def top_artists(
         self,
         ctx: ApplicationContext,
         user: discord.User = None,
         period: str = "overall",
+        start: str = None,
+        end: str = None,
     ) -> None:
         """
         Display the user's top 10 artists, and how many scrobbles
@@ -438,17 +604,23 @@ class LastFM(commands.Cog):
             )
             return
 
+        await self.refresh_scrobbles(name)
+
         embed = discord.Embed(color=discord.Color.gold())
-        user: pylast.User = self.network.get_user(name)
 
-        lfm_period = PERIODS[period]
-        relative_timestamp: int = get_relative_unix_timestamp(lfm_period)
+        try:
+            after, before, period = self.get_period_bounds(
+                discord_id, period, start, end
+            )
 
-        if relative_timestamp is None:
-            relative_timestamp = 0
+        except ValueError:
+            await ctx.respond(
+                f"{ctx.user.mention}, dates should look like 2022-05-17, 2022-05 or 2022!"
+            )
+            return
 
         stripped_artists: list[StrippedArtist] = get_x_top_artists(
-            name, 10, relative_timestamp
+            name, 10, after, before
         )
 
         if len(stripped_artists) == 0:
@@ -483,17 +655,18 @@ class LastFM(commands.Cog):
             text=f"These artists make up {percent_scrobbles:0.2f}% of {name}'s total scrobbles!"
         )
 
-        image_url = user.get_image()
+        profile: UserProfile = await self.lastfm.get_user_profile(name)
+        image_url = profile.image_url
 
         if image_url:
 
             embed.set_author(
-                name=f"{user.get_name()}'s Top 10 Artists ({period})",
+                name=f"{profile.name}'s Top 10 Artists ({period})",
                 icon_url=image_url,
             )
 
         else:
-            embed.set_author(name=f"{user.get_name()}'s Top 10 Artists ({period})")
+            embed.set_author(name=f"{profile.name}'s Top 10 Artists ({period})")
 
         await ctx.respond(embed=embed)
 
@@ -507,11 +680,28 @@ class LastFM(commands.Cog):
         required=False,
         default="overall",
     )
+    @option(
+        name="start",
+        type=str,
+        description="Day (2022-05-17), month (2022-05) or year (2022) to count from instead",
+        required=False,
+        default=None,
+    )
+    @option(
+        name="end",
+        type=str,
+        description="Day, month or year to count up to, otherwise just the start's",
+        required=False,
+        default=None,
+    )
+    @query_budget(15)
     async def top_tracks(
         self,
         ctx: ApplicationContext,
         user: discord.User = None,
         period: str = "overall",
+        start: str = None,
+        end: str = None,
     ) -> None:
         """
         Display the user's top 10 tracks, and how many scrobbles
@@ -530,19 +720,22 @@ class LastFM(commands.Cog):
             )
             return
 
+        await self.refresh_scrobbles(name)
+
         embed = discord.Embed(color=discord.Color.gold())
-        user: pylast.User = self.network.get_user(name)
 
-        lfm_period = PERIODS[period]
-        relative_timestamp: int = get_relative_unix_timestamp(lfm_period)
+        try:
+            after, before, period = self.get_period_bounds(
+                discord_id, period, start, end
+            )
 
-        # set to 0 since any song after unix time "0" includes all songs anyway
-        if relative_timestamp is None:
-            relative_timestamp = 0
+        except ValueError:
+            await ctx.respond(
+                f"{ctx.user.mention}, dates should look like 2022-05-17, 2022-05 or 2022!"
+            )
+            return
 
-        stripped_tracks: list[StrippedTrack] = get_x_top_tracks(
-            name, 10, relative_timestamp
-        )
+        stripped_tracks: list[StrippedTrack] = get_x_top_tracks(name, 10, after, before)
 
         if len(stripped_tracks) == 0:
             await ctx.respond(
@@ -574,15 +767,16 @@ class LastFM(commands.Cog):
             text=f"These tracks make up {percent_scrobbles:0.2f}% of {name}'s total scrobbles!"
         )
 
-        image_url = user.get_image()
+        profile: UserProfile = await self.lastfm.get_user_profile(name)
+        image_url = profile.image_url
 
         if image_url:
             embed.set_author(
-                name=f"{user.get_name()}'s Top 10 Tracks ({period})",
+                name=f"{profile.name}'s Top 10 Tracks ({period})",
                 icon_url=image_url,
             )
         else:
-            embed.set_author(name=f"{user.get_name()}'s Top 10 Tracks ({period})")
+            embed.set_author(name=f"{profile.name}'s Top 10 Tracks ({period})")
 
         await ctx.respond(embed=embed)
 
@@ -596,11 +790,28 @@ class LastFM(commands.Cog):
         required=False,
         default="overall",
     )
+    @option(
+        name="start",
+        type=str,
+        description="Day (2022-05-17), month (2022-05) or year (2022) to count from instead",
+        required=False,
+        default=None,
+    )
+    @option(
+        name="end",
+        type=str,
+        description="Day, month or year to count up to, otherwise just the start's",
+        required=False,
+        default=None,
+    )
+    @query_budget(15)
     async def top_albums(
         self,
         ctx: ApplicationContext,
         user: discord.User = None,
         period: str = "overall",
+        start: str = None,
+        end: str = None,
     ) -> None:
         """
         Display the user's top 10 album, and how many scrobbles
@@ -619,19 +830,22 @@ class LastFM(commands.Cog):
             )
             return
 
+        await self.refresh_scrobbles(name)
+
         embed = discord.Embed(color=discord.Color.gold())
-        user: pylast.User = self.network.get_user(name)
 
-        lfm_period = PERIODS[period]
-        relative_timestamp: int = get_relative_unix_timestamp(lfm_period)
+        try:
+            after, before, period = self.get_period_bounds(
+                discord_id, period, start, end
+            )
 
-        # set to 0 since any song after unix time "0" includes all songs anyway
-        if relative_timestamp is None:
-            relative_timestamp = 0
+        except ValueError:
+            await ctx.respond(
+                f"{ctx.user.mention}, dates should look like 2022-05-17, 2022-05 or 2022!"
+            )
+            return
 
-        stripped_albums: list[StrippedAlbum] = get_x_top_albums(
-            name, 10, relative_timestamp
-        )
+        stripped_albums: list[StrippedAlbum] = get_x_top_albums(name, 10, after, before)
 
         if len(stripped_albums) == 0:
             await ctx.respond(
@@ -664,20 +878,22 @@ class LastFM(commands.Cog):
             text=f"These albums make up {percent_scrobbles:0.2f}% of {name}'s total scrobbles!"
         )
 
-        image_url = user.get_image()
+        profile: UserProfile = await self.lastfm.get_user_profile(name)
+        image_url = profile.image_url
 
         if image_url:
             embed.set_author(
-                name=f"{user.get_name()}'s Top 10 Albums ({period})",
+                name=f"{profile.name}'s Top 10 Albums ({period})",
                 icon_url=image_url,
             )
         else:
-            embed.set_author(name=f"{user.get_name()}'s Top 10 Albums ({period})")
+            embed.set_author(name=f"{profile.name}'s Top 10 Albums ({period})")
 
         await ctx.respond(embed=embed)
 
     @has_set_lfm_user()
     @slash_command(name="track", description="See info about a single track.")
+    @query_budget(8)
     async def track_info(
         self,
         ctx: ApplicationContext,
@@ -689,6 +905,8 @@ class LastFM(commands.Cog):
         Display info about a single track.
         """
 
+        await ctx.defer()
+
         # if user supplied, set lfm_user to their last.fm username & return if they have none set
         name: str = get_lfm_username(ctx.user.id, user)
         discord_id = ctx.user.id if user is None else user.id
@@ -699,6 +917,8 @@ class LastFM(commands.Cog):
             )
             return
 
+        await self.refresh_scrobbles(name)
+
         track_data = get_single_track_info(discord_id, track_title, track_artist)
 
         if track_data is None:
@@ -717,13 +937,12 @@ class LastFM(commands.Cog):
             await ctx.respond("Unable to find track!")
             return
 
-        user: pylast.User = self.network.get_user(name)
-
         embed = discord.Embed(
             color=discord.Color.gold(),
         )
 
-        user_image = user.get_image()
+        profile: UserProfile = await self.lastfm.get_user_profile(name)
+        user_image = profile.image_url
 
         if user_image:
             embed.set_author(
@@ -760,11 +979,28 @@ class LastFM(commands.Cog):
         required=False,
         default="overall",
     )
+    @option(
+        name="start",
+        type=str,
+        description="Day (2022-05-17), month (2022-05) or year (2022) to count from instead",
+        required=False,
+        default=None,
+    )
+    @option(
+        name="end",
+        type=str,
+        description="Day, month or year to count up to, otherwise just the start's",
+        required=False,
+        default=None,
+    )
+    @query_budget(20)
     async def artist_chart(
         self,
         ctx: ApplicationContext,
         user: discord.User = None,
         period: str = "overall",
+        start: str = None,
+        end: str = None,
     ) -> None:
         """
         Displays a 3x3 chart of the user's top 9 artists.
@@ -774,6 +1010,7 @@ class LastFM(commands.Cog):
 
         # if user supplied, set lfm_user to their last.fm username & return if they have none set
         name: str = get_lfm_username(ctx.user.id, user)
+        discord_id = ctx.user.id if user is None else user.id
 
         if name is None:
             await ctx.respond(
@@ -781,15 +1018,22 @@ class LastFM(commands.Cog):
             )
             return
 
-        lfm_period = PERIODS[period]
-        relative_timestamp: int = get_relative_unix_timestamp(lfm_period)
+        await self.refresh_scrobbles(name)
 
-        if relative_timestamp is None:
-            relative_timestamp = 0
+        try:
+            after, before, period = self.get_period_bounds(
+                discord_id, period, start, end
+            )
+
+        except ValueError:
+            await ctx.respond(
+                f"{ctx.user.mention}, dates should look like 2022-05-17, 2022-05 or 2022!"
+            )
+            return
 
         NUM_ARTISTS = 9
         top_artists: list[StrippedArtist] = get_x_top_artists(
-            name, NUM_ARTISTS + 5, relative_timestamp
+            name, NUM_ARTISTS + 5, after, before
         )
 
         top_artist_urls: list[str] = []
@@ -835,11 +1079,28 @@ class LastFM(commands.Cog):
         required=False,
         default="overall",
     )
+    @option(
+        name="start",
+        type=str,
+        description="Day (2022-05-17), month (2022-05) or year (2022) to count from instead",
+        required=False,
+        default=None,
+    )
+    @option(
+        name="end",
+        type=str,
+        description="Day, month or year to count up to, otherwise just the start's",
+        required=False,
+        default=None,
+    )
+    @query_budget(20)
     async def album_chart(
         self,
         ctx: ApplicationContext,
         user: discord.User = None,
         period: str = "overall",
+        start: str = None,
+        end: str = None,
     ) -> None:
         """
         Displays a 3x3 chart of the user's top 9 albums.
@@ -849,6 +1110,7 @@ class LastFM(commands.Cog):
 
         # if user supplied, set lfm_user to their last.fm username & return if they have none set
         name: str = get_lfm_username(ctx.user.id, user)
+        discord_id = ctx.user.id if user is None else user.id
 
         if name is None:
             await ctx.respond(
@@ -856,15 +1118,22 @@ class LastFM(commands.Cog):
             )
             return
 
-        lfm_period = PERIODS[period]
-        relative_timestamp: int = get_relative_unix_timestamp(lfm_period)
+        await self.refresh_scrobbles(name)
 
-        if relative_timestamp is None:
-            relative_timestamp = 0
+        try:
+            after, before, period = self.get_period_bounds(
+                discord_id, period, start, end
+            )
+
+        except ValueError:
+            await ctx.respond(
+                f"{ctx.user.mention}, dates should look like 2022-05-17, 2022-05 or 2022!"
+            )
+            return
 
         NUM_ALBUMS = 9
         top_albums: list[StrippedAlbum] = get_x_top_albums(
-            name, NUM_ALBUMS + 5, relative_timestamp
+            name, NUM_ALBUMS + 5, after, before
         )
 
         top_album_urls: list[str] = []
@@ -901,12 +1170,337 @@ class LastFM(commands.Cog):
 
         await ctx.send(embed=embed)
 
+    @has_set_lfm_user()
+    @slash_command(
+        name="heatmap", description="See when you listen, by weekday and hour."
+    )
+    @option(
+        name="period",
+        type=str,
+        description="Decides the period of time to show your listening for",
+        choices=CMD_TIME_CHOICES,
+        required=False,
+        default="overall",
+    )
+    @query_budget(5)
+    async def heatmap(
+        self,
+        ctx: ApplicationContext,
+        user: discord.User = None,
+        period: str = "overall",
+    ) -> None:
+        """
+        Display a weekday by hour grid of how much the user listens.
+        """
+
+        await ctx.defer()
+
+        # if user supplied, set lfm_user to their last.fm username & return if they have none set
+        name: str = get_lfm_username(ctx.user.id, user)
+        discord_id = ctx.user.id if user is None else user.id
+
+        if name is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, this user does not have a last.fm username set!"
+            )
+            return
+
+        await self.refresh_scrobbles(name)
+
+        relative_timestamp: int = get_relative_unix_timestamp(PERIODS[period]) or 0
+
+        tz: zoneinfo.ZoneInfo = get_user_timezone(discord_id)
+
+        # fetching, binning and drawing all block, keep them off the event loop
+        heatmap_image: Image = await asyncio.to_thread(
+            create_heatmap,
+            discord_id,
+            relative_timestamp,
+            tz,
+            f"When {name} listens ({period}, {tz.key})",
+        )
+
+        with BytesIO() as image_binary:
+            heatmap_image.save(image_binary, "PNG")
+            image_binary.seek(0)
+            await ctx.respond(
+                file=discord.File(fp=image_binary, filename=f"{name}_heatmap.png")
+            )
+
+    @has_set_lfm_user()
+    @slash_command(
+        name="streak", description="See how many days in a row you've listened."
+    )
+    @option(
+        name="artist",
+        type=str,
+        description="Only count days you listened to this artist",
+        required=False,
+        default=None,
+    )
+    @query_budget(5)
+    async def streak(
+        self,
+        ctx: ApplicationContext,
+        user: discord.User = None,
+        artist: str = None,
+    ) -> None:
+        """
+        Show the user's current and longest runs of consecutive days
+        with scrobbles, in their time zone, optionally for one artist.
+        """
+
+        await ctx.defer()
+
+        # if user supplied, set lfm_user to their last.fm username & return if they have none set
+        name: str = get_lfm_username(ctx.user.id, user)
+        discord_id = ctx.user.id if user is None else user.id
+
+        if name is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, this user does not have a last.fm username set!"
+            )
+            return
+
+        await self.refresh_scrobbles(name)
+
+        account_id, tz = get_account_timezone(discord_id)
+        if account_id is None:
+            await ctx.respond(f"No scrobbles stored for {name} yet!")
+            return
+
+        # read from the day rollups, one row per day with scrobbles
+        runs: DayRuns = await asyncio.to_thread(get_day_runs, account_id, tz, artist)
+
+        current, current_start = runs.current_streak(datetime.datetime.now(tz).date())
+        longest, longest_start, longest_end = runs.longest_streak()
+
+        if longest == 0:
+            await ctx.respond(
+                f"{name} hasn't listened to {artist} yet!"
+                if artist
+                else f"No scrobbles stored for {name} yet!"
+            )
+            return
+
+        embed = discord.Embed(
+            title=f"{name}'s {artist + ' ' if artist else ''}listening streak"
+        )
+        embed.description = (
+            f"Current streak: `{current}` days"
+            + (f" (since {current_start:%B %d, %Y})" if current else "")
+            + f"\nLongest streak: `{longest}` days "
+            f"({longest_start:%B %d, %Y} - {longest_end:%B %d, %Y})"
+        )
+        embed.set_footer(text=f"Days counted in {tz.key}")
+
+        await ctx.respond(embed=embed)
+
+    @has_set_lfm_user()
+    @slash_command(
+        name="milestone", description="See which track was one of your milestones."
+    )
+    @option(
+        name="number",
+        type=int,
+        description="Which scrobble to look up, such as 10000 for your 10,000th",
+        min_value=1,
+    )
+    @query_budget(5)
+    async def milestone(
+        self, ctx: ApplicationContext, number: int, user: discord.User = None
+    ) -> None:
+        """
+        Show the user's scrobble with the given number, counting
+        from their first.
+        """
+
+        await ctx.defer()
+
+        # if user supplied, set lfm_user to their last.fm username & return if they have none set
+        name: str = get_lfm_username(ctx.user.id, user)
+        discord_id = ctx.user.id if user is None else user.id
+
+        if name is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, this user does not have a last.fm username set!"
+            )
+            return
+
+        await self.refresh_scrobbles(name)
+
+        account_id: int = get_account_ids([discord_id]).get(discord_id)
+        track: StrippedTrack = (
+            get_nth_scrobble(account_id, number) if account_id else None
+        )
+
+        if track is None:
+            await ctx.respond(f"{name} hasn't reached {number:,} scrobbles yet!")
+            return
+
+        embed = discord.Embed(title=f"{name}'s scrobble #{number:,}")
+        embed.description = (
+            f"[{track.title}]({track.lfm_url}) by "
+            f"[{track.artist}]({get_artist_lfm_link(track.artist)})\n"
+            f"Scrobbled <t:{track.unix_timestamp}:F>"
+        )
+
+        if image_url := get_track_image_url(track.title, track.artist):
+            embed.set_thumbnail(url=image_url)
+            embed = update_embed_color(embed)
+
+        await ctx.respond(embed=embed)
+
+    @has_set_lfm_user()
+    @slash_command(name="wrapped", description="See your year in review.")
+    @option(
+        name="year",
+        type=int,
+        description="Year to look back on, this year if not given",
+        required=False,
+        default=None,
+    )
+    @query_budget(3)
+    async def wrapped(
+        self, ctx: ApplicationContext, year: int = None, user: discord.User = None
+    ) -> None:
+        """
+        Show the user's year in review. Reports are built ahead of
+        time by a batch job, so this only reads the stored one.
+        """
+
+        # if user supplied, set lfm_user to their last.fm username & return if they have none set
+        name: str = get_lfm_username(ctx.user.id, user)
+        discord_id = ctx.user.id if user is None else user.id
+
+        if name is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, this user does not have a last.fm username set!"
+            )
+            return
+
+        if year is None:
+            year = datetime.datetime.utcnow().year
+
+        stored: tuple[dict, bytes, int] = get_wrapped_report(discord_id, year)
+
+        if stored is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, {name}'s {year} wrapped isn't ready, check back later!"
+            )
+            return
+
+        report, image, built_at = stored
+
+        embed = discord.Embed(
+            title=f"{name}'s {year} wrapped",
+            description=f"`{report['scrobbles']}` scrobbles over "
+            f"`{report['listening_days']}` of {report['days_in_year']} days",
+            color=discord.Color.gold(),
+        )
+
+        embed.add_field(
+            name="Top artists",
+            value="\n".join(
+                f"{i+1}) [{artist}]({get_artist_lfm_link(artist)}) - **{plays}**"
+                for i, (artist, plays) in enumerate(report["top_artists"])
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="Top albums",
+            value="\n".join(
+                f"{i+1}) [{album}]({get_album_lfm_link(artist, album)}) - **{plays}**"
+                for i, (album, artist, plays) in enumerate(report["top_albums"])
+            )
+            or "None",
+            inline=False,
+        )
+        embed.add_field(
+            name="Top tracks",
+            value="\n".join(
+                f"{i+1}) [{title}]({lfm_url}) - **{plays}**"
+                for i, (title, artist, lfm_url, plays) in enumerate(
+                    report["top_tracks"]
+                )
+            ),
+            inline=False,
+        )
+
+        if report["biggest_day"]:
+            day, plays = report["biggest_day"]
+            embed.add_field(
+                name="Biggest day",
+                value=f"{datetime.date.fromisoformat(day):%B %d} - `{plays}` scrobbles",
+            )
+
+        embed.add_field(
+            name="New artists",
+            value=f"`{report['new_artists']}` discovered"
+            + "".join(
+                f"\n[{artist}]({get_artist_lfm_link(artist)}) - **{plays}**"
+                for artist, plays in report["top_new_artists"]
+            ),
+        )
+
+        embed.set_footer(text="Days counted in UTC")
+        embed.timestamp = datetime.datetime.fromtimestamp(
+            built_at, datetime.timezone.utc
+        )
+
+        if image is None:
+            await ctx.respond(embed=embed)
+            return
+
+        embed.set_image(url=f"attachment://{year}_wrapped.png")
+        with BytesIO(image) as image_binary:
+            await ctx.respond(
+                embed=embed,
+                file=discord.File(fp=image_binary, filename=f"{year}_wrapped.png"),
+            )
+
+    @has_set_lfm_user()
+    @slash_command(name="export", description="Download every scrobble stored for you.")
+    @commands.cooldown(1, (60 * 10), commands.BucketType.user)
+    @query_budget(5)
+    async def export(self, ctx: ApplicationContext) -> None:
+        """
+        Send the user their stored scrobbles as gzipped csv files, in
+        as many parts as it takes to stay under discord's upload limit.
+        """
+
+        await ctx.defer(ephemeral=True)
+
+        name: str = get_lfm_username(ctx.user.id, None)
+        await self.refresh_scrobbles(name)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # reading and compressing block, keep them off the event loop
+            paths: list[str] = await asyncio.to_thread(
+                write_export, ctx.user.id, directory
+            )
+
+            if not paths:
+                await ctx.respond(
+                    f"No scrobbles stored for {name} yet!", ephemeral=True
+                )
+                return
+
+            for i, path in enumerate(paths):
+                part: str = f"_part{i+1}" if len(paths) > 1 else ""
+                await ctx.respond(
+                    f"Part {i+1} of {len(paths)}" if len(paths) > 1 else None,
+                    file=discord.File(path, filename=f"{name}_scrobbles{part}.csv.gz"),
+                    ephemeral=True,
+                )
+
     @has_set_lfm_user()
     @slash_command(
         name="overview",
         description="View an overview of your recent top tracks, artists, albums and genres.",
         guilds=guilds,
     )
+    @query_budget(28)
     async def overview(
         self, ctx: ApplicationContext, user: discord.User = None
     ) -> None:
@@ -918,7 +1512,7 @@ class LastFM(commands.Cog):
 
         # if user supplied, set lfm_user to their last.fm username & return if they have none set
         name: str = get_lfm_username(ctx.user.id, user)
-        # discord_id = ctx.user.id if user is None else user.id
+        discord_id = ctx.user.id if user is None else user.id
 
         if name is None:
             await ctx.respond(
@@ -926,62 +1520,69 @@ class LastFM(commands.Cog):
             )
             return
 
+        await self.refresh_scrobbles(name)
+
         embed = discord.Embed(title="Overview of last 4 days")
 
         description: str = ""
 
-        now: datetime.date = datetime.date.today()
-        lower_bound: datetime.datetime = datetime.datetime(now.year, now.month, now.day)
-        upper_bound: datetime.datetime = datetime.datetime.today() + datetime.timedelta(
-            days=1
-        )
+        # days start at midnight where the user is, not where the bot is
+        account_id, tz = get_account_timezone(discord_id)
+        today: datetime.date = datetime.datetime.now(tz).date()
 
         DAYS: int = 4
-        for i in range(DAYS):
-
-            lower_stamp = int(lower_bound.timestamp())
-            upper_stamp = int(upper_bound.timestamp())
+        daily_counts: dict[datetime.date, int] = await asyncio.to_thread(
+            get_window_counts,
+            account_id,
+            today - datetime.timedelta(days=DAYS - 1),
+            today,
+            tz,
+        )
 
-            # get top artist on day
-            top_artist: StrippedArtist = None
-            top_track: StrippedTrack = None
-            top_album: StrippedAlbum = None
-            try:
-                top_artist = get_x_top_artists(name, 1, lower_stamp, upper_stamp)[0]
+        for i in range(DAYS):
+            day: datetime.date = today - datetime.timedelta(days=i)
 
-            except IndexError:
-                # no top artist for time period, prepare for next loop
-                upper_bound = lower_bound
-                lower_bound = lower_bound - datetime.timedelta(days=1)
+            # no scrobbles that day, no need to look for top artists
+            if day not in daily_counts:
                 continue
 
-            try:
-                top_track = get_x_top_tracks(name, 1, lower_stamp, upper_stamp)[0]
+            # the top lists count strictly between the stamps, so start
+            # a second early to take in a scrobble right at midnight
+            lower_stamp: int = get_local_day_start(day, tz) - 1
+            upper_stamp: int = get_local_day_start(day + datetime.timedelta(days=1), tz)
 
-            except IndexError:
-                print(
-                    "no top track?? but there was a top artist?? should not reach this line"
-                )
+            top_artists: list[StrippedArtist] = get_x_top_artists(
+                name, 1, lower_stamp, upper_stamp
+            )
+            top_tracks: list[StrippedTrack] = get_x_top_tracks(
+                name, 1, lower_stamp, upper_stamp
+            )
+            # scrobbles without an album tag don't count towards any album
+            top_albums: list[StrippedAlbum] = get_x_top_albums(
+                name, 1, lower_stamp, upper_stamp
+            )
+
+            if not top_artists or not top_tracks:
                 continue
 
-            top_album = get_x_top_albums(name, 1, lower_stamp, upper_stamp)[0]
+            top_artist: StrippedArtist = top_artists[0]
+            top_track: StrippedTrack = top_tracks[0]
 
             if i == 0:
                 if artist_image_url := get_artist_image_url(top_artist.artist):
                     embed.set_thumbnail(url=artist_image_url)
                     embed = update_embed_color(embed)
 
-            discord_date_timestamp = f"<t:{int(lower_bound.timestamp())}:D>"
             description += (
-                f"{discord_date_timestamp}\n"
+                f"**{day:%A, %B %d}** - `{daily_counts[day]}` scrobbles\n"
                 f"`{top_artist.artist_plays}` plays - [{top_artist.artist}]({get_artist_lfm_link(top_artist.artist)})\n"
-                f"`{top_album.album_plays}` plays - [{top_album.artist}]({get_artist_lfm_link(top_album.artist)}) | [{top_album.album}]({get_album_lfm_link(top_album.artist, top_album.album)})\n"
-                f"`{top_track.track_plays}` plays - [{top_track.artist}]({get_artist_lfm_link(top_track.artist)}) | [{top_track.title}]({top_track.lfm_url})\n\n"
             )
 
-            # move 1 day in the past to get the next day's info on next iteration
-            upper_bound = lower_bound
-            lower_bound = lower_bound - datetime.timedelta(days=1)
+            if top_albums:
+                top_album: StrippedAlbum = top_albums[0]
+                description += f"`{top_album.album_plays}` plays - [{top_album.artist}]({get_artist_lfm_link(top_album.artist)}) | [{top_album.album}]({get_album_lfm_link(top_album.artist, top_album.album)})\n"
+
+            description += f"`{top_track.track_plays}` plays - [{top_track.artist}]({get_artist_lfm_link(top_track.artist)}) | [{top_track.title}]({top_track.lfm_url})\n\n"
 
         if description == "":
             await ctx.respond(f"No scrobble data for past {DAYS} to use!")
@@ -995,6 +1596,240 @@ class LastFM(commands.Cog):
         embed.description = description
         await ctx.respond(embed=embed)
 
+    async def send_leaderboard(
+        self, ctx: ApplicationContext, kind: str, artist: str, name: str = ""
+    ) -> None:
+        """
+        Respond with the server's members who have played the artist,
+        album or track the most.
+        """
+
+        await ctx.defer()
+
+        if ctx.guild is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, this command can only be used in a server!"
+            )
+            return
+
+        # make sure the invoker's own plays are counted
+        if (lfm_user := retrieve_lfm_username(ctx.user.id)) is not None:
+            await self.refresh_scrobbles(lfm_user)
+
+        # one lookup over every user, narrowed to this server's members here
+        leaderboard: list[tuple] = [
+            row
+            for row in get_play_leaderboard(kind, artist, name)
+            if ctx.guild.get_member(row[0]) is not None
+        ]
+
+        if len(leaderboard) == 0:
+            await ctx.respond(
+                f"{ctx.user.mention}, nobody in this server has played that {kind}!"
+            )
+            return
+
+        stored_artist, stored_name = leaderboard[0][3], leaderboard[0][4]
+        title: str = (
+            stored_artist if kind == "artist" else f"{stored_name} by {stored_artist}"
+        )
+
+        embed = discord.Embed(color=discord.Color.gold())
+        embed.set_author(name=f"Who knows {title} in {ctx.guild.name}?")
+
+        image_url: str = None
+        if kind == "artist":
+            image_url = get_artist_image_url(stored_artist)
+        elif kind == "album":
+            image_url = get_album_image_url(stored_name, stored_artist)
+        else:
+            image_url = get_track_image_url(stored_name, stored_artist)
+
+        if image_url:
+            embed.set_thumbnail(url=image_url)
+            embed = update_embed_color(embed)
+
+        description: str = ""
+        for i, (discord_id, lfm_user, plays, _, _) in enumerate(
+            leaderboard[:WHOKNOWS_SIZE]
+        ):
+            member: discord.Member = ctx.guild.get_member(discord_id)
+            place: str = "👑" if i == 0 else f"{i+1})"
+            display_name: str = (
+                f"**{member.display_name}**"
+                if discord_id == ctx.user.id
+                else member.display_name
+            )
+
+            description += f"\n{place} [{display_name}](https://www.last.fm/user/{lfm_user}) - **{plays}** plays"
+
+        embed.description = description
+
+        total_plays: int = sum(row[2] for row in leaderboard)
+        embed.set_footer(
+            text=f"{len(leaderboard)} listeners, {total_plays} plays in this server"
+        )
+
+        await ctx.respond(embed=embed)
+
+    @whoknows.command(
+        name="artist", description="See who in this server has played an artist most."
+    )
+    @query_budget(3)
+    async def whoknows_artist(self, ctx: ApplicationContext, artist: str) -> None:
+        await self.send_leaderboard(ctx, "artist", artist)
+
+    @whoknows.command(
+        name="album", description="See who in this server has played an album most."
+    )
+    @query_budget(3)
+    async def whoknows_album(
+        self, ctx: ApplicationContext, album: str, artist: str
+    ) -> None:
+        await self.send_leaderboard(ctx, "album", artist, album)
+
+    @whoknows.command(
+        name="track", description="See who in this server has played a track most."
+    )
+    @query_budget(3)
+    async def whoknows_track(
+        self, ctx: ApplicationContext, track: str, artist: str
+    ) -> None:
+        await self.send_leaderboard(ctx, "track", artist, track)
+
+    @slash_command(
+        name="compare", description="See how similar two users' music taste is."
+    )
+    @query_budget(8)
+    async def compare(
+        self, ctx: ApplicationContext, user: discord.User, other: discord.User = None
+    ) -> None:
+        """
+        Score how much two users' listening overlaps, by the cosine
+        similarity of their artist play counts, and list the artists
+        they share. Compares the invoker with user if other isn't given.
+        """
+
+        await ctx.defer()
+
+        first: discord.User = user if other is not None else ctx.user
+        second: discord.User = other if other is not None else user
+
+        account_ids: dict[int, int] = get_account_ids([first.id, second.id])
+
+        for member in (first, second):
+            if member.id not in account_ids:
+                await ctx.respond(
+                    f"{ctx.user.mention}, {member.display_name} does not have a last.fm username set!"
+                )
+                return
+
+            await self.refresh_scrobbles(retrieve_lfm_username(member.id))
+
+        vectors: dict[int, ArtistVector] = await asyncio.to_thread(
+            self.taste.get_vectors, list(account_ids.values())
+        )
+        first_vector: ArtistVector = vectors[account_ids[first.id]]
+        second_vector: ArtistVector = vectors[account_ids[second.id]]
+
+        with span("compare"):
+            similarity: float = cosine_similarity(first_vector, second_vector)
+            shared: list[tuple[str, int, int]] = shared_top_artists(
+                first_vector, second_vector, SHARED_ARTIST_COUNT
+            )
+
+        embed = discord.Embed(color=discord.Color.gold())
+        embed.set_author(
+            name=f"{first.display_name} vs. {second.display_name}",
+            icon_url=first.display_avatar.url,
+        )
+
+        description: str = f"Taste compatibility: **{similarity:.0%}**\n"
+        for i, (artist, first_plays, second_plays) in enumerate(shared):
+            artist_link: str = get_artist_lfm_link(artist)
+            description += f"\n{i+1}) [{artist}]({artist_link}) - **{first_plays}** vs. **{second_plays}** scrobbles"
+
+        if len(shared) == 0:
+            description += "\nThese users have no artists in common!"
+
+        embed.description = description
+
+        shared_count: int = len(
+            first_vector.counts.keys() & second_vector.counts.keys()
+        )
+        embed.set_footer(text=f"{shared_count} artists in common")
+
+        await ctx.respond(embed=embed)
+
+    @slash_command(
+        name="compatible",
+        description="Find the members of this server with the most similar taste.",
+    )
+    @query_budget(25)
+    async def compatible(self, ctx: ApplicationContext, user: discord.User = None):
+        """
+        Rank the server's members by how similar their taste is to
+        the user's, the invoker by default.
+        """
+
+        if ctx.guild is None:
+            await ctx.respond(
+                f"{ctx.user.mention}, this command can only be used in a server!"
+            )
+            return
+
+        user = user or ctx.user
+
+        await ctx.defer()
+
+        account_ids: dict[int, int] = get_account_ids(
+            [member.id for member in ctx.guild.members if not member.bot] + [user.id]
+        )
+
+        if user.id not in account_ids:
+            await ctx.respond(
+                f"{ctx.user.mention}, {user.display_name} does not have a last.fm username set!"
+            )
+            return
+
+        await self.refresh_scrobbles(retrieve_lfm_username(user.id))
+
+        vectors: dict[int, ArtistVector] = await asyncio.to_thread(
+            self.taste.get_vectors, list(account_ids.values())
+        )
+        user_vector: ArtistVector = vectors[account_ids[user.id]]
+
+        with span("compare"):
+            # members sharing the user's last.fm account are left out
+            ranking: list[tuple[float, int]] = sorted(
+                (
+                    (cosine_similarity(user_vector, vectors[account_id]), discord_id)
+                    for discord_id, account_id in account_ids.items()
+                    if account_id != account_ids[user.id]
+                ),
+                reverse=True,
+            )[:COMPATIBLE_COUNT]
+
+        if len(ranking) == 0:
+            await ctx.respond(
+                f"{ctx.user.mention}, nobody else in this server has a last.fm username set!"
+            )
+            return
+
+        embed = discord.Embed(color=discord.Color.gold())
+        embed.set_author(
+            name=f"Most compatible with {user.display_name} in {ctx.guild.name}",
+            icon_url=user.display_avatar.url,
+        )
+
+        description: str = ""
+        for i, (similarity, discord_id) in enumerate(ranking):
+            member: discord.Member = ctx.guild.get_member(discord_id)
+            description += f"\n{i+1}) {member.display_name} - **{similarity:.0%}**"
+
+        embed.description = description
+        await ctx.respond(embed=embed)
+
     @pfp.command(
         name="update",
         description="Update the bot's profile picture to album art of your choice! Approved users only.",
@@ -1017,20 +1852,22 @@ class LastFM(commands.Cog):
             )
             return
 
-        possibilities = pylast.AlbumSearch(album_name=album, network=self.network)
-
         try:  # if no albums found tell user
-            first_result: pylast.Album = possibilities.get_next_page()[0]
+            first_result: AlbumMatch = (
+                await self.lastfm.client.search_album(album, limit=1)
+            )[0]
 
-        except IndexError:
+        except (IndexError, LastFMError):
 
             # reset cooldown if unsuccessful
             ctx.command.reset_cooldown(ctx)
             await ctx.respond(f"Unable to find album {album}!")
             return
 
-        item_art_url = first_result.get_cover_image()
-        item_art = requests.get(item_art_url).content
+        with span("image_download"):
+            item_art = (
+                await asyncio.to_thread(requests.get, first_result.image_url)
+            ).content
 
         try:
             await self.bot.user.edit(avatar=item_art)
@@ -1041,7 +1878,7 @@ class LastFM(commands.Cog):
             return
 
         await ctx.respond(
-            f"Successfully set the profile picture!\n`{first_result.get_name()} by {first_result.get_artist()}`"
+            f"Successfully set the profile picture!\n`{first_result.name} by {first_result.artist}`"
         )
 
     async def cog_command_error(self, ctx: ApplicationContext, error: Exception):
@@ -1082,6 +1919,13 @@ class LastFM(commands.Cog):
             **Recent** - see the last 5 tracks you listened to
             **Now** - see the song you're currently listening to.
             **Scrobbles** - see how many scrobbles you have.
+            **Compare** - see how similar your taste is to someone else's.
+            **Compatible** - find who in the server has the most similar taste.
+            **Heatmap** - see which days and hours you listen most.
+            **Streak** - see how many days in a row you've listened.
+            **Milestone** - see which track was your 1000th scrobble, or any other.
+            **Wrapped** - see your year in review.
+            **Export** - download all your stored scrobbles.
             """
 
         embed.add_field(name="Common commands", value=common_cmd_desc, inline=False)
@@ -1101,6 +1945,16 @@ class LastFM(commands.Cog):
 
         embed.add_field(name="/Chart Command Group", value=chart_cmd_desc, inline=False)
 
+        whoknows_cmd_desc: str = """
+        **Artist** - see who in the server has played an artist the most
+        **Album** - see who in the server has played an album the most
+        **Track** - see who in the server has played a track the most
+        """
+
+        embed.add_field(
+            name="/Whoknows Command Group", value=whoknows_cmd_desc, inline=False
+        )
+
         await ctx.respond(embed=embed, ephemeral=True)
 
     @commands.is_owner()
@@ -1127,7 +1981,8 @@ class LastFM(commands.Cog):
         Display all stored users & their local scrobble counts.
         """
 
-        users: list[tuple[str, int]] = retrieve_all_lfm_names()
+        # one query for every user's count instead of one per user
+        users: list[tuple[str, int]] = get_all_user_scrobble_counts()
 
         # make embed pretty even tho i'm the only one that'll ever see it
         embed: discord.Embed = discord.Embed(title="Stored Users")
@@ -1136,8 +1991,7 @@ class LastFM(commands.Cog):
 
         description: str = ""
         for i, user in enumerate(users):
-            lfm_user, discord_id = user
-            user_scrobbles: int = get_number_user_scrobbles_stored(discord_id)
+            lfm_user, user_scrobbles = user
 
             description += f"{i+1}: **{lfm_user}** - `{user_scrobbles}`\n"
 
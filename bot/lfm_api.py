@@ -0,0 +1,137 @@
+### async facade over the last.fm calls made by commands
+
+from cache import TTLCache
+from lfm_client import (
+    LastFMClient,
+    LastFMError,
+    RateLimiter,
+    RecentTrack,
+    RecentTracksPage,
+    TrackInfo,
+    UserInfo,
+)
+
+
+class NowPlaying:
+    """
+    Everything the bot shows about a track someone is currently
+    playing, fetched in one go so it can be cached as a unit.
+    """
+
+    def __init__(
+        self,
+        title: str,
+        artist: str,
+        album: str,
+        lfm_url: str,
+        image_url: str,
+        user_plays: int,
+    ):
+        self.title = title
+        self.artist = artist
+        self.album = album
+        self.lfm_url = lfm_url
+        self.image_url = image_url
+        self.user_plays = user_plays
+
+    def __repr__(self) -> str:
+        return f"NowPlaying({self.title=}, {self.artist=}, {self.album=}, {self.user_plays=})"
+
+
+class UserProfile:
+    """
+    A last.fm user's display name, avatar and total playcount.
+    """
+
+    def __init__(self, name: str, image_url: str, playcount: int):
+        self.name = name
+        self.image_url = image_url
+        self.playcount = playcount
+
+    def __repr__(self) -> str:
+        return f"UserProfile({self.name=}, {self.image_url=}, {self.playcount=})"
+
+
+class AsyncLastFM:
+    """
+    Serves the last.fm data commands need through the async client,
+    caching results for a short time. Calls for the same key that
+    overlap share one set of upstream requests.
+    """
+
+    def __init__(
+        self,
+        client: LastFMClient,
+        now_playing_ttl: float = 15,
+        profile_ttl: float = 300,
+    ):
+        self.client = client
+        self.limiter: RateLimiter = client.limiter
+
+        self.now_playing_cache = TTLCache(now_playing_ttl)
+        self.profile_cache = TTLCache(profile_ttl)
+
+    async def _fetch_now_playing(self, username: str) -> NowPlaying:
+        """
+        Fetch the user's now playing track, along with
+        how many times they've played it.
+        """
+
+        page: RecentTracksPage = await self.client.get_recent_tracks(username, limit=1)
+
+        if not page.tracks or not page.tracks[0].now_playing:
+            return None
+
+        # recent tracks already include the album and image, only
+        # the user's playcount needs another request
+        track: RecentTrack = page.tracks[0]
+        try:
+            info: TrackInfo = await self.client.get_track_info(
+                track.title, track.artist, username
+            )
+            user_plays: int = info.user_playcount
+
+        except LastFMError:
+            # occurs sometimes when last.fm can't find the track's playcount
+            user_plays = None
+
+        return NowPlaying(
+            title=track.title,
+            artist=track.artist,
+            album=track.album or None,
+            lfm_url=track.lfm_url,
+            image_url=track.image_url,
+            user_plays=user_plays,
+        )
+
+    async def _fetch_user_profile(self, username: str) -> UserProfile:
+        """
+        Fetch a user's profile info.
+        """
+
+        info: UserInfo = await self.client.get_user_info(username)
+
+        return UserProfile(
+            name=info.name,
+            image_url=info.image_url,
+            playcount=info.playcount,
+        )
+
+    async def get_now_playing(self, username: str) -> NowPlaying:
+        """
+        Return what the user is currently listening to,
+        or None if they aren't playing anything.
+        """
+
+        return await self.now_playing_cache.get_or_fetch(
+            username.lower(), lambda: self._fetch_now_playing(username)
+        )
+
+    async def get_user_profile(self, username: str) -> UserProfile:
+        """
+        Return the user's display name, avatar and total playcount.
+        """
+
+        return await self.profile_cache.get_or_fetch(
+            username.lower(), lambda: self._fetch_user_profile(username)
+        )
@@ -0,0 +1,416 @@
+### asyncio last.fm api client sharing one connection pool
+
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, NamedTuple
+
+import aiohttp
+
+from metrics import RATE_LIMIT_WAIT_SECONDS, recent_rate_limit_waits, span
+
+DEFAULT_API_URL: str = "https://ws.audioscrobbler.com/2.0/"
+
+# most tracks user.getrecenttracks returns per page
+MAX_PAGE_SIZE: int = 200
+
+# last.fm error codes worth retrying: operation failed, service
+# offline, temporarily unavailable and rate limit exceeded
+RETRY_ERROR_CODES: set[int] = {8, 11, 16, 29}
+
+
+class LastFMError(Exception):
+    """
+    An error response from the last.fm api.
+    """
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"last.fm error {code}: {message}")
+        self.code = code
+        self.message = message
+
+
+class RecentTrack(NamedTuple):
+    title: str
+    artist: str
+    album: str
+    lfm_url: str
+    image_url: str
+    # None while the track is still playing
+    unix_timestamp: int
+    now_playing: bool
+
+
+class RecentTracksPage(NamedTuple):
+    tracks: list[RecentTrack]
+    page: int
+    total_pages: int
+    # scrobbles in the whole requested range, not just this page
+    total: int
+
+
+class UserInfo(NamedTuple):
+    name: str
+    image_url: str
+    playcount: int
+    registered: int
+
+
+class TrackInfo(NamedTuple):
+    title: str
+    artist: str
+    album: str
+    lfm_url: str
+    image_url: str
+    listeners: int
+    playcount: int
+    # only known when the track was looked up for a user
+    user_playcount: int
+
+
+class AlbumMatch(NamedTuple):
+    name: str
+    artist: str
+    lfm_url: str
+    image_url: str
+
+
+class RateLimiter:
+    """
+    Token bucket spacing out requests to rate per second on
+    average while allowing short bursts. Safe to share between
+    threads and event loops, so pylast and the async client
+    can draw from the same budget.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, service: str = "lastfm"):
+        self.rate = rate
+        self.burst = burst
+        self.service = service
+
+        self.tokens: float = burst
+        self.updated: float = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.calls: int = 0
+        self.waits: int = 0
+        self.wait_seconds: float = 0.0
+
+    def reserve(self) -> float:
+        """
+        Take a token and return how long the caller must wait before
+        making its request.
+        """
+
+        with self._lock:
+            now: float = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            # take the token now even if it isn't there yet, so
+            # waiting callers queue up behind each other
+            self.tokens -= 1
+            wait: float = -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+            self.calls += 1
+            if wait:
+                self.waits += 1
+                self.wait_seconds += wait
+
+        RATE_LIMIT_WAIT_SECONDS.observe(wait, service=self.service)
+        recent_rate_limit_waits.append(wait)
+
+        return wait
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be made, returning how long it waited.
+        """
+
+        if wait := self.reserve():
+            time.sleep(wait)
+
+        return wait
+
+    async def acquire_async(self) -> float:
+        """
+        Wait without blocking the event loop until a request may be made.
+        """
+
+        if wait := self.reserve():
+            await asyncio.sleep(wait)
+
+        return wait
+
+
+def get_image_url(images: list[dict]) -> str:
+    """
+    Return the largest image from a last.fm image list, if any.
+    """
+
+    for image in reversed(images or []):
+        if image.get("#text"):
+            return image["#text"]
+
+    return None
+
+
+def parse_recent_track(track: dict) -> RecentTrack:
+    now_playing: bool = track.get("@attr", {}).get("nowplaying") == "true"
+
+    return RecentTrack(
+        title=track["name"],
+        artist=track["artist"]["#text"],
+        album=track["album"]["#text"],
+        lfm_url=track["url"],
+        image_url=get_image_url(track.get("image")),
+        unix_timestamp=None if now_playing else int(track["date"]["uts"]),
+        now_playing=now_playing,
+    )
+
+
+class LastFMClient:
+    """
+    Makes last.fm api calls with aiohttp over one shared connection
+    pool, so any number of them can be in flight on a single event
+    loop. Requests draw from the rate limiter and failed ones are
+    retried with backoff.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = DEFAULT_API_URL,
+        limiter: RateLimiter = None,
+        max_connections: int = 16,
+        timeout: float = 15,
+        retries: int = 3,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url or DEFAULT_API_URL
+        self.limiter = limiter or RateLimiter(5, burst=5)
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+
+        # requests currently waiting on the limiter or the network
+        self.in_flight: int = 0
+
+        # sessions have to be made inside a running event loop
+        self._session: aiohttp.ClientSession = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections, ttl_dns_cache=300
+                ),
+                timeout=self.timeout,
+            )
+
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "LastFMClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def call(self, method: str, **params) -> dict:
+        """
+        Call an api method and return its decoded json, raising
+        LastFMError if last.fm reports an error.
+        """
+
+        params.update({"method": method, "api_key": self.api_key, "format": "json"})
+        query: dict = {
+            key: str(value) for key, value in params.items() if value is not None
+        }
+
+        self.in_flight += 1
+        try:
+            for attempt in range(self.retries + 1):
+                await self.limiter.acquire_async()
+
+                try:
+                    with span("lastfm"):
+                        async with self._get_session().get(
+                            self.base_url, params=query
+                        ) as response:
+                            data: dict = await response.json(content_type=None)
+
+                # includes bodies that aren't json, like error pages
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                    if attempt == self.retries:
+                        raise
+
+                else:
+                    if "error" not in data:
+                        return data
+
+                    error = LastFMError(int(data["error"]), data.get("message", ""))
+                    if error.code not in RETRY_ERROR_CODES or attempt == self.retries:
+                        raise error
+
+                await asyncio.sleep(2**attempt)
+
+        finally:
+            self.in_flight -= 1
+
+    async def get_recent_tracks(
+        self,
+        username: str,
+        from_timestamp: int = None,
+        to_timestamp: int = None,
+        page: int = 1,
+        limit: int = MAX_PAGE_SIZE,
+    ) -> RecentTracksPage:
+        """
+        Return one page of the user's scrobbles, newest first. The
+        first page can start with the track they're playing now.
+        """
+
+        data: dict = await self.call(
+            "user.getrecenttracks",
+            user=username,
+            page=page,
+            limit=limit,
+            # last.fm treats both bounds as inclusive
+            **{"from": from_timestamp, "to": to_timestamp},
+        )
+
+        tracks: list[dict] = data["recenttracks"].get("track", [])
+        # a single track comes back as a dict rather than a list
+        if isinstance(tracks, dict):
+            tracks = [tracks]
+
+        attr: dict = data["recenttracks"]["@attr"]
+
+        return RecentTracksPage(
+            tracks=[parse_recent_track(track) for track in tracks],
+            page=int(attr["page"]),
+            total_pages=int(attr["totalPages"]),
+            total=int(attr["total"]),
+        )
+
+    async def iter_recent_tracks(
+        self,
+        username: str,
+        from_timestamp: int = None,
+        to_timestamp: int = None,
+        limit: int = MAX_PAGE_SIZE,
+        concurrency: int = 1,
+        oldest_first: bool = False,
+    ) -> AsyncIterator[RecentTracksPage]:
+        """
+        Yield every page of the user's scrobbles in the range, newest
+        first. With concurrency above 1 later pages are fetched that
+        many at a time, which is only safe with to_timestamp set since
+        new scrobbles shift unbounded pages while they're being read.
+        oldest_first yields the pages the other way round (the tracks
+        within each stay newest first), also only with to_timestamp
+        set, so a caller storing them as they come that stops partway
+        has stored an unbroken run of the oldest ones.
+        """
+
+        first: RecentTracksPage = await self.get_recent_tracks(
+            username, from_timestamp, to_timestamp, 1, limit
+        )
+
+        if to_timestamp is None:
+            concurrency = 1
+            oldest_first = False
+
+        if not oldest_first:
+            yield first
+
+        for start in range(2, first.total_pages + 1, concurrency):
+            numbers: range = range(
+                start, min(start + concurrency, first.total_pages + 1)
+            )
+            if oldest_first:
+                numbers = range(
+                    first.total_pages + 2 - start,
+                    max(first.total_pages + 2 - start - concurrency, 1),
+                    -1,
+                )
+
+            pages: list[RecentTracksPage] = await asyncio.gather(
+                *[
+                    self.get_recent_tracks(
+                        username, from_timestamp, to_timestamp, page, limit
+                    )
+                    for page in numbers
+                ]
+            )
+
+            for page in pages:
+                yield page
+
+        if oldest_first:
+            yield first
+
+    async def get_user_info(self, username: str) -> UserInfo:
+        user: dict = (await self.call("user.getinfo", user=username))["user"]
+
+        return UserInfo(
+            name=user["name"],
+            image_url=get_image_url(user.get("image")),
+            playcount=int(user.get("playcount", 0)),
+            registered=int(user.get("registered", {}).get("unixtime", 0)),
+        )
+
+    async def get_track_info(
+        self, title: str, artist: str, username: str = None
+    ) -> TrackInfo:
+        """
+        Return a track's details, including how many times username
+        has played it when given.
+        """
+
+        track: dict = (
+            await self.call(
+                "track.getInfo",
+                track=title,
+                artist=artist,
+                username=username,
+                autocorrect=1,
+            )
+        )["track"]
+
+        album: dict = track.get("album")
+        user_playcount: str = track.get("userplaycount")
+
+        return TrackInfo(
+            title=track["name"],
+            artist=track["artist"]["name"],
+            album=album["title"] if album else None,
+            lfm_url=track.get("url"),
+            image_url=get_image_url(album.get("image")) if album else None,
+            listeners=int(track.get("listeners", 0)),
+            playcount=int(track.get("playcount", 0)),
+            user_playcount=int(user_playcount) if user_playcount is not None else None,
+        )
+
+    async def search_album(self, album: str, limit: int = 5) -> list[AlbumMatch]:
+        results: dict = (await self.call("album.search", album=album, limit=limit))[
+            "results"
+        ]
+        albums: list[dict] = results["albummatches"]["album"]
+
+        return [
+            AlbumMatch(
+                name=match["name"],
+                artist=match["artist"],
+                lfm_url=match.get("url"),
+                image_url=get_image_url(match.get("image")),
+            )
+            for match in albums
+        ]
@@ -1,22 +1,17 @@
 import discord
-from dotenv import load_dotenv
 
-import os
+from config import TOKEN
 
-load_dotenv()
+# the members intent keeps every guild's member list cached, which
+# /whoknows filters its leaderboards by. it has to be switched on
+# for the bot in the discord developer portal too
+intents = discord.Intents.default()
+intents.members = True
 
-TOKEN = os.getenv("BOT_TOKEN")
-LFM_API_KEY = os.getenv("LASTFM_API_KEY")
-LFM_API_SECRET = os.getenv("LASTFM_API_SECRET")
-LFM_USER = os.getenv("LFM_USER")
-LFM_PASS = os.getenv("LFM_PASS")
-SPOTIPY_CLIENT_ID = os.getenv("SPOTIPY_CLIENT_ID")
-SPOTIPY_CLIENT_SECRET = os.getenv("SPOTIPY_CLIENT_SECRET")
+bot = discord.Bot(intents=intents)
 
-bot = discord.Bot()
 
-
-extensions = ["lfm", "admin", "custom_util_cmds"]
+extensions = ["lfm", "admin", "custom_util_cmds", "telemetry"]
 
 for ext in extensions:
     bot.load_extension(ext)
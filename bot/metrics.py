@@ -0,0 +1,502 @@
+### lightweight timing spans, counters and histograms, exported for prometheus
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator
+
+# upper bounds (seconds) of the histogram buckets
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+
+class Counter:
+    """
+    Monotonically increasing count, split by label values.
+    """
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key: tuple = tuple(labels[label] for label in self.labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels[label] for label in self.labels), 0)
+
+    def render(self) -> list[str]:
+        lines: list[str] = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed durations in cumulative
+    buckets, split by label values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+
+        # label values -> [per bucket counts, sum, count]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key: tuple = tuple(labels[label] for label in self.labels)
+
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            entry: list = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines: list[str] = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+
+        with self._lock:
+            for key, (bucket_counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    bucket_labels: str = format_labels(
+                        self.labels + ("le",), key + (str(bound),)
+                    )
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+
+                inf_labels: str = format_labels(self.labels + ("le",), key + ("+Inf",))
+                lines.append(f"{self.name}_bucket{inf_labels} {count}")
+                lines.append(
+                    f"{self.name}_sum{format_labels(self.labels, key)} {total}"
+                )
+                lines.append(
+                    f"{self.name}_count{format_labels(self.labels, key)} {count}"
+                )
+
+        return lines
+
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    """
+    Format label names and values the way prometheus expects,
+    eg. {command="top artists",stage="db"}.
+    """
+
+    if not names:
+        return ""
+
+    pairs: list[str] = []
+    for name, value in zip(names, values):
+        escaped: str = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+
+    return "{" + ",".join(pairs) + "}"
+
+
+REGISTRY: list = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+STAGE_SECONDS: Histogram = register(
+    Histogram(
+        "jam_tracker_stage_seconds",
+        "Time spent in each stage (db, lastfm, spotify, image_download, render).",
+        ("stage",),
+    )
+)
+COMMAND_SECONDS: Histogram = register(
+    Histogram(
+        "jam_tracker_command_seconds",
+        "Total time taken by each slash command.",
+        ("command", "status"),
+    )
+)
+COMMAND_STAGE_SECONDS: Histogram = register(
+    Histogram(
+        "jam_tracker_command_stage_seconds",
+        "Time each slash command spent in each stage.",
+        ("command", "stage"),
+    )
+)
+COMMAND_QUERIES: Histogram = register(
+    Histogram(
+        "jam_tracker_command_queries",
+        "Number of sql statements each slash command ran.",
+        ("command",),
+        buckets=(1, 2, 5, 10, 20, 50, 100, 250, 500),
+    )
+)
+RATE_LIMIT_WAIT_SECONDS: Histogram = register(
+    Histogram(
+        "jam_tracker_rate_limit_wait_seconds",
+        "Time upstream requests waited for the rate limiter.",
+        ("service",),
+    )
+)
+COMMANDS_TOTAL: Counter = register(
+    Counter(
+        "jam_tracker_commands_total",
+        "Slash commands run, by outcome.",
+        ("command", "status"),
+    )
+)
+INGEST_ROWS_TOTAL: Counter = register(
+    Counter(
+        "jam_tracker_ingest_rows_total",
+        "Scrobble rows committed by the ingest writer.",
+    )
+)
+INGEST_COMMIT_SECONDS: Histogram = register(
+    Histogram(
+        "jam_tracker_ingest_commit_seconds",
+        "Time taken by each group commit of the ingest writer.",
+    )
+)
+INGEST_GROUP_ROWS: Histogram = register(
+    Histogram(
+        "jam_tracker_ingest_group_rows",
+        "Scrobble rows in each group commit of the ingest writer.",
+        buckets=(1, 10, 50, 200, 500, 1000, 2000, 5000),
+    )
+)
+INGEST_BACKPRESSURE_SECONDS: Histogram = register(
+    Histogram(
+        "jam_tracker_ingest_backpressure_seconds",
+        "Time fetchers waited for room in the ingest queue.",
+    )
+)
+
+
+# recent samples kept in memory for /perf, appending to a full
+# deque drops the oldest sample
+RECENT_SAMPLES: int = 500
+
+recent_command_seconds: dict[str, deque] = {}
+# (seconds, statement) of the latest sql statements run
+recent_queries: deque = deque(maxlen=RECENT_SAMPLES)
+# seconds last.fm requests waited on the rate limiter, 0 if they didn't
+recent_rate_limit_waits: deque = deque(maxlen=RECENT_SAMPLES)
+# (time.monotonic() at the end, rows, seconds) of the latest group commits
+recent_ingest_commits: deque = deque(maxlen=RECENT_SAMPLES)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Return the nearest rank q-th percentile of values.
+    """
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    index: int = max(0, min(len(values) - 1, round(q / 100 * len(values)) - 1))
+
+    return values[index]
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """
+    Thread pool counting the work waiting for a free thread. Set as
+    an event loop's default executor, it shows how far the blocking
+    calls sent through asyncio.to_thread are backed up.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.queued: int = 0
+        self._lock = threading.Lock()
+
+    def _add_queued(self, amount: int) -> None:
+        with self._lock:
+            self.queued += amount
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        def run():
+            self._add_queued(-1)
+            return fn(*args, **kwargs)
+
+        self._add_queued(1)
+        try:
+            future: Future = super().submit(run)
+
+        except RuntimeError:
+            self._add_queued(-1)
+            raise
+
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, future: Future) -> None:
+        # work cancelled before it started never ran to count itself off
+        if future.cancelled():
+            self._add_queued(-1)
+
+
+class CommandTimer:
+    """
+    Collects how long a single command invocation
+    spends in each stage.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.start: float = time.perf_counter()
+        self.end: float = None
+        self.stages: dict[str, float] = {}
+        self.queries: int = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_query(self) -> None:
+        with self._lock:
+            self.queries += 1
+
+    def stop(self) -> None:
+        self.end = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+
+# the command whose work is currently being timed, if any. asyncio
+# tasks and asyncio.to_thread carry it along automatically
+current_timer: contextvars.ContextVar[CommandTimer] = contextvars.ContextVar(
+    "current_timer", default=None
+)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """
+    Record time spent in a stage, both globally and against
+    the command currently running.
+    """
+
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+    if (timer := current_timer.get()) is not None:
+        timer.add(stage, seconds)
+
+
+def record_query(statement: str, seconds: float) -> None:
+    """
+    Record a finished sql statement.
+    """
+
+    record_stage("db", seconds)
+    recent_queries.append((seconds, statement))
+
+    if (timer := current_timer.get()) is not None:
+        timer.add_query()
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time the body of a with block as the given stage.
+    """
+
+    start: float = time.perf_counter()
+    try:
+        yield
+
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def timed(stage: str) -> Callable:
+    """
+    Decorator timing every call of a function, sync or async,
+    as the given stage.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_command(command: str) -> CommandTimer:
+    """
+    Start timing a command. Must be called from the task running
+    the command so the stages it goes through are attributed to it.
+    """
+
+    timer = CommandTimer(command)
+    current_timer.set(timer)
+
+    return timer
+
+
+def finish_command(timer: CommandTimer, status: str = "ok") -> None:
+    """
+    Record a finished command's total time and stage breakdown.
+    """
+
+    COMMAND_SECONDS.observe(timer.elapsed(), command=timer.command, status=status)
+    recent_command_seconds.setdefault(
+        timer.command, deque(maxlen=RECENT_SAMPLES)
+    ).append(timer.elapsed())
+    COMMANDS_TOTAL.inc(command=timer.command, status=status)
+
+    COMMAND_QUERIES.observe(timer.queries, command=timer.command)
+
+    for stage, seconds in timer.stages.items():
+        COMMAND_STAGE_SECONDS.observe(seconds, command=timer.command, stage=stage)
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    A command ran more sql statements than its declared budget.
+    """
+
+
+# raise QueryBudgetExceeded instead of only logging when a command
+# goes over budget, the benchmarks turn this on so regressions fail
+strict_query_budgets: bool = False
+
+
+def query_budget(max_queries: int) -> Callable:
+    """
+    Decorator declaring the most sql statements a command should
+    run. Going over is logged, or raises in strict mode. Needs to
+    be the decorator closest to the command's function.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if (timer := current_timer.get()) is None:
+                return await func(*args, **kwargs)
+
+            queries_before: int = timer.queries
+            result = await func(*args, **kwargs)
+            used: int = timer.queries - queries_before
+
+            if used > max_queries:
+                message: str = f"{timer.command} ran {used} queries, over its budget of {max_queries}"
+
+                if strict_query_budgets:
+                    raise QueryBudgetExceeded(message)
+
+                print(message)
+
+            return result
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
+
+
+def render_prometheus() -> str:
+    """
+    Return every registered metric in prometheus' text format.
+    """
+
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines += metric.render()
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+
+        body: bytes = render_prometheus().encode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        # scrapes every few seconds would flood the console
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve /metrics on a background thread.
+    """
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
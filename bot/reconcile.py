@@ -0,0 +1,340 @@
+### finds and fills holes in stored history by comparing counts with last.fm
+#
+# syncs only ever fetch scrobbles newer than the newest one stored, so
+# pages that failed partway through a sync, or scrobbles submitted
+# late with older timestamps, are never picked up. this compares the
+# stored count per range of days (from scrobble_day) with last.fm's
+# total for the same range, a single limit=1 request each, halving
+# ranges that disagree until they're small enough to fetch again.
+# ranges left when a run's checks are used up are stored and looked
+# at first next run.
+
+import asyncio
+import bisect
+import itertools
+import time
+import traceback
+
+import aiohttp
+from sqlalchemy import delete, insert, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from data_grabber import (
+    ACCOUNT_CONCURRENCY,
+    PAGE_CONCURRENCY,
+    get_account_last_timestamp,
+    get_linked_accounts,
+    limiter,
+    track_to_row,
+)
+from data_interface import ReconcileRange, Session
+from ingest import ScrobbleWriter, WriteAborted
+from lfm_client import LastFMClient, LastFMError
+from config import LFM_API_KEY, LFM_API_URL
+from rollups import DAY_SECONDS
+
+# ranges last.fm has at most this many scrobbles in are fetched again
+# whole rather than split further (five full pages)
+REFETCH_SCROBBLES: int = 1000
+
+# total requests spent comparing counts for one account per run,
+# anything left over is picked up next run
+MAX_CHECKS: int = 64
+
+
+class StoredDays:
+    """
+    An account's stored scrobbles per utc day, with running totals
+    so the count over any range of days is two lookups.
+    """
+
+    def __init__(self, days: list[tuple[int, int]]):
+        self.days: list[int] = [day for day, _ in days]
+        self.totals: list[int] = [0, *itertools.accumulate(plays for _, plays in days)]
+
+    def count(self, first_day: int, end_day: int) -> int:
+        """
+        Return how many scrobbles are stored from the start of
+        first_day up to (not including) end_day.
+        """
+
+        return (
+            self.totals[bisect.bisect_left(self.days, end_day)]
+            - self.totals[bisect.bisect_left(self.days, first_day)]
+        )
+
+
+def get_stored_days(account_id: int) -> StoredDays:
+    with Session.begin() as session:
+        return StoredDays(
+            session.execute(
+                text(
+                    "SELECT day, plays FROM scrobble_day "
+                    "WHERE account_id = :account_id ORDER BY day"
+                ),
+                {"account_id": account_id},
+            ).all()
+        )
+
+
+def get_stored_scrobbles(
+    account_id: int, after: int, before: int
+) -> set[tuple[int, str, str]]:
+    """
+    Return the timestamp, title and artist of the account's stored
+    scrobbles in the range, both ends included like last.fm's from
+    and to.
+    """
+
+    with Session.begin() as session:
+        return set(
+            session.execute(
+                text(
+                    "SELECT unix_timestamp, title, artist FROM scrobble "
+                    "WHERE account_id = :account_id "
+                    "AND unix_timestamp BETWEEN :after AND :before"
+                ),
+                {"account_id": account_id, "after": after, "before": before},
+            ).all()
+        )
+
+
+def get_pending_ranges(account_id: int) -> list[tuple[int, int, int]]:
+    """
+    Return the ranges of days the account's last run left over, in
+    the order they're popped (oldest last), with last.fm's counts
+    not known yet.
+    """
+
+    with Session.begin() as session:
+        return [
+            (first_day, end_day, None)
+            for first_day, end_day in session.query(
+                ReconcileRange.first_day, ReconcileRange.end_day
+            )
+            .filter_by(account_id=account_id)
+            .order_by(ReconcileRange.first_day.desc())
+        ]
+
+
+def set_pending_ranges(account_id: int, ranges: list[tuple[int, int, int]]) -> None:
+    with Session.begin() as session:
+        session.execute(
+            delete(ReconcileRange).where(ReconcileRange.account_id == account_id)
+        )
+
+        if ranges:
+            session.execute(
+                insert(ReconcileRange),
+                [
+                    {
+                        "account_id": account_id,
+                        "first_day": first_day,
+                        "end_day": end_day,
+                    }
+                    for first_day, end_day, _ in ranges
+                ],
+            )
+
+
+async def count_remote(
+    client: LastFMClient, username: str, after: int, before: int
+) -> int:
+    """
+    Return how many scrobbles last.fm has for the user between the
+    timestamps, both included. Only one track is asked for, the
+    total for the range comes along with it.
+    """
+
+    page = await client.get_recent_tracks(username, after, before, limit=1)
+    return page.total
+
+
+async def refetch_window(
+    client: LastFMClient,
+    writer: ScrobbleWriter,
+    account_id: int,
+    username: str,
+    after: int,
+    before: int,
+) -> int:
+    """
+    Fetch every scrobble last.fm has in the range and store the ones
+    not stored yet, told apart by timestamp, title and artist since
+    several can share a second. Returns how many were missing.
+    """
+
+    seen: set[tuple[int, str, str]] = await asyncio.to_thread(
+        get_stored_scrobbles, account_id, after, before
+    )
+
+    rows: list[dict] = []
+    async for page in client.iter_recent_tracks(
+        username,
+        from_timestamp=after,
+        to_timestamp=before,
+        concurrency=PAGE_CONCURRENCY,
+    ):
+        for track in page.tracks:
+            key: tuple[int, str, str] = (
+                track.unix_timestamp,
+                track.title,
+                track.artist,
+            )
+
+            if not track.now_playing and key not in seen:
+                seen.add(key)
+                rows.append(track_to_row(track))
+
+    if rows:
+        await (await writer.write(account_id, rows))
+
+    return len(rows)
+
+
+async def reconcile_account(
+    client: LastFMClient,
+    writer: ScrobbleWriter,
+    account_id: int,
+    username: str,
+    max_checks: int = MAX_CHECKS,
+) -> int:
+    """
+    Compare the account's stored history with last.fm's, up to the
+    newest scrobble stored (anything newer is left to syncing), and
+    fetch again only the ranges whose counts disagree. Splitting a
+    range needs one request for its first half, the second half's
+    total is what's left. Ranges the last run didn't get to are
+    compared first, the whole history once there are none. Whatever
+    is left when max_checks requests have been made, or a request or
+    write fails, is stored for the next run. Returns the number of
+    scrobbles filled in.
+    """
+
+    newest: int = await asyncio.to_thread(get_account_last_timestamp, account_id)
+
+    # nothing stored yet, a normal sync fetches the whole history
+    if newest is None:
+        return 0
+
+    stored: StoredDays = await asyncio.to_thread(get_stored_days, account_id)
+
+    def get_bounds(first_day: int, end_day: int) -> tuple[int, int]:
+        return first_day * DAY_SECONDS, min(end_day * DAY_SECONDS - 1, newest)
+
+    # ranges of days still to look at, with last.fm's count for each
+    # once it's known, the next one to look at last
+    ranges: list[tuple[int, int, int]] = await asyncio.to_thread(
+        get_pending_ranges, account_id
+    ) or [(0, newest // DAY_SECONDS + 1, None)]
+    checks: int = 0
+    filled: int = 0
+
+    try:
+        while ranges:
+            first_day, end_day, remote = ranges[-1]
+
+            if remote is None:
+                if checks == max_checks:
+                    break
+
+                remote = await count_remote(
+                    client, username, *get_bounds(first_day, end_day)
+                )
+                checks += 1
+                ranges[-1] = (first_day, end_day, remote)
+
+            if remote == stored.count(first_day, end_day):
+                ranges.pop()
+                continue
+
+            if remote <= REFETCH_SCROBBLES or end_day - first_day == 1:
+                filled += await refetch_window(
+                    client,
+                    writer,
+                    account_id,
+                    username,
+                    *get_bounds(first_day, end_day),
+                )
+                ranges.pop()
+                continue
+
+            if checks == max_checks:
+                break
+
+            middle: int = (first_day + end_day) // 2
+            first_half: int = await count_remote(
+                client, username, *get_bounds(first_day, middle)
+            )
+            checks += 1
+
+            # oldest first, so filled holes come in roughly in order
+            ranges.pop()
+            ranges.append((middle, end_day, remote - first_half))
+            ranges.append((first_day, middle, first_half))
+
+    finally:
+        await asyncio.to_thread(set_pending_ranges, account_id, ranges)
+
+    if ranges:
+        print(
+            f"stopped reconciling {username} after {checks} checks, "
+            f"{len(ranges)} ranges left for next run"
+        )
+
+    return filled
+
+
+async def reconcile_accounts(client: LastFMClient, writer: ScrobbleWriter) -> None:
+    """
+    Reconcile every linked account, several at a time.
+    """
+
+    accounts: list[tuple[int, str, int]] = await asyncio.to_thread(get_linked_accounts)
+    semaphore = asyncio.Semaphore(ACCOUNT_CONCURRENCY)
+
+    async def reconcile(account_id: int, username: str) -> None:
+        async with semaphore:
+            try:
+                filled: int = await reconcile_account(
+                    client, writer, account_id, username
+                )
+
+            # request failed (last.fm api may be down) in this case
+            except (LastFMError, aiohttp.ClientError, asyncio.TimeoutError):
+                print(f"failed to reconcile {username}")
+                traceback.print_exc()
+                return
+
+            # the writer already printed why the commit failed
+            except (SQLAlchemyError, WriteAborted) as error:
+                print(f"failed to store {username}'s missing scrobbles: {error!r}")
+                return
+
+            if filled:
+                print(f"filled {filled} missing scrobbles for {username}")
+
+    start_time: float = time.time()
+    await asyncio.gather(
+        *[reconcile(account_id, username) for account_id, username, _ in accounts]
+    )
+
+    end_time: float = time.time()
+    print(f"reconciled {len(accounts)} accounts in {end_time-start_time} seconds")
+
+
+async def reconcile_all_accounts_async() -> None:
+    # same limiter as the grabber's syncs, so both together stay in budget
+    async with LastFMClient(
+        LFM_API_KEY, base_url=LFM_API_URL, limiter=limiter
+    ) as client, ScrobbleWriter() as writer:
+        await reconcile_accounts(client, writer)
+
+
+def reconcile_all_accounts() -> None:
+    """
+    Meant to run daily in the sync workers' supervisor,
+    alongside the workers' syncs.
+    """
+
+    asyncio.run(reconcile_all_accounts_async())
@@ -0,0 +1,214 @@
+### scrobble counts and streaks per local day, in any time zone
+
+import datetime
+
+import numpy as np
+from sqlalchemy import text
+
+from data_interface import Session
+
+DAY_SECONDS: int = 24 * 60 * 60
+
+# date.toordinal() of 1970-01-01, turns days since the epoch into dates
+EPOCH_ORDINAL: int = datetime.date(1970, 1, 1).toordinal()
+
+ONE_DAY: datetime.timedelta = datetime.timedelta(days=1)
+
+
+def get_utc_offset(timestamp: int, tz: datetime.tzinfo) -> int:
+    return int(
+        datetime.datetime.fromtimestamp(timestamp, tz).utcoffset().total_seconds()
+    )
+
+
+def get_offset_changes(
+    start: int, end: int, tz: datetime.tzinfo
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the times between start and end at which the time zone's
+    utc offset changes (daylight saving), and the offset from each
+    on. The offset is checked once a day, then every change is
+    narrowed down to the exact second.
+    """
+
+    times: list[int] = [start]
+    offsets: list[int] = [get_utc_offset(start, tz)]
+
+    for day in range(start + DAY_SECONDS, end + DAY_SECONDS, DAY_SECONDS):
+        offset: int = get_utc_offset(day, tz)
+        if offset == offsets[-1]:
+            continue
+
+        # binary search the last day for the first second of the new offset
+        low, high = day - DAY_SECONDS, day
+        while low < high:
+            middle: int = (low + high) // 2
+            if get_utc_offset(middle, tz) == offsets[-1]:
+                low = middle + 1
+            else:
+                high = middle
+
+        times.append(low)
+        offsets.append(offset)
+
+    return np.array(times, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def to_local_seconds(timestamps: np.ndarray, tz: datetime.tzinfo) -> np.ndarray:
+    """
+    Shift unix timestamps by the time zone's utc offset at each of
+    them, so whole days and hours of the result are local ones.
+    """
+
+    if timestamps.size == 0:
+        return timestamps
+
+    times, offsets = get_offset_changes(
+        int(timestamps.min()), int(timestamps.max()), tz
+    )
+
+    return timestamps + offsets[np.searchsorted(times, timestamps, side="right") - 1]
+
+
+def get_local_day_start(day: datetime.date, tz: datetime.tzinfo) -> int:
+    """
+    Return the unix timestamp of local midnight starting the day.
+    """
+
+    return int(datetime.datetime(day.year, day.month, day.day, tzinfo=tz).timestamp())
+
+
+def get_window_counts(
+    account_id: int,
+    first_day: datetime.date,
+    last_day: datetime.date,
+    tz: datetime.tzinfo,
+) -> dict[datetime.date, int]:
+    """
+    Return the account's scrobble counts for the local days from
+    first_day through last_day that have any. Only that window's
+    timestamps are read, an index range however long the history is.
+    """
+
+    with Session.begin() as session:
+        packed: str = session.execute(
+            text(
+                "SELECT group_concat(unix_timestamp) FROM scrobble "
+                "WHERE account_id = :account_id "
+                "AND unix_timestamp >= :start AND unix_timestamp < :end"
+            ),
+            {
+                "account_id": account_id,
+                "start": get_local_day_start(first_day, tz),
+                "end": get_local_day_start(last_day + ONE_DAY, tz),
+            },
+        ).scalar()
+
+    if not packed:
+        return {}
+
+    timestamps: np.ndarray = np.fromstring(packed, dtype=np.int64, sep=",")
+    days, counts = np.unique(
+        to_local_seconds(timestamps, tz) // DAY_SECONDS, return_counts=True
+    )
+
+    return {
+        datetime.date.fromordinal(EPOCH_ORDINAL + day): count
+        for day, count in zip(days.tolist(), counts.tolist())
+    }
+
+
+def get_active_days(
+    account_id: int, tz: datetime.tzinfo, artist: str = None
+) -> np.ndarray:
+    """
+    Return the local days (since the epoch) the account has scrobbles
+    on, or scrobbles of the artist, in order. They come from the utc
+    day rollups kept at ingest without reading any scrobbles: a utc
+    day overlaps at most two local days, and its first and last
+    scrobbles fall on the first and last of those it has plays on.
+    (A 23 hour local day lying wholly inside one utc day, at a
+    daylight saving change, can be missed.)
+    """
+
+    if artist is None:
+        statement: str = (
+            "SELECT first_timestamp, last_timestamp FROM scrobble_day "
+            "WHERE account_id = :account_id"
+        )
+    else:
+        statement: str = (
+            "SELECT first_timestamp, last_timestamp FROM artist_day "
+            "WHERE account_id = :account_id AND artist = :artist"
+        )
+
+    with Session.begin() as session:
+        bounds: list[tuple[int, int]] = session.execute(
+            text(statement), {"account_id": account_id, "artist": artist}
+        ).all()
+
+    if not bounds:
+        return np.empty(0, dtype=np.int64)
+
+    timestamps: np.ndarray = np.array(bounds, dtype=np.int64).ravel()
+    return np.unique(to_local_seconds(timestamps, tz) // DAY_SECONDS)
+
+
+def to_date(day: int) -> datetime.date:
+    return datetime.date.fromordinal(EPOCH_ORDINAL + day)
+
+
+class DayRuns:
+    """
+    The runs of consecutive local days an account has scrobbles on,
+    as the first and last day of each run in order.
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, days: np.ndarray):
+        if days.size == 0:
+            self.starts = self.ends = days
+            return
+
+        breaks: np.ndarray = np.flatnonzero(np.diff(days) != 1)
+
+        self.starts: np.ndarray = days[np.concatenate(([0], breaks + 1))]
+        self.ends: np.ndarray = days[np.concatenate((breaks, [days.size - 1]))]
+
+    def current_streak(self, today: datetime.date) -> tuple[int, datetime.date]:
+        """
+        Return the length and first day of the run of days that
+        reaches today. A run ending yesterday still counts, since
+        today isn't over yet.
+        """
+
+        if self.ends.size == 0:
+            return 0, None
+
+        start, end = to_date(int(self.starts[-1])), to_date(int(self.ends[-1]))
+        if today - end > ONE_DAY:
+            return 0, None
+
+        return (end - start).days + 1, start
+
+    def longest_streak(self) -> tuple[int, datetime.date, datetime.date]:
+        """
+        Return the length, first and last day of the longest run,
+        the earliest if several are as long.
+        """
+
+        if self.ends.size == 0:
+            return 0, None, None
+
+        longest: int = int(np.argmax(self.ends - self.starts))
+
+        return (
+            int(self.ends[longest] - self.starts[longest]) + 1,
+            to_date(int(self.starts[longest])),
+            to_date(int(self.ends[longest])),
+        )
+
+
+def get_day_runs(account_id: int, tz: datetime.tzinfo, artist: str = None) -> DayRuns:
+    return DayRuns(get_active_days(account_id, tz, artist))
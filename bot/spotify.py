@@ -6,7 +6,8 @@ import urllib3
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 
-from main import SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET
+from config import SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET
+from metrics import timed
 
 # client: spotipy.Spotify = spotipy.Spotify(
 #     client_credentials_manager=SpotifyClientCredentials(
@@ -17,11 +18,12 @@ from main import SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET
 # )
 
 
-def get_artist_image_url(artist: str) -> str:
+def get_client() -> spotipy.Spotify:
     """
-    Returns the artist's image URL, retrieved from Spotify.
+    Return a Spotify client authenticated with the bot's credentials.
     """
-    client: spotipy.Spotify = spotipy.Spotify(
+
+    return spotipy.Spotify(
         client_credentials_manager=SpotifyClientCredentials(
             client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET
         ),
@@ -29,6 +31,14 @@ def get_artist_image_url(artist: str) -> str:
         retries=10,
     )
 
+
+@timed("spotify")
+def get_artist_image_url(artist: str) -> str:
+    """
+    Returns the artist's image URL, retrieved from Spotify.
+    """
+    client: spotipy.Spotify = get_client()
+
     try:
         search_info: dict = client.search(q=f"artist:{artist}", limit=1, type="artist")
         artist_info: dict = search_info["artists"]["items"][0]
@@ -40,18 +50,13 @@ def get_artist_image_url(artist: str) -> str:
         return None
 
 
+@timed("spotify")
 def get_track_image_url(track: str, artist: str) -> str:
     """
     Returns the track's image URL, retrieved from Spotify.
     """
 
-    client: spotipy.Spotify = spotipy.Spotify(
-        client_credentials_manager=SpotifyClientCredentials(
-            client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET
-        ),
-        requests_timeout=10,
-        retries=10,
-    )
+    client: spotipy.Spotify = get_client()
 
     try:
         if artist:
@@ -82,18 +87,13 @@ def get_track_image_url(track: str, artist: str) -> str:
         return None
 
 
+@timed("spotify")
 def get_album_image_url(album: str, artist: str) -> str:
     """
     Returns the track's image URL, retrieved from Spotify.
     """
 
-    client: spotipy.Spotify = spotipy.Spotify(
-        client_credentials_manager=SpotifyClientCredentials(
-            client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET
-        ),
-        requests_timeout=10,
-        retries=10,
-    )
+    client: spotipy.Spotify = get_client()
 
     # spotify doesn't return pic for alternate world
     if album == "Dawn FM (Alternate World)":
@@ -128,19 +128,14 @@ def get_album_image_url(album: str, artist: str) -> str:
         return None
 
 
+@timed("spotify")
 def get_track_info(track: str, artist: str = None) -> tuple:
     """
     Returns the track's title, album, and cover art url retrieved
     from Spotify.
     """
 
-    client: spotipy.Spotify = spotipy.Spotify(
-        client_credentials_manager=SpotifyClientCredentials(
-            client_id=SPOTIPY_CLIENT_ID, client_secret=SPOTIPY_CLIENT_SECRET
-        ),
-        requests_timeout=10,
-        retries=10,
-    )
+    client: spotipy.Spotify = get_client()
 
     try:
         if artist:
@@ -0,0 +1,199 @@
+### keeps stored scrobbles up to date from inside the bot's event loop
+
+import asyncio
+import itertools
+import time
+import traceback
+
+from data_grabber import (
+    ACCOUNT_CONCURRENCY,
+    get_account,
+    get_linked_accounts,
+    update_account_scrobbles,
+)
+from ingest import ScrobbleWriter
+from lfm_client import LastFMClient
+from metrics import Counter, register
+
+# sync priorities, lower runs first
+URGENT: int = 0  # new accounts from /lfm set
+REQUESTED: int = 1  # a command waiting on fresh data
+ROUTINE: int = 2  # the periodic sweep of every account
+
+PRIORITY_NAMES: dict[int, str] = {
+    URGENT: "urgent",
+    REQUESTED: "requested",
+    ROUTINE: "routine",
+}
+
+SYNCS_TOTAL: Counter = register(
+    Counter(
+        "jam_tracker_syncs_total",
+        "Account syncs run by the in-bot sync service.",
+        ("priority", "status"),
+    )
+)
+
+
+class SyncService:
+    """
+    Syncs accounts' scrobbles on the bot's event loop. A priority
+    queue feeds a few worker tasks, so a newly linked account or a
+    command waiting on fresh data jumps ahead of the routine sweep
+    that queues every linked account each interval. An account is
+    only ever queued or syncing once at a time, and every sync's
+    scrobbles are stored through one shared writer.
+    """
+
+    def __init__(
+        self,
+        client: LastFMClient,
+        interval: float = 60,
+        workers: int = ACCOUNT_CONCURRENCY,
+        fresh_for: float = 30,
+    ):
+        self.client = client
+        self.writer = ScrobbleWriter()
+        self.interval = interval
+        self.workers = workers
+        # a requested sync is skipped if the account synced this recently
+        self.fresh_for = fresh_for
+
+        # (priority, order, lowercase username, username)
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.tasks: list[asyncio.Task] = []
+
+        # lowercase username -> (priority, future) while queued
+        self.pending: dict[str, tuple[int, asyncio.Future]] = {}
+        # lowercase username -> future while syncing
+        self.running: dict[str, asyncio.Future] = {}
+        # lowercase username -> time.monotonic() of its last finished sync
+        self.last_synced: dict[str, float] = {}
+
+        # breaks priority ties in queue order
+        self._counter = itertools.count()
+
+    def start(self) -> None:
+        """
+        Start the workers and the periodic sweep, if not already running.
+        """
+
+        if self.tasks:
+            return
+
+        self.writer.start()
+        self.tasks = [asyncio.create_task(self._sweep())]
+        self.tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+
+        self.tasks = []
+        self.writer.stop()
+
+    def queue_depth(self) -> int:
+        return len(self.pending)
+
+    def enqueue(self, username: str, priority: int = ROUTINE) -> asyncio.Future:
+        """
+        Queue a sync of the account and return a future resolving to
+        whether it succeeded. Joins the account's queued or running
+        sync instead if there is one, moving it up if this is more urgent.
+        """
+
+        key: str = username.lower()
+
+        if key in self.running:
+            return self.running[key]
+
+        if key in self.pending:
+            queued_priority, future = self.pending[key]
+            if priority >= queued_priority:
+                return future
+
+        else:
+            future = asyncio.get_running_loop().create_future()
+
+        # the older, less urgent queue entry is skipped once popped
+        self.pending[key] = (priority, future)
+        self.queue.put_nowait((priority, next(self._counter), key, username))
+
+        return future
+
+    async def sync_now(self, username: str, timeout_ms: float) -> bool:
+        """
+        Sync the account ahead of the routine sweep and wait up to
+        timeout_ms for it. Returns True if the stored data is fresh,
+        False if the sync failed or is still running in the background.
+        """
+
+        last_synced: float = self.last_synced.get(username.lower())
+        if last_synced is not None and time.monotonic() - last_synced < self.fresh_for:
+            return True
+
+        future: asyncio.Future = self.enqueue(username, REQUESTED)
+
+        try:
+            # shield so timing out doesn't cancel the sync itself
+            return await asyncio.wait_for(asyncio.shield(future), timeout_ms / 1000)
+
+        except asyncio.TimeoutError:
+            return False
+
+    async def _sweep(self) -> None:
+        """
+        Queue a routine sync of every linked account each interval.
+        """
+
+        while True:
+            try:
+                accounts: list[tuple] = await asyncio.to_thread(get_linked_accounts)
+
+                for _, username, _ in accounts:
+                    self.enqueue(username, ROUTINE)
+
+            except Exception:
+                traceback.print_exc()
+
+            await asyncio.sleep(self.interval)
+
+    async def _work(self) -> None:
+        while True:
+            priority, _, key, username = await self.queue.get()
+
+            # skip entries superseded by a more urgent one
+            if self.pending.get(key, (None,))[0] != priority:
+                continue
+
+            _, future = self.pending.pop(key)
+            self.running[key] = future
+
+            success: bool = False
+            try:
+                success = await self._sync(username)
+
+            except Exception:
+                traceback.print_exc()
+
+            finally:
+                del self.running[key]
+                if success:
+                    self.last_synced[key] = time.monotonic()
+
+                if not future.done():
+                    future.set_result(success)
+
+                SYNCS_TOTAL.inc(
+                    priority=PRIORITY_NAMES[priority],
+                    status="ok" if success else "error",
+                )
+
+    async def _sync(self, username: str) -> bool:
+        account: tuple[int, str, int] = await asyncio.to_thread(get_account, username)
+
+        # unlinked before its turn came up
+        if account is None:
+            return False
+
+        return await update_account_scrobbles(self.client, self.writer, *account)
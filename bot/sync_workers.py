@@ -0,0 +1,269 @@
+### run the scrobble grabber as several worker processes
+#
+# accounts are split between live workers by consistent hashing of
+# the account id, and a lease row per account makes sure no two
+# workers sync it at once. workers that die stop renewing their
+# heartbeat and leases, so the rest take over their accounts once
+# those lapse.
+
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import time
+import traceback
+
+import schedule
+from sqlalchemy import delete, text, update
+
+from data_grabber import (
+    REQUESTS_PER_SECOND,
+    get_linked_accounts,
+    limiter,
+    update_account_scrobbles,
+)
+from data_interface import Session, SyncLease, SyncWorker
+from ingest import ScrobbleWriter
+from lfm_client import LastFMClient, RateLimiter
+from config import LFM_API_KEY, LFM_API_URL
+
+# seconds between a worker's passes over its accounts
+SYNC_INTERVAL: int = 60
+
+# a worker missing heartbeats for this long is treated as dead,
+# and its leases lapse after the same time
+LEASE_SECONDS: int = 300
+
+# how often workers renew their heartbeat and leases
+HEARTBEAT_SECONDS: int = 30
+
+# points each worker gets on the hash ring, more spreads accounts evenly
+VIRTUAL_NODES: int = 100
+
+# accounts one worker syncs at the same time
+WORKER_CONCURRENCY: int = 2
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to nodes. Adding or removing
+    a node only moves the keys that node gains or loses.
+    """
+
+    def __init__(self, nodes: list[str], virtual_nodes: int = VIRTUAL_NODES):
+        self.points: list[tuple[int, str]] = sorted(
+            (hash_key(f"{node}#{i}"), node)
+            for node in nodes
+            for i in range(virtual_nodes)
+        )
+        self.hashes: list[int] = [point for point, _ in self.points]
+
+    def get_node(self, key: str) -> str:
+        """
+        Return the node owning key, or None if the ring is empty.
+        """
+
+        if not self.points:
+            return None
+
+        index: int = bisect.bisect(self.hashes, hash_key(key)) % len(self.points)
+        return self.points[index][1]
+
+
+def heartbeat(worker: str) -> None:
+    """
+    Record that the worker is alive and extend every lease it holds.
+    """
+
+    now: int = int(time.time())
+
+    with Session.begin() as session:
+        if (row := session.get(SyncWorker, worker)) is None:
+            session.add(SyncWorker(name=worker, heartbeat=now))
+
+        else:
+            row.heartbeat = now
+
+        session.execute(
+            update(SyncLease)
+            .where(SyncLease.worker == worker)
+            .values(expires_at=now + LEASE_SECONDS)
+        )
+
+
+def get_live_workers() -> list[str]:
+    """
+    Return the names of workers that have checked in recently.
+    """
+
+    with Session.begin() as session:
+        return [
+            name
+            for (name,) in session.query(SyncWorker.name).filter(
+                SyncWorker.heartbeat >= int(time.time()) - LEASE_SECONDS
+            )
+        ]
+
+
+def acquire_lease(account_id: int, worker: str) -> bool:
+    """
+    Claim the account for the worker, succeeding if nobody holds it,
+    the holder's lease lapsed, or the worker already holds it.
+    """
+
+    now: int = int(time.time())
+
+    with Session.begin() as session:
+        session.execute(
+            text(
+                "INSERT INTO sync_lease (account_id, worker, expires_at) "
+                "VALUES (:account_id, :worker, :expires_at) "
+                "ON CONFLICT (account_id) DO UPDATE SET "
+                "worker = excluded.worker, expires_at = excluded.expires_at "
+                "WHERE sync_lease.expires_at < :now OR sync_lease.worker = excluded.worker"
+            ),
+            {
+                "account_id": account_id,
+                "worker": worker,
+                "expires_at": now + LEASE_SECONDS,
+                "now": now,
+            },
+        )
+
+        holder: str = (
+            session.query(SyncLease.worker).filter_by(account_id=account_id).scalar()
+        )
+
+    return holder == worker
+
+
+def release_lease(account_id: int, worker: str) -> None:
+    with Session.begin() as session:
+        session.execute(
+            delete(SyncLease).where(
+                SyncLease.account_id == account_id, SyncLease.worker == worker
+            )
+        )
+
+
+async def keep_alive(worker: str) -> None:
+    while True:
+        try:
+            await asyncio.to_thread(heartbeat, worker)
+
+        except Exception:
+            traceback.print_exc()
+
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+
+
+async def sync_owned_accounts(
+    client: LastFMClient, writer: ScrobbleWriter, worker: str
+) -> None:
+    """
+    Sync every linked account the hash ring gives this worker.
+    """
+
+    ring = HashRing(await asyncio.to_thread(get_live_workers))
+    accounts: list[tuple[int, str, int]] = [
+        account
+        for account in await asyncio.to_thread(get_linked_accounts)
+        if ring.get_node(str(account[0])) == worker
+    ]
+
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+
+    async def sync(account: tuple[int, str, int]) -> None:
+        account_id: int = account[0]
+
+        async with semaphore:
+            # still held by a worker that owned it before the ring changed
+            if not await asyncio.to_thread(acquire_lease, account_id, worker):
+                return
+
+            try:
+                await update_account_scrobbles(client, writer, *account)
+
+            finally:
+                await asyncio.to_thread(release_lease, account_id, worker)
+
+    await asyncio.gather(*[sync(account) for account in accounts])
+
+
+def get_request_share(total_workers: int) -> float:
+    """
+    Return the requests per second each worker, and the supervisor's
+    batch jobs, may send. last.fm's limit applies to the api key, so
+    they split it.
+    """
+
+    return REQUESTS_PER_SECOND / (total_workers + 1)
+
+
+async def run_worker(worker: str, total_workers: int) -> None:
+    worker_limiter = RateLimiter(get_request_share(total_workers))
+
+    # check in before the first pass so this worker is on the ring
+    await asyncio.to_thread(heartbeat, worker)
+    heartbeat_task: asyncio.Task = asyncio.create_task(keep_alive(worker))
+
+    async with LastFMClient(
+        LFM_API_KEY, base_url=LFM_API_URL, limiter=worker_limiter
+    ) as client, ScrobbleWriter() as writer:
+        try:
+            while True:
+                start: float = time.monotonic()
+
+                try:
+                    await sync_owned_accounts(client, writer, worker)
+
+                except Exception:
+                    traceback.print_exc()
+
+                await asyncio.sleep(max(0, SYNC_INTERVAL - (time.monotonic() - start)))
+
+        finally:
+            heartbeat_task.cancel()
+
+
+def worker_process(worker: str, total_workers: int) -> None:
+    print(f"starting {worker}")
+    asyncio.run(run_worker(worker, total_workers))
+
+
+def run_workers(total_workers: int) -> None:
+    """
+    Start the worker processes and restart any that die. A restarted
+    worker keeps its name, and with it its place on the ring and any
+    leases that haven't lapsed.
+    """
+
+    # reconciliation runs here and draws from the grabber's limiter
+    limiter.rate = get_request_share(total_workers)
+
+    names: list[str] = [f"worker-{i}" for i in range(total_workers)]
+    processes: dict[str, multiprocessing.Process] = {}
+
+    while True:
+        for name in names:
+            process: multiprocessing.Process = processes.get(name)
+
+            if process is None or not process.is_alive():
+                if process is not None:
+                    print(f"{name} exited with code {process.exitcode}, restarting")
+
+                process = multiprocessing.Process(
+                    target=worker_process, args=(name, total_workers), daemon=True
+                )
+                process.start()
+                processes[name] = process
+
+        # batch jobs the grabber scheduled, like the wrapped reports,
+        # which only start their own threads here
+        schedule.run_pending()
+
+        time.sleep(5)
@@ -0,0 +1,192 @@
+### compact per-account artist play counts for comparing users' taste
+
+import math
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, text
+
+from data_interface import Session
+
+# accounts whose vectors are kept in memory, least recently used go first
+MAX_VECTORS: int = 2000
+
+# accounts loaded per query, keeps each IN-list well under sqlite's limit
+LOAD_BATCH_SIZE: int = 500
+
+# lowercase artist name -> id shared by every vector, so vectors hold ints
+artist_ids: dict[str, int] = {}
+# id -> artist name as first seen
+artist_names: list[str] = []
+
+# vectors are built on several threads, ids are handed out one at a time
+artist_ids_lock = threading.Lock()
+
+
+def get_artist_id(artist: str) -> int:
+    key: str = artist.lower()
+
+    if (artist_id := artist_ids.get(key)) is None:
+        artist_id = artist_ids[key] = len(artist_names)
+        artist_names.append(artist)
+
+    return artist_id
+
+
+class ArtistVector:
+    """
+    One account's play count per artist id, along with the sum of
+    squared counts so similarity doesn't have to recompute it.
+    scrobble_count is the account's stored scrobble count the vector
+    was built at, it's out of date once that changes.
+    """
+
+    __slots__ = ("counts", "norm_squared", "scrobble_count")
+
+    def __init__(self, scrobble_count: int):
+        self.counts: dict[int, int] = {}
+        self.norm_squared: int = 0
+        self.scrobble_count: int = scrobble_count
+
+    def add(self, artist_id: int, plays: int) -> None:
+        old: int = self.counts.get(artist_id, 0)
+        self.counts[artist_id] = old + plays
+        self.norm_squared += (old + plays) ** 2 - old**2
+
+
+def cosine_similarity(a: ArtistVector, b: ArtistVector) -> float:
+    """
+    Return the cosine similarity of two accounts' artist play counts,
+    0 when they share nothing and 1 when their counts are proportional.
+    """
+
+    if not a.norm_squared or not b.norm_squared:
+        return 0.0
+
+    # intersecting the key views runs in C, only shared artists add to the sum
+    a_counts: dict[int, int] = a.counts
+    b_counts: dict[int, int] = b.counts
+    dot: int = sum(
+        a_counts[artist_id] * b_counts[artist_id]
+        for artist_id in a_counts.keys() & b_counts.keys()
+    )
+
+    return dot / math.sqrt(a.norm_squared * b.norm_squared)
+
+
+def shared_top_artists(
+    a: ArtistVector, b: ArtistVector, limit: int
+) -> list[tuple[str, int, int]]:
+    """
+    Return the name and both play counts of the artists both accounts
+    have played, ranked by the smaller of the two counts.
+    """
+
+    shared: list[int] = sorted(
+        a.counts.keys() & b.counts.keys(),
+        key=lambda artist_id: min(a.counts[artist_id], b.counts[artist_id]),
+        reverse=True,
+    )
+
+    return [
+        (artist_names[artist_id], a.counts[artist_id], b.counts[artist_id])
+        for artist_id in shared[:limit]
+    ]
+
+
+class ArtistVectorCache:
+    """
+    Keeps accounts' artist vectors in memory, built from their
+    play_tally rows. A vector is rebuilt only once its account's
+    stored scrobble count has moved on, which costs one lookup per
+    artist the account has played however long its history is, and
+    only the accounts asked for are ever looked at. Blocks, so
+    commands should call get_vectors on a thread.
+    """
+
+    def __init__(self, max_vectors: int = MAX_VECTORS):
+        self.max_vectors = max_vectors
+        self.vectors: OrderedDict[int, ArtistVector] = OrderedDict()
+
+        # commands on different threads share the cache
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def get_vectors(self, account_ids: list[int]) -> dict[int, ArtistVector]:
+        """
+        Return up to date vectors for the accounts, by account id.
+        """
+
+        unique_ids: list[int] = list(dict.fromkeys(account_ids))
+        loaded: dict[int, ArtistVector] = {}
+
+        with Session.begin() as session:
+            counts: dict[int, int] = {}
+            for i in range(0, len(unique_ids), LOAD_BATCH_SIZE):
+                counts.update(
+                    session.execute(
+                        text(
+                            "SELECT id, scrobble_count FROM lfm_account "
+                            "WHERE id IN :account_ids"
+                        ).bindparams(bindparam("account_ids", expanding=True)),
+                        {"account_ids": unique_ids[i : i + LOAD_BATCH_SIZE]},
+                    ).all()
+                )
+
+            with self.lock:
+                stale: list[int] = [
+                    account_id
+                    for account_id in unique_ids
+                    if account_id not in self.vectors
+                    or self.vectors[account_id].scrobble_count
+                    != counts.get(account_id, 0)
+                ]
+
+            for i in range(0, len(stale), LOAD_BATCH_SIZE):
+                loaded.update(self._load(session, stale[i : i + LOAD_BATCH_SIZE]))
+
+        with self.lock:
+            self.vectors.update(loaded)
+
+            vectors: dict[int, ArtistVector] = {}
+            for account_id in account_ids:
+                self.vectors.move_to_end(account_id)
+                vectors[account_id] = self.vectors[account_id]
+
+            while len(self.vectors) > self.max_vectors:
+                self.vectors.popitem(last=False)
+
+        return vectors
+
+    def _load(self, session, account_ids: list[int]) -> dict[int, ArtistVector]:
+        """
+        Build vectors for the accounts from their artist tallies.
+        """
+
+        # one statement so the tallies and the scrobble counts come
+        # from the same snapshot, with nothing stored in between
+        rows: list[tuple] = session.execute(
+            text(
+                "SELECT id, NULL, scrobble_count FROM lfm_account "
+                "WHERE id IN :account_ids "
+                "UNION ALL "
+                "SELECT account_id, artist, plays FROM play_tally "
+                "WHERE account_id IN :account_ids AND kind = 'artist'"
+            ).bindparams(bindparam("account_ids", expanding=True)),
+            {"account_ids": account_ids},
+        ).all()
+
+        vectors: dict[int, ArtistVector] = {
+            account_id: ArtistVector(0) for account_id in account_ids
+        }
+
+        with artist_ids_lock:
+            for account_id, artist, plays in rows:
+                if artist is None:
+                    vectors[account_id].scrobble_count = plays
+                else:
+                    vectors[account_id].add(get_artist_id(artist), plays)
+
+        return vectors
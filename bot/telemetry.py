@@ -0,0 +1,206 @@
+### records where each command spends its time and serves the metrics
+
+import sys
+import time
+import traceback
+
+import discord
+from discord import ApplicationContext
+from discord.commands import slash_command
+from discord.ext import commands
+
+from cache import TTLCache
+from data_interface import get_db_size
+from config import METRICS_PORT
+from metrics import (
+    CommandTimer,
+    CountingExecutor,
+    finish_command,
+    percentile,
+    recent_command_seconds,
+    recent_ingest_commits,
+    recent_queries,
+    recent_rate_limit_waits,
+    start_command,
+    start_metrics_server,
+)
+
+# number of slow queries /perf lists
+SLOW_QUERY_COUNT: int = 5
+
+# seconds of group commits /perf averages ingest speed over
+INGEST_WINDOW_SECONDS: int = 60
+
+
+class Telemetry(commands.Cog):
+    def __init__(self, bot: discord.Bot) -> None:
+        self.bot: discord.Bot = bot
+
+        # before/after hooks run in the command's own task, so the
+        # timer they set is seen by everything the command awaits
+        self.bot.before_invoke(self.start_timer)
+        self.bot.after_invoke(self.stop_timer)
+
+        # runs everything commands send through asyncio.to_thread
+        self.executor = CountingExecutor()
+        self.bot.loop.set_default_executor(self.executor)
+
+        self.server = None
+        if METRICS_PORT:
+            self.server = start_metrics_server(int(METRICS_PORT))
+            print(f"Serving metrics on port {METRICS_PORT}")
+
+    def cog_unload(self) -> None:
+        self.bot._before_invoke = None
+        self.bot._after_invoke = None
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    async def start_timer(self, ctx: ApplicationContext) -> None:
+        ctx.command_timer = start_command(ctx.command.qualified_name)
+
+    async def stop_timer(self, ctx: ApplicationContext) -> None:
+        if (timer := getattr(ctx, "command_timer", None)) is not None:
+            timer.stop()
+
+    @commands.Cog.listener()
+    async def on_application_command_completion(self, ctx: ApplicationContext):
+        if (timer := getattr(ctx, "command_timer", None)) is not None:
+            finish_command(timer, "ok")
+
+    @commands.Cog.listener()
+    async def on_application_command_error(
+        self, ctx: ApplicationContext, error: Exception
+    ):
+        # commands stopped by a failed check or cooldown never started a timer
+        timer: CommandTimer = getattr(ctx, "command_timer", None)
+        if timer is not None:
+            finish_command(timer, "error")
+
+        # any error listener turns off the bot's default error printing,
+        # so keep printing the errors nothing else handles
+        if ctx.command and ctx.command.has_error_handler():
+            return
+
+        if ctx.cog and ctx.cog.has_error_handler():
+            return
+
+        print(f"Ignoring exception in command {ctx.command}:", file=sys.stderr)
+        traceback.print_exception(
+            type(error), error, error.__traceback__, file=sys.stderr
+        )
+
+    @commands.is_owner()
+    @slash_command(name="perf", guild_ids=[315782312476409867])
+    async def perf(self, ctx: ApplicationContext) -> None:
+        """
+        Show recent command latencies, cache and queue stats and the
+        slowest recent queries. Everything comes from in-memory
+        buffers, so checking doesn't add load.
+        """
+
+        embed: discord.Embed = discord.Embed(title="Performance")
+
+        command_lines: list[str] = []
+        for command, samples in sorted(recent_command_seconds.items()):
+            samples = list(samples)
+            command_lines.append(
+                f"**{command}** ({len(samples)}): "
+                f"p50 `{format_ms(percentile(samples, 50))}` "
+                f"p95 `{format_ms(percentile(samples, 95))}` "
+                f"p99 `{format_ms(percentile(samples, 99))}`"
+            )
+
+        embed.add_field(
+            name="Command latency",
+            # embed fields are capped at 1024 characters
+            value="\n".join(command_lines)[:1024] or "No commands run yet.",
+            inline=False,
+        )
+
+        if (lastfm_cog := self.bot.get_cog("LastFM")) is not None:
+            lastfm = lastfm_cog.lastfm
+
+            caches: dict[str, TTLCache] = {
+                "now playing": lastfm.now_playing_cache,
+                "profile": lastfm.profile_cache,
+            }
+            embed.add_field(
+                name="Caches",
+                value="\n".join(
+                    f"**{name}**: `{cache.hit_rate():.0%}` hit rate, "
+                    f"{cache.hits} hits, {cache.misses} misses, "
+                    f"{cache.coalesced} coalesced, {len(cache)} entries"
+                    for name, cache in caches.items()
+                ),
+                inline=False,
+            )
+
+            limiter = lastfm.limiter
+            waits: list[float] = list(recent_rate_limit_waits)
+            embed.add_field(
+                name="Last.fm rate limiter",
+                value=f"{limiter.waits}/{limiter.calls} requests waited, "
+                f"`{limiter.wait_seconds:.1f}s` total, "
+                f"recent p95 `{format_ms(percentile(waits, 95))}`",
+                inline=False,
+            )
+
+            queued: str = (
+                f"last.fm requests in flight: `{lastfm.client.in_flight}`\n"
+                f"to_thread pool: `{self.executor.queued}`"
+            )
+            if lastfm_cog.sync is not None:
+                queued += (
+                    f"\naccounts waiting to sync: `{lastfm_cog.sync.queue_depth()}`"
+                    f"\nbatches waiting to be stored: `{lastfm_cog.sync.writer.queue_depth()}`"
+                )
+
+            embed.add_field(name="Queued work", value=queued)
+
+        embed.add_field(name="Database", value=f"`{get_db_size() / 2**20:.1f} MB`")
+
+        since: float = time.monotonic() - INGEST_WINDOW_SECONDS
+        commits: list[tuple[int, float]] = [
+            (rows, seconds)
+            for end, rows, seconds in recent_ingest_commits
+            if end >= since
+        ]
+        embed.add_field(
+            name="Scrobble ingest",
+            value=f"`{sum(rows for rows, _ in commits) / INGEST_WINDOW_SECONDS:.1f}` rows/s, "
+            f"{len(commits)} commits, p95 commit "
+            f"`{format_ms(percentile([seconds for _, seconds in commits], 95))}`",
+        )
+
+        slowest: list[tuple[float, str]] = sorted(
+            list(recent_queries), key=lambda query: query[0], reverse=True
+        )[:SLOW_QUERY_COUNT]
+        embed.add_field(
+            name="Slowest recent queries",
+            value="\n".join(
+                f"`{format_ms(seconds)}` `{' '.join(statement.split())[:90]}`"
+                for seconds, statement in slowest
+            )
+            or "None yet.",
+            inline=False,
+        )
+
+        await ctx.respond(embed=embed)
+
+
+def format_ms(seconds: float) -> str:
+    """
+    Format a duration in seconds as milliseconds.
+    """
+
+    if seconds is None:
+        return "-"
+
+    return f"{seconds * 1000:.1f}ms"
+
+
+def setup(bot: discord.Bot) -> None:
+    bot.add_cog(Telemetry(bot))
@@ -0,0 +1,194 @@
+### fuzzy lookups of a user's tracks using the local full-text index
+
+import re
+from difflib import SequenceMatcher
+
+from sqlalchemy import text
+
+# version tags that differ between spotify, last.fm and what people type
+VERSION_TAG = re.compile(
+    r"\s*[\(\[][^\)\]]*(feat\.?|ft\.?|with|remaster|version|edit|live|mono|stereo|deluxe|mix)[^\)\]]*[\)\]]",
+    re.IGNORECASE,
+)
+VERSION_SUFFIX = re.compile(
+    r"\s+-\s+[^-]*(feat\.?|ft\.?|remaster|version|edit|live|mono|stereo|deluxe|mix).*$",
+    re.IGNORECASE,
+)
+NON_WORD = re.compile(r"[^\w\s]")
+
+# smallest similarity for a candidate to count as a match
+MIN_SCORE: float = 0.6
+
+# least a title scores when the search is its first words, or whole
+# words from elsewhere in it
+PREFIX_SCORE: float = 0.75
+CONTAINED_SCORE: float = 0.65
+
+# number of full-text hits re-scored in python
+CANDIDATE_LIMIT: int = 25
+
+
+def normalize_title(title: str) -> str:
+    """
+    Lowercase a track title and strip version tags like
+    "(feat. X)" or "- Remastered 2011" along with punctuation.
+    """
+
+    title = VERSION_TAG.sub("", title)
+    title = VERSION_SUFFIX.sub("", title)
+    title = NON_WORD.sub(" ", title.lower())
+
+    return " ".join(title.split())
+
+
+def build_match_query(search: str, match_all: bool, column: str = "title") -> str:
+    """
+    Turn a normalized search string into an fts5 trigram query on
+    one column. match_all requires every trigram (a substring match),
+    otherwise any shared trigram makes a row a candidate.
+    """
+
+    trigrams: list[str] = list(
+        dict.fromkeys(search[i : i + 3] for i in range(len(search) - 2))
+    )
+    quoted: list[str] = ['"' + trigram.replace('"', '""') + '"' for trigram in trigrams]
+
+    joined: str = (" AND " if match_all else " OR ").join(quoted)
+
+    return f"{column} : ({joined})"
+
+
+def get_candidates(
+    session, account_id: int, search: str, search_artist: str = None
+) -> list[tuple[str, str]]:
+    """
+    Return (title, artist) pairs from the account's known tracks
+    that could match the normalized search string, best ranked first.
+    With an artist, tracks sharing some of it are looked for first so
+    a common title's other artists can't crowd the right one out.
+    """
+
+    # trigram index can't match anything shorter than 3 characters
+    if len(search) < 3:
+        # the search is matched literally, wildcards included
+        escaped: str = (
+            search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        )
+
+        rows = session.execute(
+            text(
+                "SELECT title, artist FROM known_track "
+                "WHERE account_id = :account_id "
+                "AND title LIKE :pattern ESCAPE '\\' LIMIT :limit"
+            ),
+            {
+                "account_id": account_id,
+                "pattern": f"%{escaped}%",
+                "limit": CANDIDATE_LIMIT,
+            },
+        ).all()
+
+        return [tuple(row) for row in rows]
+
+    # the account column holds each track's account as "<id>"
+    account: str = f'account : "<{account_id}>"'
+
+    artist_queries: list[str] = [""]
+    if search_artist and len(search_artist) >= 3:
+        artist_queries.insert(
+            0, " AND " + build_match_query(search_artist, False, "artist")
+        )
+
+    # try a strict substring match first, only falling back to
+    # any-trigram matching (typos, missing words) if it finds nothing
+    for match_all in (True, False):
+        for artist_query in artist_queries:
+            rows = session.execute(
+                text(
+                    "SELECT known_track.title, known_track.artist FROM track_search "
+                    "JOIN known_track ON known_track.id = track_search.rowid "
+                    "WHERE track_search MATCH :query "
+                    "ORDER BY track_search.rank LIMIT :limit"
+                ),
+                {
+                    "query": f"{account} AND "
+                    + build_match_query(search, match_all)
+                    + artist_query,
+                    "limit": CANDIDATE_LIMIT,
+                },
+            ).all()
+
+            if rows:
+                return [tuple(row) for row in rows]
+
+    return []
+
+
+def score_title(search_title: str, title: str) -> float:
+    """
+    Return how similar a title is to the searched one, from 0 to 1.
+    A search that's the start of the title, or whole words from it,
+    scores high even when it's much shorter, so "love" finds
+    "Love Story".
+    """
+
+    title = normalize_title(title)
+    score: float = SequenceMatcher(None, search_title, title).ratio()
+
+    if title.startswith(search_title + " "):
+        return max(score, PREFIX_SCORE + (1 - PREFIX_SCORE) * score)
+
+    if f" {search_title} " in f" {title} ":
+        return max(score, CONTAINED_SCORE + (1 - CONTAINED_SCORE) * score)
+
+    return score
+
+
+def score_candidate(
+    search_title: str, search_artist: str, title: str, artist: str
+) -> float:
+    """
+    Return how similar a candidate is to what was searched for,
+    from 0 to 1, weighing the title over the artist.
+    """
+
+    title_score: float = score_title(search_title, title)
+
+    if not search_artist:
+        return title_score
+
+    artist_score: float = SequenceMatcher(
+        None, search_artist, normalize_title(artist)
+    ).ratio()
+
+    return 0.7 * title_score + 0.3 * artist_score
+
+
+def find_track(
+    session, account_id: int, track_title: str, track_artist: str = None
+) -> tuple[str, str]:
+    """
+    Return the stored (title, artist) of the account's track that
+    best matches the given title and optional artist, or None if
+    nothing is close enough. Uses only the local index.
+    """
+
+    search_title: str = normalize_title(track_title)
+    search_artist: str = normalize_title(track_artist) if track_artist else None
+
+    if not search_title:
+        return None
+
+    candidates: list[tuple[str, str]] = get_candidates(
+        session, account_id, search_title, search_artist
+    )
+
+    best: tuple[str, str] = None
+    best_score: float = MIN_SCORE
+    for title, artist in candidates:
+        score: float = score_candidate(search_title, search_artist, title, artist)
+
+        if score > best_score:
+            best, best_score = (title, artist), score
+
+    return best
@@ -0,0 +1,281 @@
+### year in review reports, built ahead of time by a batch job in the grabber
+
+import calendar
+import datetime
+import json
+import time
+import traceback
+from io import BytesIO
+from math import isqrt
+
+from PIL import Image
+from sqlalchemy import text
+
+from cmd_data_helpers import get_x_top_albums, get_x_top_artists, get_x_top_tracks
+from data_interface import Session, WrappedReport
+from image import combine_images
+from rollups import DAY_SECONDS, EPOCH_ORDINAL
+from spotify import get_artist_image_url
+
+# entries in each of the report's top lists
+TOP_COUNT: int = 5
+
+# the chart shows up to this many artists, the top ones that have an image
+CHART_SIZE: int = 9
+CHART_CANDIDATES: int = CHART_SIZE + 5
+
+# the current year's report goes out of date with every scrobble,
+# so it's only rebuilt this often
+CURRENT_YEAR_SECONDS: int = 24 * 60 * 60
+
+
+def get_year_bounds(year: int) -> tuple[int, int]:
+    """
+    Return the unix timestamps just before the utc year starts and
+    when the next one starts, the way get_x_top_* take ranges.
+    """
+
+    return (
+        calendar.timegm((year, 1, 1, 0, 0, 0)) - 1,
+        calendar.timegm((year + 1, 1, 1, 0, 0, 0)),
+    )
+
+
+def find_stale_reports(now: int) -> list[tuple[int, str, int, int]]:
+    """
+    Return the account id, username, year and scrobble count of every
+    linked account's year whose report is missing or was built from a
+    different number of scrobbles. Counts come from scrobble_day, so
+    this doesn't touch scrobble itself.
+    """
+
+    with Session.begin() as session:
+        counts: list[tuple[int, str, int, int]] = session.execute(
+            text(
+                "SELECT account_id, username, "
+                "CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER) AS year, "
+                "SUM(plays) FROM scrobble_day JOIN lfm_account ON lfm_account.id = account_id "
+                "WHERE account_id IN "
+                "(SELECT account_id FROM user_account WHERE account_id IS NOT NULL) "
+                "GROUP BY account_id, year"
+            )
+        ).all()
+
+        built: dict[tuple[int, int], tuple[int, int]] = {
+            (account_id, year): (scrobble_count, built_at)
+            for account_id, year, scrobble_count, built_at in session.query(
+                WrappedReport.account_id,
+                WrappedReport.year,
+                WrappedReport.scrobble_count,
+                WrappedReport.built_at,
+            )
+        }
+
+    current_year: int = datetime.datetime.utcfromtimestamp(now).year
+    stale: list[tuple[int, str, int, int]] = []
+
+    for account_id, username, year, count in counts:
+        if (account_id, year) not in built:
+            stale.append((account_id, username, year, count))
+            continue
+
+        built_count, built_at = built[(account_id, year)]
+        if built_count == count:
+            continue
+
+        if year == current_year and now - built_at < CURRENT_YEAR_SECONDS:
+            continue
+
+        stale.append((account_id, username, year, count))
+
+    return stale
+
+
+def get_year_days(account_id: int, year: int) -> list[tuple[int, int]]:
+    """
+    Return the utc days (since the epoch) the account scrobbled on
+    in the year, with how many scrobbles each.
+    """
+
+    after, before = get_year_bounds(year)
+
+    with Session.begin() as session:
+        return session.execute(
+            text(
+                "SELECT day, plays FROM scrobble_day WHERE account_id = :account_id "
+                "AND day >= :first_day AND day < :end_day"
+            ),
+            {
+                "account_id": account_id,
+                "first_day": (after + 1) // DAY_SECONDS,
+                "end_day": before // DAY_SECONDS,
+            },
+        ).all()
+
+
+def get_new_artists(account_id: int, year: int) -> list[tuple[str, int]]:
+    """
+    Return the artists the account first played in the year, with
+    their plays that year, most played first.
+    """
+
+    with Session.begin() as session:
+        return session.execute(
+            text(
+                "SELECT artist, SUM(CASE WHEN month < :end_month THEN plays END) AS year_plays "
+                "FROM month_tally WHERE account_id = :account_id AND kind = 'artist' "
+                "GROUP BY artist COLLATE NOCASE "
+                "HAVING MIN(month) >= :first_month AND MIN(month) < :end_month "
+                "ORDER BY year_plays DESC"
+            ),
+            {
+                "account_id": account_id,
+                "first_month": year * 12,
+                "end_month": (year + 1) * 12,
+            },
+        ).all()
+
+
+def render_chart(artists: list[str]) -> bytes:
+    """
+    Render a square chart of the first artists that have an image on
+    spotify, as png bytes. Returns None if none of them do.
+    """
+
+    names: list[str] = []
+    urls: list[str] = []
+    for artist in artists:
+        if len(urls) == CHART_SIZE:
+            break
+
+        if (url := get_artist_image_url(artist)) is not None:
+            names.append(artist)
+            urls.append(url)
+
+    if not urls:
+        return None
+
+    # combine_images lays images out in a square grid
+    size: int = isqrt(len(urls)) ** 2
+    chart: Image.Image = combine_images(names[:size], urls[:size])
+
+    with BytesIO() as image_binary:
+        chart.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+def build_report(account_id: int, username: str, year: int) -> tuple[dict, bytes]:
+    """
+    Work out the account's year in review and render its chart.
+    Top lists come from month_tally, since a year is twelve whole
+    months, and the day stats from scrobble_day.
+    """
+
+    after, before = get_year_bounds(year)
+
+    top_artists = get_x_top_artists(username, CHART_CANDIDATES, after, before)
+    top_albums = get_x_top_albums(username, TOP_COUNT, after, before)
+    top_tracks = get_x_top_tracks(username, TOP_COUNT, after, before)
+
+    days: list[tuple[int, int]] = get_year_days(account_id, year)
+
+    biggest_day: list = None
+    if days:
+        day, plays = max(days, key=lambda day: day[1])
+        biggest_day = [
+            datetime.date.fromordinal(EPOCH_ORDINAL + day).isoformat(),
+            plays,
+        ]
+
+    new_artists: list[tuple[str, int]] = get_new_artists(account_id, year)
+
+    report: dict = {
+        "year": year,
+        "scrobbles": sum(plays for _, plays in days),
+        "top_artists": [
+            [artist.artist, artist.artist_plays] for artist in top_artists[:TOP_COUNT]
+        ],
+        "top_albums": [
+            [album.album, album.artist, album.album_plays] for album in top_albums
+        ],
+        "top_tracks": [
+            [track.title, track.artist, track.lfm_url, track.track_plays]
+            for track in top_tracks
+        ],
+        "listening_days": len(days),
+        "days_in_year": 366 if calendar.isleap(year) else 365,
+        "biggest_day": biggest_day,
+        "new_artists": len(new_artists),
+        "top_new_artists": [list(artist) for artist in new_artists[:TOP_COUNT]],
+    }
+
+    image: bytes = None
+    try:
+        image = render_chart([artist.artist for artist in top_artists])
+
+    except Exception:
+        # a report without its chart is still worth storing
+        traceback.print_exc()
+
+    return report, image
+
+
+def build_wrapped_reports() -> None:
+    """
+    Build every report that's missing or out of date. Reports for
+    past years are only rebuilt when late scrobbles for that year
+    arrive, the current year's at most once every
+    CURRENT_YEAR_SECONDS. Meant to run periodically in the grabber.
+    """
+
+    now: int = int(time.time())
+    stale: list[tuple[int, str, int, int]] = find_stale_reports(now)
+
+    if stale:
+        print(f"building {len(stale)} wrapped reports")
+
+    for account_id, username, year, count in stale:
+        try:
+            report, image = build_report(account_id, username, year)
+
+        except Exception:
+            print(f"failed to build {username}'s {year} wrapped")
+            traceback.print_exc()
+            continue
+
+        with Session.begin() as session:
+            session.merge(
+                WrappedReport(
+                    account_id=account_id,
+                    year=year,
+                    scrobble_count=count,
+                    built_at=now,
+                    report=json.dumps(report),
+                    image=image,
+                )
+            )
+
+
+def get_wrapped_report(discord_id: int, year: int) -> tuple[dict, bytes, int]:
+    """
+    Return the stored report for the discord user's account and year,
+    along with its chart and when it was built, or None if it hasn't
+    been built yet.
+    """
+
+    with Session.begin() as session:
+        row: tuple[str, bytes, int] = session.execute(
+            text(
+                "SELECT report, image, built_at FROM wrapped_report "
+                "WHERE account_id = "
+                "(SELECT account_id FROM user_account WHERE discord_id = :discord_id) "
+                "AND year = :year"
+            ),
+            {"discord_id": discord_id, "year": year},
+        ).first()
+
+    if row is None:
+        return None
+
+    report, image, built_at = row
+    return json.loads(report), image, built_at
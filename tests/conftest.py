@@ -0,0 +1,68 @@
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+BOT_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+DB_FILE: str = os.path.join(tempfile.mkdtemp(), "test.db")
+
+# the bot's modules import each other by name and open the database
+# as they're imported, so point them at a throwaway one first
+sys.path.insert(0, BOT_DIR)
+os.environ["JAM_TRACKER_DB_URL"] = f"sqlite:///{DB_FILE}"
+
+account_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def db_file() -> str:
+    return DB_FILE
+
+
+@pytest.fixture
+def account() -> tuple[int, str]:
+    """
+    A new last.fm account with nothing stored, as (id, username).
+    """
+
+    from data_interface import Session, get_or_create_account
+
+    username: str = f"test_{next(account_numbers)}"
+
+    with Session.begin() as session:
+        created = get_or_create_account(session, username)
+        session.flush()
+        account_id: int = created.id
+
+    return account_id, username
+
+
+def scrobble(title: str, artist: str, timestamp: int, album: str = None) -> dict:
+    return {
+        "title": title,
+        "artist": artist,
+        "album": album,
+        "lfm_url": None,
+        "unix_timestamp": timestamp,
+    }
+
+
+def get_stored(account_id: int) -> list[tuple[int, str, str]]:
+    """
+    Return the account's stored scrobbles as (timestamp, title, artist).
+    """
+
+    from sqlalchemy import text
+
+    from data_interface import Session
+
+    with Session.begin() as session:
+        return session.execute(
+            text(
+                "SELECT unix_timestamp, title, artist FROM scrobble "
+                "WHERE account_id = :account_id ORDER BY unix_timestamp, title"
+            ),
+            {"account_id": account_id},
+        ).all()
@@ -0,0 +1,110 @@
+from sqlalchemy import text
+
+from conftest import get_stored, scrobble
+from data_interface import (
+    LastFMAccount,
+    Session,
+    User,
+    merge_case_duplicate_accounts,
+    store_scrobble_batches,
+    store_user,
+    update_user,
+)
+
+
+def add_account(username: str, discord_id: int, titles: list[str]) -> int:
+    """
+    Store an account under the username exactly as given, the way
+    older versions did, with a linked user and one scrobble per title.
+    """
+
+    with Session.begin() as session:
+        account = LastFMAccount(username=username, scrobble_count=0)
+        session.add(account)
+        session.flush()
+
+        session.add(
+            User(discord_id=discord_id, last_fm_user=username, account_id=account.id)
+        )
+        account_id: int = account.id
+
+    store_scrobble_batches(
+        [
+            (
+                account_id,
+                [
+                    scrobble(title, "Band", 1600000000 + i)
+                    for i, title in enumerate(titles)
+                ],
+            )
+        ]
+    )
+
+    return account_id
+
+
+def test_merge_case_duplicate_accounts():
+    kept: int = add_account("Merge_Me", 9001, ["One", "Two"])
+    dropped: int = add_account("merge_me", 9002, ["Three"])
+
+    assert merge_case_duplicate_accounts()
+
+    with Session.begin() as session:
+        # the account with more scrobbles is kept under the lowercase name
+        assert session.query(LastFMAccount.id, LastFMAccount.username).filter(
+            LastFMAccount.username.in_(["Merge_Me", "merge_me"])
+        ).all() == [(kept, "merge_me")]
+
+        assert {
+            discord_id
+            for (discord_id,) in session.query(User.discord_id).filter_by(
+                account_id=kept
+            )
+        } == {9001, 9002}
+
+        # nothing stored for the dropped account is left behind
+        for table in (
+            "known_track",
+            "play_tally",
+            "month_tally",
+            "scrobble_day",
+            "artist_day",
+        ):
+            assert (
+                session.execute(
+                    text(f"SELECT COUNT(*) FROM {table} WHERE account_id = :id"),
+                    {"id": dropped},
+                ).scalar()
+                == 0
+            )
+
+        session.execute(
+            text("INSERT INTO track_search (track_search) VALUES ('integrity-check')")
+        )
+
+    assert get_stored(dropped) == []
+    assert [title for _, title, _ in get_stored(kept)] == ["One", "Two"]
+
+    # already merged, nothing more to do
+    assert not merge_case_duplicate_accounts()
+
+
+def test_linking_ignores_username_case():
+    assert store_user(9101, "Linked_User")
+    assert store_user(9102, "linked_user")
+
+    # the same account typed differently isn't a change
+    assert not update_user(9101, "LINKED_USER")
+
+    with Session.begin() as session:
+        assert {
+            (discord_id, last_fm_user, username)
+            for discord_id, last_fm_user, username in session.query(
+                User.discord_id, User.last_fm_user, LastFMAccount.username
+            )
+            .join(User.account)
+            .filter(User.discord_id.in_([9101, 9102]))
+        } == {
+            (9101, "linked_user", "linked_user"),
+            (9102, "linked_user", "linked_user"),
+        }
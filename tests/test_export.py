@@ -0,0 +1,58 @@
+import csv
+import gzip
+import random
+
+import export
+from conftest import get_stored, scrobble
+from data_interface import Session, User, store_scrobble_batches
+
+
+def test_export_splits_into_parts(account, tmp_path, monkeypatch):
+    account_id, username = account
+
+    with Session.begin() as session:
+        session.add(User(discord_id=7001, last_fm_user=username, account_id=account_id))
+
+    # random titles so the parts don't compress down to nothing
+    rng = random.Random(1)
+    store_scrobble_batches(
+        [
+            (
+                account_id,
+                [
+                    scrobble(
+                        f"Track {rng.getrandbits(64):x}",
+                        f"Artist {rng.getrandbits(32):x}",
+                        1600000000 + i,
+                        album=f"Album {i % 7}" if i % 3 else None,
+                    )
+                    for i in range(3000)
+                ],
+            )
+        ]
+    )
+
+    # small chunks, and parts small enough that several are needed
+    monkeypatch.setattr(export, "EXPORT_CHUNK_ROWS", 200)
+    part_bytes: int = 16 * 2**10
+    paths: list[str] = export.write_export(7001, str(tmp_path), part_bytes)
+
+    assert len(paths) > 1
+
+    rows: list[list[str]] = []
+    for path in paths:
+        with open(path, "rb") as file:
+            # a part is only closed once it passes the limit, by at
+            # most the one chunk written after the last check
+            assert len(file.read()) < part_bytes + 16 * 2**10
+
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as file:
+            reader = csv.reader(file)
+            assert next(reader) == list(export.EXPORT_COLUMNS)
+            rows += list(reader)
+
+    # every scrobble once, oldest first, across the parts
+    assert [
+        (int(timestamp), title, artist) for timestamp, title, artist, _, _ in rows
+    ] == [tuple(row) for row in get_stored(account_id)]
+    assert rows[0][3] == "" and rows[1][3] == "Album 1"
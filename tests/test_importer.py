@@ -0,0 +1,78 @@
+import calendar
+import json
+
+from conftest import get_stored, scrobble
+from data_interface import store_scrobble_batches
+from importer import import_export, parse_export_date
+
+
+def test_parse_export_date():
+    assert parse_export_date("31 Jan 2021 12:34") == calendar.timegm(
+        (2021, 1, 31, 12, 34, 0)
+    )
+    assert parse_export_date("5 May 2021 00:00") == calendar.timegm(
+        (2021, 5, 5, 0, 0, 0)
+    )
+
+
+def test_same_second_scrobbles(account, tmp_path):
+    account_id, username = account
+
+    path = tmp_path / "export.json"
+    path.write_text(
+        json.dumps(
+            [
+                {"name": "First", "artist": "Band", "date": {"uts": "1600000000"}},
+                {"name": "Second", "artist": "Band", "date": {"uts": "1600000000"}},
+                {"name": "First", "artist": "Band", "date": {"uts": "1600000000"}},
+            ]
+        )
+    )
+
+    # the repeated row is the same scrobble, the other track isn't
+    assert import_export(username, str(path)) == (3, 2)
+
+    # importing it again adds nothing
+    assert import_export(username, str(path)) == (3, 0)
+
+    assert get_stored(account_id) == [
+        (1600000000, "First", "Band"),
+        (1600000000, "Second", "Band"),
+    ]
+
+
+def test_export_overlapping_synced_history(account, tmp_path):
+    account_id, username = account
+
+    # 31 Jan 2021 12:34:00 utc
+    minute: int = calendar.timegm((2021, 1, 31, 12, 34, 0))
+
+    # synced from the api, to the second
+    store_scrobble_batches(
+        [
+            (
+                account_id,
+                [
+                    scrobble("Synced", "Band", minute + 5),
+                    scrobble("Also Synced", "Band", minute + 59),
+                ],
+            )
+        ]
+    )
+
+    path = tmp_path / "export.csv"
+    path.write_text(
+        "Band,Album,Synced,31 Jan 2021 12:34\n"
+        "Band,Album,Also Synced,31 Jan 2021 12:34\n"
+        "Band,Album,Not Synced,31 Jan 2021 12:34\n"
+        "Band,Album,Synced,31 Jan 2021 12:35\n"
+    )
+
+    # only the two not matching a synced scrobble within their minute
+    assert import_export(username, str(path)) == (4, 2)
+    assert get_stored(account_id) == [
+        (minute, "Not Synced", "Band"),
+        (minute + 5, "Synced", "Band"),
+        (minute + 59, "Also Synced", "Band"),
+        (minute + 60, "Synced", "Band"),
+    ]
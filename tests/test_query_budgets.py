@@ -0,0 +1,143 @@
+import asyncio
+import os
+import random
+import sys
+import time
+
+import pytest
+
+import metrics
+from conftest import BOT_DIR
+
+sys.path.insert(0, os.path.join(BOT_DIR, "..", "bench"))
+
+import command_bench as bench  # noqa: E402
+from query_bench import Catalog, populate  # noqa: E402
+
+# the benchmarked user and the background users populate adds after it
+USER_ID: int = bench.BENCH_DISCORD_ID
+SCROBBLES: int = 3000
+BACKGROUND_USERS: int = 5
+
+
+class Member(bench.FakeUser):
+    bot: bool = False
+
+    @property
+    def display_avatar(self) -> bench.FakeAvatar:
+        return self.avatar
+
+
+class Guild:
+    """
+    Just enough of a discord.Guild for the leaderboards.
+    """
+
+    def __init__(self, members: list[Member]):
+        self.name = "test server"
+        self.members = members
+
+    def get_member(self, discord_id: int) -> Member:
+        return next((m for m in self.members if m.id == discord_id), None)
+
+
+@pytest.fixture(scope="module")
+def stand_ins(db_file):
+    """
+    Seed the database like the command benchmark does and serve
+    last.fm, spotify and images locally. Yields the cog factory and
+    the image url builder.
+    """
+
+    server = bench.StandInServer(0, 0, 0)
+    base_url: str = server.start()
+
+    import data_interface
+
+    populate(
+        db_file,
+        Catalog(random.Random(1)),
+        [SCROBBLES],
+        BACKGROUND_USERS,
+        end=int(time.time()),
+    )
+    data_interface.rebuild_stats()
+
+    # the bot loads its font relative to its own folder
+    cwd: str = os.getcwd()
+    os.chdir(BOT_DIR)
+
+    yield bench.install_stand_ins(base_url), server.image_url
+
+    os.chdir(cwd)
+
+
+def get_budgeted_commands(cog, other: Member) -> dict:
+    """
+    Map a name for every command with a query budget to a coroutine
+    factory taking a context.
+    """
+
+    return {
+        **bench.get_commands(cog),
+        "scrobbles": lambda ctx: cog.scrobbles.callback(cog, ctx, None),
+        "heatmap": lambda ctx: cog.heatmap.callback(cog, ctx, None, "overall"),
+        "streak": lambda ctx: cog.streak.callback(cog, ctx, None, None),
+        "artist streak": lambda ctx: cog.streak.callback(cog, ctx, None, "Artist 0"),
+        "milestone": lambda ctx: cog.milestone.callback(cog, ctx, 100, None),
+        "wrapped": lambda ctx: cog.wrapped.callback(cog, ctx, None, None),
+        "export": lambda ctx: cog.export.callback(cog, ctx),
+        "whoknows artist": lambda ctx: cog.whoknows_artist.callback(
+            cog, ctx, "Artist 0"
+        ),
+        "whoknows album": lambda ctx: cog.whoknows_album.callback(
+            cog, ctx, "Artist 0", "Artist 0 Album 0"
+        ),
+        "whoknows track": lambda ctx: cog.whoknows_track.callback(
+            cog, ctx, "Artist 0", "Artist 0 Track 0"
+        ),
+        "compare": lambda ctx: cog.compare.callback(cog, ctx, other, None),
+        "compatible": lambda ctx: cog.compatible.callback(cog, ctx, None),
+    }
+
+
+def run_command(stand_ins, name: str) -> metrics.CommandTimer:
+    make_cog, image_url = stand_ins
+
+    members: list[Member] = [
+        Member(discord_id, f"member_{discord_id}", image_url(str(discord_id)))
+        for discord_id in range(USER_ID, USER_ID + BACKGROUND_USERS + 1)
+    ]
+
+    async def run() -> metrics.CommandTimer:
+        from lfm import guilds
+
+        cog = make_cog()
+        ctx = bench.FakeContext(members[0], guilds[0])
+        ctx.guild = Guild(members)
+
+        try:
+            timer: metrics.CommandTimer = metrics.start_command(name)
+            await get_budgeted_commands(cog, members[1])[name](ctx)
+            timer.stop()
+
+        finally:
+            cog.cog_unload()
+            await cog.lastfm.client.close()
+
+        assert ctx.responses, f"{name} finished without responding"
+        return timer
+
+    return asyncio.run(run())
+
+
+COMMANDS: list[str] = list(get_budgeted_commands(None, None))
+
+
+@pytest.mark.parametrize("name", COMMANDS)
+def test_command_stays_within_query_budget(stand_ins, monkeypatch, name):
+    # going over budget raises QueryBudgetExceeded instead of printing
+    monkeypatch.setattr(metrics, "strict_query_budgets", True)
+
+    timer: metrics.CommandTimer = run_command(stand_ins, name)
+    assert timer.queries > 0
@@ -0,0 +1,148 @@
+import asyncio
+import bisect
+import random
+
+from sqlalchemy import text
+
+import reconcile
+from conftest import get_stored
+from data_interface import Session, store_scrobble_batches
+from ingest import ScrobbleWriter
+from lfm_client import RecentTrack, RecentTracksPage
+
+
+class StandInClient:
+    """
+    Answers recent tracks requests from a fixed history, newest
+    first like last.fm, counting the requests made.
+    """
+
+    def __init__(self, history: list[RecentTrack]):
+        self.history = sorted(history, key=lambda track: track.unix_timestamp)
+        self.timestamps: list[int] = [track.unix_timestamp for track in self.history]
+        self.requests: int = 0
+
+    async def get_recent_tracks(
+        self, username, from_timestamp=None, to_timestamp=None, page=1, limit=200
+    ) -> RecentTracksPage:
+        self.requests += 1
+
+        low: int = bisect.bisect_left(self.timestamps, from_timestamp or 0)
+        high: int = bisect.bisect_right(self.timestamps, to_timestamp or 2**40)
+        tracks: list[RecentTrack] = self.history[low:high][::-1]
+
+        return RecentTracksPage(
+            tracks[(page - 1) * limit : page * limit],
+            page,
+            max(1, -(-len(tracks) // limit)),
+            len(tracks),
+        )
+
+    async def iter_recent_tracks(
+        self, username, from_timestamp=None, to_timestamp=None, concurrency=1
+    ):
+        page: RecentTracksPage = await self.get_recent_tracks(
+            username, from_timestamp, to_timestamp
+        )
+        yield page
+
+        for number in range(2, page.total_pages + 1):
+            yield await self.get_recent_tracks(
+                username, from_timestamp, to_timestamp, number
+            )
+
+
+def make_history() -> list[RecentTrack]:
+    rng = random.Random(3)
+    history: list[RecentTrack] = []
+    timestamp: int = 1500000000
+
+    for i in range(4000):
+        timestamp += rng.randint(60, 5000)
+        history.append(
+            RecentTrack(
+                f"Track {i % 89}",
+                f"Artist {i % 13}",
+                None,
+                None,
+                None,
+                timestamp,
+                False,
+            )
+        )
+
+        # now and then a second track in the very same second
+        if i % 500 == 250:
+            history.append(
+                RecentTrack(
+                    f"Other {i}", "Artist 0", None, None, None, timestamp, False
+                )
+            )
+
+    return history
+
+
+def reconcile_once(client, account_id: int, username: str, max_checks: int) -> int:
+    async def run() -> int:
+        async with ScrobbleWriter() as writer:
+            return await reconcile.reconcile_account(
+                client, writer, account_id, username, max_checks
+            )
+
+    return asyncio.run(run())
+
+
+def get_pending(account_id: int) -> list[tuple[int, int]]:
+    with Session.begin() as session:
+        return session.execute(
+            text(
+                "SELECT first_day, end_day FROM reconcile_range "
+                "WHERE account_id = :account_id"
+            ),
+            {"account_id": account_id},
+        ).all()
+
+
+def test_reconcile_fills_holes(account, monkeypatch):
+    account_id, username = account
+    history: list[RecentTrack] = make_history()
+
+    # a block of pages, scattered singles and the same-second tracks are missing
+    missing: set[int] = {
+        i
+        for i, track in enumerate(history)
+        if 1500 <= i < 1800 or i % 701 == 5 or track.title.startswith("Other")
+    }
+    store_scrobble_batches(
+        [
+            (
+                account_id,
+                [
+                    reconcile.track_to_row(track)
+                    for i, track in enumerate(history)
+                    if i not in missing
+                ],
+            )
+        ]
+    )
+
+    # small enough that the ranges have to be split a few times
+    monkeypatch.setattr(reconcile, "REFETCH_SCROBBLES", 100)
+    client = StandInClient(history)
+
+    # out of checks partway, what's left is kept for the next run
+    filled: int = reconcile_once(client, account_id, username, 3)
+    assert get_pending(account_id)
+
+    while get_pending(account_id):
+        filled += reconcile_once(client, account_id, username, 3)
+
+    assert filled == len(missing)
+    assert get_stored(account_id) == sorted(
+        (track.unix_timestamp, track.title, track.artist) for track in history
+    )
+
+    # nothing left to find, the whole history is compared in one request
+    client.requests = 0
+    assert reconcile_once(client, account_id, username, 3) == 0
+    assert client.requests == 1
@@ -0,0 +1,86 @@
+from conftest import scrobble
+from data_interface import Session, get_or_create_account, store_scrobble_batches
+from track_search import find_track, get_candidates, normalize_title
+
+
+def store_tracks(account_id: int, tracks: list[tuple[str, str]]) -> None:
+    store_scrobble_batches(
+        [
+            (
+                account_id,
+                [
+                    scrobble(title, artist, 1600000000 + i)
+                    for i, (title, artist) in enumerate(tracks)
+                ],
+            )
+        ]
+    )
+
+
+def test_normalize_title():
+    assert normalize_title("Song (feat. Someone)") == "song"
+    assert normalize_title("Song - Remastered 2011") == "song"
+    assert normalize_title("Don't Stop!") == "don t stop"
+
+
+def test_find_track(account):
+    account_id, _ = account
+    store_tracks(
+        account_id,
+        [
+            ("Love Story", "Taylor Swift"),
+            ("Yesterday - Remastered 2009", "The Beatles"),
+            ("Intro", "The xx"),
+            ("Intro", "M83"),
+        ],
+    )
+
+    with Session.begin() as session:
+        # version tags, typos and a search that's just the first word
+        assert find_track(session, account_id, "Yesterday") == (
+            "Yesterday - Remastered 2009",
+            "The Beatles",
+        )
+        assert find_track(session, account_id, "Love Stroy") == (
+            "Love Story",
+            "Taylor Swift",
+        )
+        assert find_track(session, account_id, "love") == (
+            "Love Story",
+            "Taylor Swift",
+        )
+
+        # the artist picks between tracks sharing a title
+        assert find_track(session, account_id, "Intro", "M83") == ("Intro", "M83")
+        assert find_track(session, account_id, "Intro", "the xx") == (
+            "Intro",
+            "The xx",
+        )
+
+        assert find_track(session, account_id, "Something Else Entirely") is None
+
+
+def test_short_search_matches_wildcards_literally(account):
+    account_id, _ = account
+    store_tracks(account_id, [("a_b", "Band"), ("axb", "Band"), ("50%", "Band")])
+
+    with Session.begin() as session:
+        assert get_candidates(session, account_id, "_") == [("a_b", "Band")]
+        assert get_candidates(session, account_id, "%") == [("50%", "Band")]
+
+
+def test_find_track_only_searches_the_account(account):
+    account_id, _ = account
+    store_tracks(account_id, [("Only Mine", "Band")])
+
+    with Session.begin() as session:
+        other = get_or_create_account(session, f"{account[1]}_other")
+        session.flush()
+        other_id: int = other.id
+
+    store_tracks(other_id, [("Not Yours", "Band")])
+
+    with Session.begin() as session:
+        assert find_track(session, account_id, "Only Mine") == ("Only Mine", "Band")
+        assert find_track(session, account_id, "Not Yours") is None
+        assert find_track(session, other_id, "Not Yours") == ("Not Yours", "Band")